@@ -0,0 +1,390 @@
+# 可插拔的agent后端：规则型启发式、随机策略、脚本，以及调用LLM的默认后端。
+# Pluggable agent backends. Any seat can use any backend, e.g.
+#     GameEngine(10, distribution, agents=HeuristicAgent())              # 所有座位
+#     GameEngine(10, distribution, agents={0: RandomAgent(), 3: HeuristicAgent()})  # 其他座位调用LLM
+# 非LLM后端不需要网络和openai，单核每秒可以跑上千局完整对局，用于测试和平衡性研究。
+
+import random
+import re
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from game_engine import LLMCall
+    from game_state import WitchState
+    from player_agent import Player
+
+_CLAIM_RE = re.compile(r"checked player (\d+): (Good|Bad)")
+_SUSPECT_RE = re.compile(r"suspect player (\d+)")
+
+
+class AgentContext:
+    """
+    引擎交给后端的信息，只包含该玩家身份可以知道的内容：
+    公开历史、存活玩家、狼人的同伴、预言家自己的查验结果、女巫自己的药水状态。
+    """
+    __slots__ = ("round", "phase", "player", "targets", "alive", "public", "teammates",
+                 "seer_checks", "witch", "rng", "memo")
+
+    def __init__(self, round_num: int, phase: str, player: "Player", targets: List[int], alive: List[int],
+                 public: List[Dict], teammates: Optional[List[int]] = None, seer_checks: Optional[List[Dict]] = None,
+                 witch: Optional["WitchState"] = None, rng: Optional[random.Random] = None,
+                 memo: Optional[Dict] = None):
+        self.round = round_num
+        self.phase = phase
+        self.player = player
+        self.targets = targets  # 本次行动的可选目标；女巫解药时为[被袭击的玩家]
+        self.alive = alive
+        self.public = public
+        self.teammates = teammates
+        self.seer_checks = seer_checks
+        self.witch = witch
+        self.rng = rng or random.Random()
+        self.memo = memo if memo is not None else {}
+
+    @property
+    def player_id(self) -> int:
+        return self.player.player_id
+
+    def board(self) -> "PublicBoard":
+        """
+        对公开历史的分析，同一局内所有座位共享，公开事件增加时增量更新。
+        """
+        board = self.memo.get("board")
+        if board is None:
+            board = self.memo["board"] = PublicBoard()
+        board.update(self.public)
+        return board
+
+    def suspicion(self) -> Dict[int, float]:
+        """
+        当前存活玩家在好人视角下的怀疑分数，按(公开事件数, 存活玩家)缓存。
+        """
+        board = self.board()
+        key = (board.size, tuple(self.alive))
+        cached = self.memo.get("suspicion")
+        if cached is None or cached[0] != key:
+            cached = self.memo["suspicion"] = (key, {pid: board.suspicion(pid, self.alive) for pid in self.alive})
+        return cached[1]
+
+
+class PublicBoard:
+    """
+    从公开历史中提取的信息：跳预言家的声明、发言中的怀疑、投票和出局情况。
+    只识别启发式发言的固定句式（"I checked player X: Bad"、"I suspect player X"），LLM的自由发言不影响。
+    """
+    __slots__ = ("size", "claims", "suspects", "last_votes", "votes_received", "eliminated", "_speech_round")
+
+    def __init__(self):
+        self.size = 0  # 已处理的公开事件数
+        self.claims: Dict[int, Dict[int, str]] = {}  # 声称预言家的玩家 -> {被查验者: Good/Bad}
+        self.suspects: Dict[int, int] = {}  # 最近一轮发言中被怀疑的次数
+        self.last_votes: Dict[int, int] = {}  # 最近一次投票：投票者 -> 目标
+        self.votes_received: Dict[int, int] = {}  # 累计得票
+        self.eliminated: List[int] = []
+        self._speech_round = None
+
+    def update(self, public: List[Dict]):
+        for event in public[self.size:]:
+            phase = event.get("phase")
+            if phase == "day_speech":
+                if event.get("round") != self._speech_round:
+                    self._speech_round = event.get("round")
+                    self.suspects = {}
+                for speech in event.get("speeches", []):
+                    text = str(speech.get("speech", ""))
+                    for target, result in _CLAIM_RE.findall(text):
+                        self.claims.setdefault(speech["player_id"], {})[int(target)] = result
+                    for target in _SUSPECT_RE.findall(text):
+                        self.suspects[int(target)] = self.suspects.get(int(target), 0) + 1
+            elif phase == "day_vote":
+                self.last_votes = {int(voter): int(target) for voter, target in event.get("votes", {}).items()}
+                for target in self.last_votes.values():
+                    self.votes_received[target] = self.votes_received.get(target, 0) + 1
+                if event.get("eliminated") is not None:
+                    self.eliminated.append(event["eliminated"])
+        self.size = len(public)
+
+    def suspicion(self, player_id: int, alive: List[int]) -> float:
+        """
+        好人视角下对某个玩家的怀疑程度。只采信仍然存活、且是唯一跳预言家的玩家的查验结果。
+        """
+        score = self.suspects.get(player_id, 0) + 0.5 * self.votes_received.get(player_id, 0)
+        claimers = [c for c in self.claims if c in alive]
+        if len(claimers) == 1:
+            result = self.claims[claimers[0]].get(player_id)
+            if result == "Bad":
+                score += 10
+            elif result == "Good":
+                score -= 10
+        return score
+
+
+class AgentBackend:
+    """
+    agent后端接口。respond(call, context)返回与LLM回复同格式的文本，由引擎按原有逻辑解析，
+    因此任意后端可以互换。子类通常只需实现按阶段拆分的kill/check/save/poison/shoot/speak/vote。
+    后端对象可以被多个座位、多个线程共享，状态应放在context.memo中。
+    """
+    name = "agent"
+
+    def respond(self, call: "LLMCall", context: AgentContext) -> str:
+        phase = call.phase
+        if phase == "night_wolf":
+            return str(self.kill(context))
+        if phase == "night_seer":
+            return str(self.check(context))
+        if phase == "night_witch_save":
+            return "yes" if self.save(context) else "no"
+        if phase == "night_witch_poison":
+            target = self.poison(context)
+            return "no" if target is None else str(target)
+        if phase == "hunter_shoot":
+            return str(self.shoot(context))
+        if phase == "day_speech":
+            return self.speak(context)
+        if phase == "day_vote":
+            return str(self.vote(context))
+        raise ValueError(f"unknown phase {phase!r}")
+
+    async def arespond(self, call: "LLMCall", context: AgentContext) -> str:
+        """
+        异步引擎（async_engine.py）使用的接口。本地后端不做I/O，默认直接调用respond。
+        """
+        return self.respond(call, context)
+
+    def kill(self, context: AgentContext) -> int:
+        raise NotImplementedError
+
+    def check(self, context: AgentContext) -> int:
+        raise NotImplementedError
+
+    def save(self, context: AgentContext) -> bool:
+        raise NotImplementedError
+
+    def poison(self, context: AgentContext) -> Optional[int]:
+        raise NotImplementedError
+
+    def shoot(self, context: AgentContext) -> int:
+        raise NotImplementedError
+
+    def speak(self, context: AgentContext) -> str:
+        raise NotImplementedError
+
+    def vote(self, context: AgentContext) -> int:
+        raise NotImplementedError
+
+
+class RandomAgent(AgentBackend):
+    """
+    随机策略：目标均匀随机，以给定概率使用解药/毒药。
+    """
+    name = "random"
+
+    def __init__(self, save_prob: float = 0.5, poison_prob: float = 0.2):
+        self.save_prob = save_prob
+        self.poison_prob = poison_prob
+
+    def kill(self, context: AgentContext) -> int:
+        return context.rng.choice(context.targets)
+
+    check = shoot = kill
+
+    def save(self, context: AgentContext) -> bool:
+        return context.rng.random() < self.save_prob
+
+    def poison(self, context: AgentContext) -> Optional[int]:
+        if context.targets and context.rng.random() < self.poison_prob:
+            return context.rng.choice(context.targets)
+        return None
+
+    def speak(self, context: AgentContext) -> str:
+        others = [pid for pid in context.alive if pid != context.player_id]
+        if not others:
+            return "I have nothing to add."
+        return f"I suspect player {context.rng.choice(others)}."
+
+    def vote(self, context: AgentContext) -> int:
+        others = [pid for pid in context.targets if pid != context.player_id]
+        return context.rng.choice(others or context.targets)
+
+
+class HeuristicAgent(RandomAgent):
+    """
+    按身份的规则型策略：
+    - 预言家优先查验最可疑且未查验过的玩家，查到狼人后跳身份公布全部查验结果
+    - 好人投票给最可疑的玩家（唯一预言家的查验结果、发言中的怀疑、历史得票）
+    - 狼人夜里优先刀跳身份的预言家，白天跟随好人的怀疑投给非同伴
+    - 女巫首夜和预言家被刀时用解药，有可信的查杀时用毒药
+    - 猎人带走最可疑的玩家
+    """
+    name = "heuristic"
+
+    def __init__(self, poison_threshold: float = 5.0):
+        super().__init__()
+        self.poison_threshold = poison_threshold
+
+    def _most_suspicious(self, context: AgentContext, candidates: List[int]) -> int:
+        scores = context.suspicion()
+        if context.seer_checks:
+            # 预言家自己的查验结果优先于公开信息
+            scores = dict(scores)
+            for check in context.seer_checks:
+                scores[check["checked_id"]] = 100.0 if check["result"] == "Bad" else -100.0
+        values = [scores.get(pid, 0.0) for pid in candidates]
+        top = max(values)
+        return context.rng.choice([pid for pid, value in zip(candidates, values) if value == top])
+
+    def _good_candidates(self, context: AgentContext, candidates: List[int]) -> List[int]:
+        # 狼人只在非同伴中选择
+        if context.teammates is not None:
+            return [pid for pid in candidates if pid not in context.teammates] or candidates
+        return [pid for pid in candidates if pid != context.player_id] or candidates
+
+    def kill(self, context: AgentContext) -> int:
+        board = context.board()
+        claimers = [pid for pid in board.claims if pid in context.targets]
+        if claimers:
+            return context.rng.choice(claimers)
+        # 其次刀怀疑过狼人的玩家
+        return self._wolf_pick(context, context.targets)
+
+    def _wolf_pick(self, context: AgentContext, candidates: List[int]) -> int:
+        board = context.board()
+        threat = {}
+        for voter, target in board.last_votes.items():
+            if target in context.teammates and voter in candidates:
+                threat[voter] = threat.get(voter, 0) + 1
+        if threat:
+            top = max(threat.values())
+            return context.rng.choice([pid for pid, n in threat.items() if n == top])
+        return context.rng.choice(candidates)
+
+    def check(self, context: AgentContext) -> int:
+        checked = {c["checked_id"] for c in context.seer_checks or []}
+        unchecked = [pid for pid in context.targets if pid not in checked]
+        return self._most_suspicious(context, unchecked or context.targets)
+
+    def save(self, context: AgentContext) -> bool:
+        attacked = context.targets[0] if context.targets else None
+        if attacked is None:
+            return False
+        if context.round == 1 or attacked == context.player_id:
+            return True
+        return attacked in context.board().claims
+
+    def poison(self, context: AgentContext) -> Optional[int]:
+        if not context.targets:
+            return None
+        target = self._most_suspicious(context, context.targets)
+        if context.suspicion().get(target, 0.0) >= self.poison_threshold:
+            return target
+        return None
+
+    def shoot(self, context: AgentContext) -> int:
+        return self._most_suspicious(context, context.targets)
+
+    def speak(self, context: AgentContext) -> str:
+        others = [pid for pid in context.alive if pid != context.player_id]
+        if not others:
+            return "I have nothing to add."
+        if context.seer_checks and (context.round >= 2 or any(c["result"] == "Bad" for c in context.seer_checks)):
+            checks = ", ".join(f"I checked player {c['checked_id']}: {c['result']}" for c in context.seer_checks)
+            return f"I am the seer. {checks}."
+        if context.teammates is not None:
+            target = self._wolf_pick(context, self._good_candidates(context, others))
+        else:
+            target = self._most_suspicious(context, others)
+        return f"I suspect player {target}."
+
+    def vote(self, context: AgentContext) -> int:
+        candidates = self._good_candidates(context, context.targets)
+        if context.teammates is not None:
+            # 狼人优先投跳身份的预言家，否则跟随好人最怀疑的玩家
+            claimers = [pid for pid in context.board().claims if pid in candidates]
+            if claimers:
+                return context.rng.choice(claimers)
+        return self._most_suspicious(context, candidates)
+
+
+class ScriptedAgent(AgentBackend):
+    """
+    按脚本回复，用于复现特定局面和编写测试。script的键可以是(轮次, 阶段, 座位)、(轮次, 阶段)或阶段名，值可以是：
+    回复文本、玩家id、True/False（解药）、None（不用毒药），值的列表（按出现顺序依次使用），
+    或函数f(context)返回上述之一。脚本没有覆盖的调用交给fallback（默认RandomAgent）。
+    """
+    name = "scripted"
+
+    def __init__(self, script: Dict, fallback: Optional[AgentBackend] = None):
+        self.script = script
+        self.fallback = fallback or RandomAgent()
+
+    def respond(self, call: "LLMCall", context: AgentContext) -> str:
+        key = (context.round, call.phase, context.player_id)
+        if key not in self.script:
+            key = (context.round, call.phase)
+        if key not in self.script:
+            key = call.phase
+        if key not in self.script:
+            return self.fallback.respond(call, context)
+        value = self.script[key]
+        if isinstance(value, list):
+            # 列表按座位分别消费
+            index_key = ("scripted", id(self), context.player_id, key)
+            index = context.memo.get(index_key, 0)
+            if index >= len(value):
+                return self.fallback.respond(call, context)
+            context.memo[index_key] = index + 1
+            value = value[index]
+        if callable(value):
+            value = value(context)
+        if isinstance(value, bool):
+            return "yes" if value else "no"
+        if value is None:
+            return "no"
+        return str(value)
+
+
+class LLMAgent(AgentBackend):
+    """
+    调用LLM的后端，与不指定后端的座位行为相同；用于在agents字典中显式混合LLM与其他后端。
+    """
+    name = "llm"
+
+    def respond(self, call: "LLMCall", context: AgentContext) -> str:
+        # 把Completion挂在call上，引擎的埋点从中读取用量
+        call.completion = call.player.complete(call.prompt, call.profile, call.choices, call.model, call.on_token)
+        return call.completion.text
+
+    async def arespond(self, call: "LLMCall", context: AgentContext) -> str:
+        call.completion = await call.player.acomplete(call.prompt, call.profile, call.choices, call.model,
+                                                      call.on_token)
+        return call.completion.text
+
+
+AGENTS: Dict[str, Callable[[], AgentBackend]] = {
+    "heuristic": HeuristicAgent,
+    "random": RandomAgent,
+    "llm": LLMAgent,
+}
+
+
+def make_agent(name: str) -> AgentBackend:
+    """
+    按名字创建后端（heuristic / random / llm）。
+    """
+    try:
+        return AGENTS[name]()
+    except KeyError:
+        raise ValueError(f"unknown agent backend {name!r}, expected one of {sorted(AGENTS)}") from None
+
+
+def assign_agents(names: List[str], num_players: int) -> Union[AgentBackend, Dict[int, AgentBackend], None]:
+    """
+    把后端名列表循环分配到各个座位，同名后端共享一个实例。"llm"座位不放入字典（直接调用LLM）。
+    """
+    if not names:
+        return None
+    backends = {name: make_agent(name) for name in set(names)}
+    if len(backends) == 1 and names[0] != "llm":
+        return backends[names[0]]
+    return {i: backends[names[i % len(names)]] for i in range(num_players) if names[i % len(names)] != "llm"}
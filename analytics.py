@@ -0,0 +1,408 @@
+# 跨对局的列式分析：流式解析日志，把投票、淘汰、夜晚行动、预言家查验装入NumPy列，再做向量化统计。
+# Vectorized cross-game analytics over game logs.
+#
+# 运行：python analytics.py game_log_*.json tournament_out/games/*.cjson.gz --workers 8
+
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from decoding import parse_poison
+from roles import Role, get_role_info
+
+ROLES = list(Role)
+ROLE_CODE = {role.value: code for code, role in enumerate(ROLES)}
+WOLF = ROLE_CODE[Role.WOLF.value]
+WOLF_CAMP = get_role_info(Role.WOLF)["camp"]
+RESULT_CODE = {"Villagers win!": 0, "Wolves win!": 1}
+PHASES = ["night_wolf", "night_seer", "night_witch_save", "night_witch_poison", "hunter_shoot", "day_speech", "day_vote"]
+PHASE_CODE = {phase: code for code, phase in enumerate(PHASES)}
+# 淘汰原因
+CAUSES = ["vote", "wolf", "poison", "hunter"]
+
+_CANDIDATES_RE = re.compile(r'(?:candidates=|Alive players[^:\[]*: |存活玩家有：)\[([\d, ]*)\]')
+_NUMBER_RE = re.compile(r'\d+')
+_MODEL_FROM_NAME = re.compile(r'game_log_(.+?)\.(?:c?json)')
+_STREAM_SECTIONS = ("logs", "detailed_prompts")
+
+
+def iter_log_sections(path: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, object]]:
+    """
+    流式解析GameLogger.save()格式的日志，不把整个文件读入内存：
+    logs和detailed_prompts逐条产出 (section, item)，其他顶层键整体产出 (key, value)。
+    紧凑格式（compact_log）本身很小，直接整体读取并还原。
+    """
+    if path.endswith(".gz") or ".cjson" in path:
+        from compact_log import load_log
+        for key, value in load_log(path).items():
+            if key in _STREAM_SECTIONS:
+                for item in value:
+                    yield key, item
+            else:
+                yield key, value
+        return
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            data = f.read(chunk_size)
+            if not data:
+                eof = True
+            buf = buf[pos:] + data
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # 数字等值可能恰好被缓冲区截断，到达缓冲区末尾时读更多再确认
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(char: str):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] != char:
+                raise ValueError(f"{path}: expected {char!r}")
+            pos += 1
+
+        fill()
+        expect("{")
+        while True:
+            skip_ws()
+            if buf[pos] == "}":
+                return
+            key = decode()
+            expect(":")
+            skip_ws()
+            if key in _STREAM_SECTIONS and buf[pos] == "[":
+                pos += 1
+                skip_ws()
+                if buf[pos] == "]":
+                    pos += 1
+                else:
+                    while True:
+                        skip_ws()
+                        yield key, decode()
+                        skip_ws()
+                        if buf[pos] == ",":
+                            pos += 1
+                            continue
+                        expect("]")
+                        break
+            else:
+                yield key, decode()
+            skip_ws()
+            if buf[pos] == ",":
+                pos += 1
+
+
+def prompt_candidates(prompt: str) -> Optional[List[int]]:
+    """
+    从prompt中读出候选玩家id列表，找不到时返回None。候选列表总在历史JSON之前，只在前半部分查找。
+    """
+    head = prompt.split("Game history:", 1)[0]
+    match = _CANDIDATES_RE.search(head)
+    if not match or not match.group(1).strip():
+        return None
+    return [int(x) for x in match.group(1).split(",")]
+
+
+def _game_rows(path: str, include_prompts: bool) -> dict:
+    """
+    解析一局日志为若干行记录（Python列表），由parse_files转换为数组。
+    """
+    roles: Dict[int, int] = {}
+    models: Dict[int, str] = {}
+    result = None
+    votes, elims, nights, checks, prompts = [], [], [], [], []
+    rounds = 0
+    prev_save_used = False
+    for section, item in iter_log_sections(path):
+        if section == "roles":
+            roles = {int(pid): ROLE_CODE.get(value, -1) for pid, value in item.items()}
+        elif section == "models":
+            models = {int(pid): model for pid, model in item.items()}
+        elif section == "result":
+            result = RESULT_CODE.get(item, -1)
+        elif section == "logs":
+            phase = item.get("phase")
+            round_num = item.get("round") or 0
+            rounds = max(rounds, round_num)
+            if phase == "day_vote":
+                for voter, target in item.get("votes", {}).items():
+                    votes.append((round_num, int(voter), int(target)))
+                # 大厅模式一天可能淘汰多人（eliminated_all）
+                eliminated_all = item.get("eliminated_all")
+                if eliminated_all is None and item.get("eliminated") is not None:
+                    eliminated_all = [item["eliminated"]]
+                for eliminated in eliminated_all or []:
+                    elims.append((round_num, int(eliminated), 0))
+            elif phase == "night" and "kills" in item:
+                # 大厅模式（lobby.py）：每个狼群的目标、每次查验、每瓶毒药各占一行
+                killed = set(item.get("killed") or [])
+                for target in dict.fromkeys(int(kill["target"]) for kill in item["kills"]):
+                    nights.append((round_num, target if target in killed else -1,
+                                   -1 if target in killed else target, -1, -1))
+                    if target in killed:
+                        elims.append((round_num, target, 1))
+                for poisoned in item.get("poisoned") or []:
+                    nights.append((round_num, -1, -1, int(poisoned), -1))
+                    elims.append((round_num, int(poisoned), 2))
+                for check in item.get("seer_checks") or []:
+                    nights.append((round_num, -1, -1, -1, int(check["checked_id"])))
+                    checks.append((round_num, int(check["checked_id"]), int(check.get("result") == "Bad")))
+            elif phase == "night":
+                witch = item.get("witch_action") or {}
+                save_used = bool(witch.get("save_used"))
+                # save_used是累计标记，只有从False变为True的那一晚才是真正用了解药
+                saved = witch.get("save_target") if save_used and not prev_save_used else None
+                prev_save_used = prev_save_used or save_used
+                poisoned = witch.get("poison_target")
+                check = item.get("seer_check") or {}
+                nights.append((round_num,
+                               -1 if item.get("killed") is None else int(item["killed"]),
+                               -1 if saved is None else int(saved),
+                               -1 if poisoned is None else int(poisoned),
+                               int(check.get("checked_id", -1)) if check else -1))
+                if check:
+                    checks.append((round_num, int(check["checked_id"]), int(check.get("result") == "Bad")))
+                if item.get("killed") is not None:
+                    elims.append((round_num, int(item["killed"]), 1))
+                if poisoned is not None:
+                    elims.append((round_num, int(poisoned), 2))
+            elif phase == "hunter_shoot":
+                elims.append((round_num, int(item["target"]), 3))
+        elif section == "detailed_prompts" and include_prompts:
+            phase = item.get("phase")
+            response = item.get("response")
+            candidates = prompt_candidates(item.get("prompt", "")) if phase != "day_speech" else None
+            fallback, first = 0, 0
+            if candidates:
+                if isinstance(response, int):
+                    # 投票回复记录的是解析后的id，无法区分回退，只记录是否等于第一个候选
+                    first = int(response == candidates[0])
+                else:
+                    text = str(response)
+                    mentioned = any(int(n) in candidates for n in _NUMBER_RE.findall(text))
+                    if phase == "night_witch_poison":
+                        # 毒药回复"no"是正常放弃；提到了候选id却无法确定目标时按不用毒药处理
+                        fallback = int(mentioned and parse_poison(text, candidates) is None)
+                    else:
+                        fallback = int(not mentioned)
+            prompts.append((int(item.get("round", 0)), PHASE_CODE.get(phase, -1), int(item.get("player_id", -1)),
+                            int(bool(candidates)), fallback, first, len(item.get("prompt", ""))))
+    if not models:
+        match = _MODEL_FROM_NAME.search(os.path.basename(path))
+        default_model = match.group(1) if match else "unknown"
+        models = {pid: default_model for pid in roles}
+    seats = sorted(roles)
+    return {
+        "path": path,
+        "result": -1 if result is None else result,
+        "rounds": rounds,
+        "players": [(pid, roles[pid], models.get(pid, "unknown")) for pid in seats],
+        "votes": votes, "elims": elims, "nights": nights, "checks": checks, "prompts": prompts,
+    }
+
+
+def _parse_chunk(args) -> List[dict]:
+    paths, include_prompts = args
+    rows = []
+    for path in paths:
+        try:
+            rows.append(_game_rows(path, include_prompts))
+        except Exception as e:
+            rows.append({"path": path, "error": f"{type(e).__name__}: {e}"})
+    return rows
+
+
+def _columns(rows: List[tuple], names: List[str]) -> Dict[str, np.ndarray]:
+    if not rows:
+        return {name: np.zeros(0, dtype=np.int64) for name in names}
+    array = np.asarray(rows, dtype=np.int64)
+    return {name: array[:, i] for i, name in enumerate(names)}
+
+
+class GameTable:
+    """
+    多局日志的列式表示。每张表是列名 -> 等长的NumPy数组，所有表都带game列（对局下标）。
+    games:    result(0好人胜/1狼人胜/-1未结束), rounds, players
+    players:  game, seat, role, model(下标见self.models), won
+    votes:    game, round, voter, target, voter_role, target_role, voter_model
+    elims:    game, round, player, role, cause(下标见CAUSES)
+    nights:   game, round, killed, saved, poisoned, checked（-1表示无）
+    checks:   game, round, target, bad
+    prompts:  game, round, phase(下标见PHASES), player, has_candidates, fallback, first_candidate, prompt_chars
+    """
+    def __init__(self, rows: List[dict]):
+        self.errors = [r for r in rows if "error" in r]
+        rows = [r for r in rows if "error" not in r]
+        self.paths = [r["path"] for r in rows]
+        self.games = {
+            "result": np.array([r["result"] for r in rows], dtype=np.int64),
+            "rounds": np.array([r["rounds"] for r in rows], dtype=np.int64),
+            "players": np.array([len(r["players"]) for r in rows], dtype=np.int64),
+        }
+        model_names = [model for r in rows for _, _, model in r["players"]]
+        self.models, model_codes = np.unique(np.array(model_names, dtype=object).astype(str), return_inverse=True) \
+            if model_names else (np.array([], dtype=str), np.zeros(0, dtype=np.int64))
+        self.players = _columns([(g, seat, role) for g, r in enumerate(rows) for seat, role, _ in r["players"]],
+                                ["game", "seat", "role"])
+        self.players["model"] = np.asarray(model_codes, dtype=np.int64)
+        # 查表：(game, seat) -> 全局玩家行号
+        offsets = np.concatenate([[0], np.cumsum(self.games["players"])])[:-1] if rows else np.zeros(0, dtype=np.int64)
+        role_of = self.players["role"]
+        model_of = self.players["model"]
+        result = self.games["result"]
+        is_wolf = role_of == WOLF
+        winner_is_wolf = result[self.players["game"]] == 1 if rows else np.zeros(0, dtype=bool)
+        finished = result[self.players["game"]] >= 0 if rows else np.zeros(0, dtype=bool)
+        self.players["won"] = np.where(finished, (is_wolf == winner_is_wolf).astype(np.int64), -1)
+
+        def with_game(key, names):
+            table = _columns([(g,) + row for g, r in enumerate(rows) for row in r[key]], ["game"] + names)
+            return table
+
+        def lookup(table, column):
+            index = offsets[table["game"]] + table[column] if len(table["game"]) else np.zeros(0, dtype=np.int64)
+            return index
+
+        self.votes = with_game("votes", ["round", "voter", "target"])
+        self.votes["voter_role"] = role_of[lookup(self.votes, "voter")]
+        self.votes["target_role"] = role_of[lookup(self.votes, "target")]
+        self.votes["voter_model"] = model_of[lookup(self.votes, "voter")]
+        self.elims = with_game("elims", ["round", "player", "cause"])
+        self.elims["role"] = role_of[lookup(self.elims, "player")]
+        self.nights = with_game("nights", ["round", "killed", "saved", "poisoned", "checked"])
+        self.checks = with_game("checks", ["round", "target", "bad"])
+        self.prompts = with_game("prompts", ["round", "phase", "player", "has_candidates", "fallback", "first_candidate", "prompt_chars"])
+        self._offsets = offsets
+
+    @staticmethod
+    def _rate(numerator: np.ndarray, denominator: np.ndarray) -> List[Optional[float]]:
+        return [round(float(n) / float(d), 4) if d else None for n, d in zip(numerator, denominator)]
+
+    def metrics(self) -> dict:
+        players, votes, prompts = self.players, self.votes, self.prompts
+        n_roles, n_models = len(ROLES), len(self.models)
+        done = players["won"] >= 0
+        role_games = np.bincount(players["role"][done], minlength=n_roles)
+        role_wins = np.bincount(players["role"][done], weights=players["won"][done], minlength=n_roles)
+        model_games = np.bincount(players["model"][done], minlength=n_models)
+        model_wins = np.bincount(players["model"][done], weights=players["won"][done], minlength=n_models)
+        pair = players["model"][done] * n_roles + players["role"][done]
+        pair_games = np.bincount(pair, minlength=n_models * n_roles)
+        pair_wins = np.bincount(pair, weights=players["won"][done], minlength=n_models * n_roles)
+
+        # 好人投票准确率：好人阵营投给狼人的比例，按轮次和模型分组
+        good = votes["voter_role"] != WOLF
+        hit = (votes["target_role"] == WOLF) & good
+        max_round = int(votes["round"].max()) + 1 if len(votes["round"]) else 1
+        round_votes = np.bincount(votes["round"][good], minlength=max_round)
+        round_hits = np.bincount(votes["round"][good], weights=hit[good], minlength=max_round)
+        model_votes = np.bincount(votes["voter_model"][good], minlength=n_models)
+        model_hits = np.bincount(votes["voter_model"][good], weights=hit[good], minlength=n_models)
+
+        # 女巫：解药救的是好人的比例，毒药毒中狼人的比例
+        nights = self.nights
+        saved_mask = nights["saved"] >= 0
+        poison_mask = nights["poisoned"] >= 0
+        saved_roles = self.players["role"][self._offsets[nights["game"][saved_mask]] + nights["saved"][saved_mask]] \
+            if saved_mask.any() else np.zeros(0, dtype=np.int64)
+        poisoned_roles = self.players["role"][self._offsets[nights["game"][poison_mask]] + nights["poisoned"][poison_mask]] \
+            if poison_mask.any() else np.zeros(0, dtype=np.int64)
+
+        # 解析回退：文本回复中找不到任何候选id，最终取了candidates[0]（毒药为回复被忽略）
+        decision = (prompts["has_candidates"] == 1) & (prompts["phase"] != PHASE_CODE["day_vote"])
+        phase_calls = np.bincount(prompts["phase"][decision], minlength=len(PHASES))
+        phase_fallbacks = np.bincount(prompts["phase"][decision], weights=prompts["fallback"][decision], minlength=len(PHASES))
+        vote_mask = prompts["phase"] == PHASE_CODE["day_vote"]
+
+        result = self.games["result"]
+        return {
+            "games": len(result),
+            "errors": len(self.errors),
+            "camp_win_rate": {
+                "好人阵营": round(float((result == 0).mean()), 4) if len(result) else None,
+                WOLF_CAMP: round(float((result == 1).mean()), 4) if len(result) else None,
+            },
+            "avg_rounds": round(float(self.games["rounds"].mean()), 3) if len(result) else None,
+            "win_rate_by_role": dict(zip([r.name for r in ROLES], self._rate(role_wins, role_games))),
+            "win_rate_by_model": dict(zip(self.models.tolist(), self._rate(model_wins, model_games))),
+            "win_rate_by_model_role": {
+                f"{self.models[i // n_roles]}/{ROLES[i % n_roles].name}": rate
+                for i, rate in enumerate(self._rate(pair_wins, pair_games)) if pair_games[i]
+            },
+            "villager_vote_accuracy": round(float(hit[good].mean()), 4) if good.any() else None,
+            "villager_vote_accuracy_by_round": {r: rate for r, rate in enumerate(self._rate(round_hits, round_votes)) if round_votes[r]},
+            "villager_vote_accuracy_by_model": dict(zip(self.models.tolist(), self._rate(model_hits, model_votes))),
+            "witch": {
+                "saves": int(saved_mask.sum()),
+                "saves_on_good": round(float((saved_roles != WOLF).mean()), 4) if len(saved_roles) else None,
+                "poisons": int(poison_mask.sum()),
+                "poisons_on_wolf": round(float((poisoned_roles == WOLF).mean()), 4) if len(poisoned_roles) else None,
+            },
+            "seer": {
+                "checks": int(len(self.checks["bad"])),
+                "checks_on_wolf": round(float(self.checks["bad"].mean()), 4) if len(self.checks["bad"]) else None,
+            },
+            "eliminations_by_cause": {
+                cause: {role.name: int(n) for role, n in zip(ROLES, np.bincount(self.elims["role"][self.elims["cause"] == i], minlength=n_roles)) if n}
+                for i, cause in enumerate(CAUSES)
+            },
+            "parse_fallback_rate": {PHASES[i]: rate for i, rate in enumerate(self._rate(phase_fallbacks, phase_calls)) if phase_calls[i]},
+            # 投票回复已被解析成id；若此比例明显高于1/候选数，说明存在大量回退
+            "vote_first_candidate_rate": round(float(prompts["first_candidate"][vote_mask].mean()), 4) if vote_mask.any() else None,
+            "avg_prompt_chars": round(float(prompts["prompt_chars"].mean()), 1) if len(prompts["prompt_chars"]) else None,
+        }
+
+
+def load_games(paths: List[str], workers: Optional[int] = None, include_prompts: bool = True,
+               chunk_size: int = 64) -> GameTable:
+    """
+    并行解析多份日志并组装为GameTable。workers=1时在当前进程中解析。
+    """
+    chunks = [(paths[i:i + chunk_size], include_prompts) for i in range(0, len(paths), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        rows = [row for chunk in chunks for row in _parse_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = [row for result in pool.map(_parse_chunk, chunks) for row in result]
+    return GameTable(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-game analytics over Werewolf game logs")
+    parser.add_argument("paths", nargs="+", help="日志文件或glob，如 'tournament_out/games/*.cjson.gz'")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-prompts", action="store_true", help="跳过detailed_prompts（不统计解析回退）")
+    args = parser.parse_args()
+    files = sorted({p for pattern in args.paths for p in (glob.glob(pattern) or [pattern])})
+    table = load_games(files, workers=args.workers, include_prompts=not args.no_prompts)
+    print(json.dumps(table.metrics(), indent=2, ensure_ascii=False))
@@ -0,0 +1,132 @@
+# 异步引擎：复用GameEngine的阶段生成器，在事件循环中并发执行每批LLM调用，
+# 一个进程、一个事件循环即可同时运行大量对局（见game_host.py）。
+# asyncio-native engine variant.
+
+import asyncio
+import inspect
+import time
+from typing import Generator, List, Optional
+
+from agents import LLMAgent
+from game_engine import GameEngine, LLMCall
+from roles import Role
+
+
+class AsyncGameEngine(GameEngine):
+    """
+    GameEngine的异步版本：arun()/aresume()代替run()/resume()，每批调用用asyncio并发执行（不使用线程池）。
+    limiter为全局并发限制（如game_host.FairLimiter），只约束需要访问网络的调用（LLM和responder），
+    本地agent后端不受限制。responder可以是普通函数，也可以返回awaitable。
+    多局在同一事件循环中交错执行，因此不做按阶段的cProfile分析。
+    """
+    profile_phases = False
+
+    def __init__(self, *args, limiter=None, game_id: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.game_id = game_id
+
+    async def arun(self, roles: Optional[List[Role]] = None):
+        """
+        运行一局游戏。被取消或超时时异常会抛回阶段生成器，引擎照常收尾（埋点写入日志，检查点保留在上一阶段）。
+        """
+        self.assign_roles(roles)
+        await self._adrive(self._game_steps("night"))
+
+    async def aresume(self):
+        if self.next_phase is None:
+            raise ValueError("game has already finished")
+        await self._adrive(self._game_steps(self.next_phase))
+
+    async def arun_until(self, round_num: int, phase: str, roles: Optional[List[Role]] = None) -> bool:
+        """
+        run_until()的异步版本。
+        """
+        if phase not in ("night", "day"):
+            raise ValueError(f"unknown phase {phase!r}")
+        self.pause_at = (round_num, phase)
+        try:
+            if not self.players:
+                self.assign_roles(roles)
+                self.next_phase = "night"
+            await self.aresume()
+        finally:
+            self.pause_at = None
+        return self.next_phase is not None
+
+    async def _adrive(self, steps: Generator):
+        try:
+            calls = next(steps)
+            while True:
+                if self.budget is not None:
+                    self._check_budget()
+                try:
+                    results = await self.aexecute_calls(calls)
+                except BaseException as e:
+                    calls = steps.throw(e)
+                    continue
+                calls = steps.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+    async def aexecute_calls(self, calls: List[LLMCall]) -> list:
+        """
+        并发执行一批相互独立的调用，按传入顺序返回结果。任何一个失败时取消其余调用。
+        """
+        if len(calls) == 1:
+            return [await self._ainvoke(calls[0])]
+        tasks = [asyncio.ensure_future(self._ainvoke(call)) for call in calls]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _remote(self, call: LLMCall) -> bool:
+        if self.responder is not None:
+            return True
+        agent = self.agent_for(call.player.player_id)
+        return agent is None or isinstance(agent, LLMAgent)
+
+    async def _arespond(self, call: LLMCall) -> str:
+        call.profile = self.decoding.get(call.phase)
+        if self.responder is not None:
+            response = self.responder(call, self.round)
+            if inspect.isawaitable(response):
+                response = await response
+            return response
+        if self.budget is not None:
+            call.model = self.budget.model_for(call.phase, call.player.model)
+        self._stream_speech(call)
+        agent = self.agent_for(call.player.player_id)
+        if agent is not None:
+            response = await agent.arespond(call, self.agent_context(call))
+        else:
+            call.completion = await call.player.acomplete(call.prompt, call.profile, call.choices, call.model,
+                                                          call.on_token)
+            response = call.completion.text
+        if self.budget is not None and call.completion is not None:
+            self.budget.record(call.completion)
+        return response
+
+    async def _ainvoke(self, call: LLMCall):
+        limiter = self.limiter if self.limiter is not None and self._remote(call) else None
+        if limiter is not None:
+            # 排队时间不计入调用延迟
+            await limiter.acquire(self.game_id)
+        try:
+            start = time.perf_counter()
+            try:
+                response = await self._arespond(call)
+            except Exception as e:
+                if self.metrics is not None:
+                    self._record_call(call, start, e)
+                raise
+            if self.metrics is not None:
+                self._record_call(call, start)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        return self._parse_response(call, response)
@@ -0,0 +1,260 @@
+# 身份配置平衡性搜索：对给定人数枚举候选role_distribution，在进程池中用快速agent后端批量模拟，
+# 置信区间分离后淘汰明显失衡的配置，输出各配置的胜率曲面。
+# Role-distribution balance optimizer built on parallel Monte Carlo simulation.
+#
+# 运行：python balance.py --players 6-20 --agents heuristic --out balance.json
+#       python balance.py --players 10 --max-games 20000
+
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from roles import Role
+
+SPECIALS = (Role.SEER, Role.WITCH, Role.HUNTER)
+# 双侧置信水平对应的z值
+_Z = {0.9: 1.6449, 0.95: 1.96, 0.99: 2.5758}
+
+
+def wilson_interval(wins: int, games: int, z: float = 1.96) -> Tuple[float, float]:
+    """
+    二项比例的Wilson置信区间，在小样本和接近0/1时比正态近似可靠。
+    """
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denom = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denom
+    half = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def candidate_distributions(num_players: int, min_wolf_share: float = 0.15, max_wolf_share: float = 0.4,
+                            required: Tuple[Role, ...] = ()) -> List[Dict[Role, int]]:
+    """
+    枚举候选配置：狼人数在人数的[min_wolf_share, max_wolf_share]之间，预言家、女巫、猎人各至多一名
+    （引擎每晚只使用第一个存活的预言家/女巫），剩余为平民且至少一名。required中的身份必须出现。
+    """
+    low = max(1, math.floor(num_players * min_wolf_share))
+    high = max(low, math.ceil(num_players * max_wolf_share))
+    candidates = []
+    for wolves in range(low, high + 1):
+        for k in range(len(SPECIALS) + 1):
+            for specials in itertools.combinations(SPECIALS, k):
+                if any(role not in specials for role in required):
+                    continue
+                villagers = num_players - wolves - len(specials)
+                # 狼人不能在开局就达到半数
+                if villagers < 1 or wolves >= num_players - wolves:
+                    continue
+                distribution = {Role.WOLF: wolves}
+                for role in specials:
+                    distribution[role] = 1
+                distribution[Role.VILLAGER] = villagers
+                candidates.append(distribution)
+    return candidates
+
+
+def describe(distribution: Dict[Role, int]) -> str:
+    return ",".join(f"{role.name}={count}" for role, count in distribution.items())
+
+
+_worker_agents = {}
+
+
+def simulate_batch(task: dict) -> dict:
+    """
+    工作进程入口：用给定配置连续模拟若干局，返回狼人胜场、总局数、总轮数和出错局数。
+    """
+    from agents import make_agent
+    from event_sink import QUIET
+    from game_engine import GameEngine
+    from logger import GameLogger
+
+    agent = _worker_agents.get(task["agents"])
+    if agent is None:
+        agent = _worker_agents[task["agents"]] = make_agent(task["agents"])
+    distribution = {Role[name]: count for name, count in task["distribution"].items()}
+    num_players = sum(distribution.values())
+    wolf_wins = games = rounds = errors = 0
+    for seed in range(task["seed"], task["seed"] + task["games"]):
+        engine = GameEngine(num_players, distribution, seed=seed, agents=agent,
+                            logger=GameLogger(verbosity=QUIET, keep_prompts=False))
+        try:
+            engine.run()
+        except Exception:
+            errors += 1
+            continue
+        if engine.logger.result:
+            games += 1
+            rounds += engine.round
+            wolf_wins += engine.logger.result == "Wolves win!"
+    return {"index": task["index"], "wolf_wins": wolf_wins, "games": games, "rounds": rounds, "errors": errors}
+
+
+class Candidate:
+    """
+    一个候选配置的累计模拟结果。
+    """
+    def __init__(self, index: int, distribution: Dict[Role, int]):
+        self.index = index
+        self.distribution = distribution
+        self.wolf_wins = 0
+        self.games = 0
+        self.rounds = 0
+        self.errors = 0
+        self.scheduled = 0  # 已分配的种子数
+        self.eliminated_at: Optional[int] = None  # 被淘汰时的批次轮数
+
+    def add(self, result: dict):
+        self.wolf_wins += result["wolf_wins"]
+        self.games += result["games"]
+        self.rounds += result["rounds"]
+        self.errors += result["errors"]
+
+    def interval(self, z: float) -> Tuple[float, float]:
+        return wilson_interval(self.wolf_wins, self.games, z)
+
+    def imbalance(self, z: float) -> Tuple[float, float]:
+        """
+        |狼人胜率 - 0.5| 的置信区间。
+        """
+        low, high = self.interval(z)
+        upper = max(abs(low - 0.5), abs(high - 0.5))
+        lower = 0.0 if low <= 0.5 <= high else min(abs(low - 0.5), abs(high - 0.5))
+        return lower, upper
+
+    def report(self, z: float) -> dict:
+        low, high = self.interval(z)
+        rate = self.wolf_wins / self.games if self.games else None
+        return {
+            "distribution": describe(self.distribution),
+            "wolves": self.distribution.get(Role.WOLF, 0),
+            "specials": [role.name for role in SPECIALS if self.distribution.get(role)],
+            "games": self.games,
+            "wolf_win_rate": round(rate, 4) if rate is not None else None,
+            "ci": [round(low, 4), round(high, 4)],
+            "imbalance": round(abs(rate - 0.5), 4) if rate is not None else None,
+            "avg_rounds": round(self.rounds / self.games, 3) if self.games else None,
+            "errors": self.errors,
+            "eliminated_at_round": self.eliminated_at,
+        }
+
+
+def balance_players(num_players: int, candidates: Optional[List[Dict[Role, int]]] = None,
+                    agents: str = "heuristic", workers: Optional[int] = None, batch_games: int = 200,
+                    max_games: int = 10000, precision: float = 0.01, confidence: float = 0.95,
+                    seed: int = 0, executor: Optional[ProcessPoolExecutor] = None) -> dict:
+    """
+    对一个人数做平衡性搜索（racing）：每轮给所有仍在竞争的配置各模拟batch_games局，
+    某配置|胜率-0.5|的置信下界高于当前最优配置的上界时即被淘汰。
+    当只剩一个配置、剩余配置的置信区间半宽都小于precision、或都达到max_games局时停止。
+    """
+    z = _Z.get(confidence) or 1.96
+    candidates = candidates if candidates is not None else candidate_distributions(num_players)
+    if not candidates:
+        raise ValueError(f"no candidate role distributions for {num_players} players")
+    pool = [Candidate(i, d) for i, d in enumerate(candidates)]
+    workers = workers or os.cpu_count() or 1
+    own_executor = executor is None
+    executor = executor or ProcessPoolExecutor(max_workers=workers)
+    started = time.time()
+    rounds = 0
+    try:
+        while True:
+            active = [c for c in pool if c.eliminated_at is None and c.scheduled < max_games]
+            if not active:
+                break
+            rounds += 1
+            # 竞争者少于进程数时把每个配置的批次拆小，保持所有核心忙碌
+            chunks = max(1, math.ceil(workers / len(active)))
+            tasks = []
+            for c in active:
+                games = min(batch_games, max_games - c.scheduled)
+                per_chunk = max(1, math.ceil(games / chunks))
+                while games > 0:
+                    n = min(per_chunk, games)
+                    tasks.append({"index": c.index, "distribution": {r.name: k for r, k in c.distribution.items()},
+                                  "games": n, "agents": agents,
+                                  "seed": seed + num_players * 10 ** 9 + c.index * 10 ** 7 + c.scheduled})
+                    c.scheduled += n
+                    games -= n
+            for result in executor.map(simulate_batch, tasks):
+                pool[result["index"]].add(result)
+            # 淘汰：置信区间与当前最优配置分离
+            contenders = [c for c in pool if c.eliminated_at is None]
+            best_upper = min(c.imbalance(z)[1] for c in contenders)
+            for c in contenders:
+                if c.imbalance(z)[0] > best_upper:
+                    c.eliminated_at = rounds
+            contenders = [c for c in pool if c.eliminated_at is None]
+            if len(contenders) <= 1:
+                break
+            if all((c.interval(z)[1] - c.interval(z)[0]) / 2 <= precision for c in contenders):
+                break
+    finally:
+        if own_executor:
+            executor.shutdown()
+    reports = sorted((c.report(z) for c in pool),
+                     key=lambda r: (r["eliminated_at_round"] is not None, r["imbalance"] if r["imbalance"] is not None else 1))
+    survivors = [r for r in reports if r["eliminated_at_round"] is None]
+    return {
+        "players": num_players,
+        "agents": agents,
+        "confidence": confidence,
+        "rounds": rounds,
+        "total_games": sum(c.games for c in pool),
+        "seconds": round(time.time() - started, 2),
+        "best": survivors[0] if survivors else reports[0],
+        "contenders": [r["distribution"] for r in survivors],
+        "surface": reports,
+    }
+
+
+def parse_players(text: str) -> List[int]:
+    """
+    解析人数参数："10"、"6-20"或"6,8,10"。
+    """
+    counts = []
+    for part in text.split(","):
+        low, _, high = part.partition("-")
+        counts.extend(range(int(low), int(high or low) + 1))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search for balanced Werewolf role distributions by simulation")
+    parser.add_argument("--players", default="10", help="人数，如 10、6-20、6,8,10")
+    parser.add_argument("--agents", default="heuristic", choices=["heuristic", "random"])
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认CPU核数")
+    parser.add_argument("--batch-games", type=int, default=200, help="每轮每个配置模拟的局数")
+    parser.add_argument("--max-games", type=int, default=10000, help="每个配置最多模拟的局数")
+    parser.add_argument("--precision", type=float, default=0.01, help="置信区间半宽小于该值时停止")
+    parser.add_argument("--confidence", type=float, default=0.95, choices=sorted(_Z))
+    parser.add_argument("--require", default="", help="必须包含的特殊身份，如 SEER,WITCH")
+    parser.add_argument("--min-wolf-share", type=float, default=0.15)
+    parser.add_argument("--max-wolf-share", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="把完整结果写入JSON文件")
+    args = parser.parse_args()
+    required = tuple(Role[name.strip().upper()] for name in args.require.split(",") if name.strip())
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count() or 1) as pool:
+        for n in parse_players(args.players):
+            candidates = candidate_distributions(n, args.min_wolf_share, args.max_wolf_share, required)
+            result = balance_players(n, candidates, agents=args.agents, workers=args.workers, batch_games=args.batch_games,
+                                     max_games=args.max_games, precision=args.precision,
+                                     confidence=args.confidence, seed=args.seed, executor=pool)
+            results.append(result)
+            best = result["best"]
+            print(f"{n:>3} players: {best['distribution']:<45} wolf win {best['wolf_win_rate']:.3f} "
+                  f"CI {best['ci']} ({result['total_games']} games, {result['seconds']}s, "
+                  f"{len(result['contenders'])} contender(s))")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
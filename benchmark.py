@@ -0,0 +1,415 @@
+# 基准测试：用按录制日志建模的假LLM驱动完整对局，测量引擎自身的开销与并发收益。
+# Benchmark suite with a latency-modelled fake LLM.
+#
+# 假LLM的回复按阶段从日志的detailed_prompts中抽样（发言文本、决策回复的格式、女巫用药比例），
+# 延迟按 基础延迟 + prompt token * 预填充耗时 + 回复token * 生成耗时 建模，再乘以对数正态抖动。
+# 日志条目中有latency字段时（见instrumentation）直接按阶段抽样真实延迟。
+#
+# 运行：python benchmark.py --players 6,10,20,50 --games 20 --save benchmarks/baseline.json
+#       python benchmark.py --players 10 --time-scale 0.01 --max-workers 1,8   # 实际等待，比较并发收益
+#       python benchmark.py --compare benchmarks/baseline.json                 # 与基线对比，退化时退出码为1
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from analytics import iter_log_sections, prompt_candidates
+from decoding import parse_poison
+from event_sink import QUIET
+from game_engine import GameEngine, LLMCall, find_player_id
+from logger import GameLogger
+from tournament import default_role_distribution
+
+DEFAULT_LOGS = ("game_log_gpt-4o.json", "game_log_gpt-4o-mini.json")
+DECISION_PHASES = ("night_wolf", "night_seer", "hunter_shoot", "day_vote")
+TIMED_PHASES = ("night_phase", "day_phase", "hunter_shoot")
+
+
+class LatencyModel:
+    """
+    单次调用的延迟模型（秒）：(base + prompt_tokens * prefill + completion_tokens * decode) * lognormal(0, sigma)。
+    默认值大致对应托管的gpt-4o级别模型。
+    """
+    def __init__(self, base: float = 0.35, prefill: float = 0.00002, decode: float = 0.02, sigma: float = 0.35):
+        self.base = base
+        self.prefill = prefill
+        self.decode = decode
+        self.sigma = sigma
+
+    def sample(self, prompt_tokens: int, completion_tokens: int, rng: random.Random) -> float:
+        mean = self.base + prompt_tokens * self.prefill + completion_tokens * self.decode
+        return mean * rng.lognormvariate(0.0, self.sigma)
+
+    def to_dict(self) -> dict:
+        return {"base": self.base, "prefill": self.prefill, "decode": self.decode, "sigma": self.sigma}
+
+
+class ResponseModel:
+    """
+    按阶段记录的回复分布：发言文本、决策回复中不含候选id的文本比例、女巫解药/毒药的使用比例，以及可选的真实延迟。
+    """
+    def __init__(self):
+        self.speeches: List[str] = []
+        self.noise: Dict[str, List[str]] = {}  # 决策阶段中不含候选id的回复
+        self.decisions: Dict[str, int] = {}  # 决策阶段的回复总数
+        self.save_yes = 0
+        self.save_total = 0
+        self.poison_used = 0
+        self.poison_total = 0
+        self.latencies: Dict[str, List[float]] = {}
+
+    @classmethod
+    def from_logs(cls, paths: List[str]) -> "ResponseModel":
+        model = cls()
+        for path in paths:
+            for section, item in iter_log_sections(path):
+                if section == "detailed_prompts":
+                    model.add(item)
+        if not model.speeches:
+            model.speeches.append("I have nothing to add yet.")
+        return model
+
+    @staticmethod
+    def _candidates(entry: dict, text: str) -> List[int]:
+        # 日志未保留prompt时读不出候选列表，把回复中的数字都当作候选
+        return prompt_candidates(entry.get("prompt", "")) or [int(n) for n in re.findall(r"\d+", text)]
+
+    def add(self, entry: dict):
+        phase = entry.get("phase")
+        text = str(entry.get("response", ""))
+        if "latency" in entry:
+            self.latencies.setdefault(phase, []).append(float(entry["latency"]))
+        if phase == "day_speech":
+            self.speeches.append(text)
+        elif phase == "night_witch_save":
+            self.save_total += 1
+            self.save_yes += "yes" in text.lower()
+        elif phase == "night_witch_poison":
+            # 与引擎相同的规则判断是否用了毒药
+            self.poison_total += 1
+            self.poison_used += parse_poison(text, self._candidates(entry, text)) is not None
+        elif phase in DECISION_PHASES:
+            self.decisions[phase] = self.decisions.get(phase, 0) + 1
+            if find_player_id(text, self._candidates(entry, text)) is None:
+                self.noise.setdefault(phase, []).append(text)
+
+    def summary(self) -> dict:
+        return {
+            "speeches": len(self.speeches),
+            "avg_speech_chars": round(sum(map(len, self.speeches)) / len(self.speeches), 1),
+            "decision_noise_rate": {p: round(len(self.noise.get(p, [])) / n, 4) for p, n in self.decisions.items()},
+            "save_rate": round(self.save_yes / self.save_total, 4) if self.save_total else None,
+            "poison_rate": round(self.poison_used / self.poison_total, 4) if self.poison_total else None,
+            "recorded_latencies": {p: len(v) for p, v in self.latencies.items()},
+        }
+
+
+class FakeLLM:
+    """
+    假LLM。responder(call, round)可直接作为GameEngine的responder；调用按time_scale实际等待（0表示不等待），
+    同时统计调用次数、prompt字节数，以及按批次计算的建模LLM耗时：
+    sequential为所有调用延迟之和，critical_path为每批取最慢一次调用之和（无限并发时的下界）。
+    """
+    def __init__(self, responses: ResponseModel, latency: Optional[LatencyModel] = None,
+                 time_scale: float = 0.0, seed: int = 0):
+        self.responses = responses
+        self.latency = latency or LatencyModel()
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_bytes = 0
+        self.sequential = 0.0
+        self.critical_path = 0.0
+        self._batch_max = 0.0
+
+    def _reply(self, phase: str, targets: List[int]) -> str:
+        rng = self.rng
+        r = self.responses
+        if phase == "day_speech":
+            return rng.choice(r.speeches)
+        if phase == "night_witch_save":
+            return "yes" if rng.random() < (r.save_yes / r.save_total if r.save_total else 0.5) else "no"
+        if phase == "night_witch_poison":
+            if targets and rng.random() < (r.poison_used / r.poison_total if r.poison_total else 0.2):
+                return str(rng.choice(targets))
+            return "no"
+        noise = r.noise.get(phase)
+        if noise and rng.random() < len(noise) / r.decisions[phase]:
+            return rng.choice(noise)
+        return str(rng.choice(targets)) if targets else "0"
+
+    def _sample(self, phase: str, prompt: str, targets: List[int]) -> tuple:
+        with self._lock:
+            text = self._reply(phase, targets)
+            size = len(prompt.encode("utf-8"))
+            recorded = self.responses.latencies.get(phase)
+            if recorded:
+                latency = self.rng.choice(recorded)
+            else:
+                latency = self.latency.sample(_tokens(prompt, size), _tokens(text, len(text.encode("utf-8"))), self.rng)
+            self.calls += 1
+            self.prompt_bytes += size
+            self.sequential += latency
+            self._batch_max = max(self._batch_max, latency)
+        return text, latency
+
+    def complete(self, phase: str, prompt: str, targets: List[int]) -> str:
+        text, latency = self._sample(phase, prompt, targets)
+        if self.time_scale > 0:
+            time.sleep(latency * self.time_scale)
+        return text
+
+    def end_batch(self):
+        with self._lock:
+            self.critical_path += self._batch_max
+            self._batch_max = 0.0
+
+    def responder(self, call: LLMCall, round_num: int) -> str:
+        return self.complete(call.phase, call.prompt, call.targets or [])
+
+    async def aresponder(self, call: LLMCall, round_num: int) -> str:
+        """
+        responder的异步版本（用于async_engine.AsyncGameEngine），等待时不阻塞事件循环。
+        """
+        text, latency = self._sample(call.phase, call.prompt, call.targets or [])
+        if self.time_scale > 0:
+            await asyncio.sleep(latency * self.time_scale)
+        return text
+
+
+class BenchEngine(GameEngine):
+    """
+    记录各阶段墙钟时间的引擎。night_phase/day_phase的时间包含其中触发的猎人开枪。
+    """
+    def __init__(self, *args, fake: FakeLLM, **kwargs):
+        super().__init__(*args, responder=fake.responder, **kwargs)
+        self.fake = fake
+        self.timings: Dict[str, List[tuple]] = {phase: [] for phase in TIMED_PHASES}
+
+    def execute_calls(self, calls: List[LLMCall]) -> list:
+        results = super().execute_calls(calls)
+        self.fake.end_batch()
+        return results
+
+    def _night_steps(self):
+        start = time.perf_counter()
+        result = yield from super()._night_steps()
+        self.timings["night_phase"].append((self.round, time.perf_counter() - start))
+        return result
+
+    def _day_steps(self):
+        start = time.perf_counter()
+        result = yield from super()._day_steps()
+        self.timings["day_phase"].append((self.round, time.perf_counter() - start))
+        return result
+
+    def _hunter_steps(self, hunter):
+        start = time.perf_counter()
+        result = yield from super()._hunter_steps(hunter)
+        self.timings["hunter_shoot"].append((self.round, time.perf_counter() - start))
+        return result
+
+
+def _tokens(text: str, size: int) -> int:
+    """
+    与llm_client.estimate_tokens同样的估计，但用UTF-8字节数推算中日韩字符数（每个多2字节），
+    避免对超长prompt做正则扫描，使假LLM自身的开销不掩盖引擎开销。size为text的UTF-8字节数。
+    """
+    cjk = (size - len(text)) // 2
+    return max(1, cjk + (len(text) - cjk) // 4)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)] if ordered else 0.0
+
+
+def _phase_stats(samples: List[tuple]) -> Optional[dict]:
+    if not samples:
+        return None
+    values = [t for _, t in samples]
+    by_round: Dict[int, List[float]] = {}
+    for round_num, t in samples:
+        by_round.setdefault(round_num, []).append(t)
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 3),
+        "p50_ms": round(1000 * _percentile(values, 0.5), 3),
+        "p95_ms": round(1000 * _percentile(values, 0.95), 3),
+        "by_round_mean_ms": {r: round(1000 * sum(v) / len(v), 3) for r, v in sorted(by_round.items())},
+    }
+
+
+def run_scenario(num_players: int, games: int, responses: ResponseModel, latency: LatencyModel,
+                 time_scale: float = 0.0, max_workers: int = 1, seed: int = 0, measure_memory: bool = True) -> dict:
+    """
+    用同一配置连续跑games局，返回该场景的指标。内存峰值用tracemalloc单独跑一局测量，不影响计时。
+    """
+    distribution = default_role_distribution(num_players)
+    fake = FakeLLM(responses, latency, time_scale=time_scale, seed=seed)
+    timings: Dict[str, List[tuple]] = {phase: [] for phase in TIMED_PHASES}
+    rounds = []
+    started = time.perf_counter()
+    for i in range(games):
+        engine = BenchEngine(num_players, distribution, seed=seed + i, max_workers=max_workers, fake=fake,
+                             logger=GameLogger(verbosity=QUIET, keep_prompts=False))
+        engine.run()
+        rounds.append(engine.round)
+        for phase in TIMED_PHASES:
+            timings[phase].extend(engine.timings[phase])
+    wall = time.perf_counter() - started
+    result = {
+        "players": num_players,
+        "max_workers": max_workers,
+        "time_scale": time_scale,
+        "games": games,
+        "wall_s": round(wall, 4),
+        "games_per_sec": round(games / wall, 3) if wall else None,
+        "avg_rounds": round(sum(rounds) / len(rounds), 3),
+        "max_rounds": max(rounds),
+        "llm_calls_per_game": round(fake.calls / games, 2),
+        "prompt_bytes_per_game": round(fake.prompt_bytes / games),
+        "modelled_llm_s_per_game": {
+            "sequential": round(fake.sequential / games, 3),
+            "critical_path": round(fake.critical_path / games, 3),
+        },
+        "phase": {phase: _phase_stats(samples) for phase, samples in timings.items()},
+    }
+    if measure_memory:
+        # 保留完整prompt的日志是真实对局的主要内存占用，这里按默认logger测量
+        fake_mem = FakeLLM(responses, latency, time_scale=0.0, seed=seed)
+        tracemalloc.start()
+        try:
+            BenchEngine(num_players, distribution, seed=seed, fake=fake_mem,
+                        logger=GameLogger(verbosity=QUIET)).run()
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# 对比基线时检查的指标：(路径, 越大越好)
+_CHECKS = [
+    (("games_per_sec",), True),
+    (("prompt_bytes_per_game",), False),
+    (("peak_memory_bytes",), False),
+    (("phase", "night_phase", "mean_ms"), False),
+    (("phase", "day_phase", "mean_ms"), False),
+    (("phase", "hunter_shoot", "mean_ms"), False),
+]
+
+
+def _get(data: dict, path: tuple):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> List[dict]:
+    """
+    与基线逐场景对比，返回超过容差的退化项。场景按(人数, 并发数, time_scale)匹配。
+    """
+    def key(r):
+        return r["players"], r["max_workers"], r["time_scale"]
+    base = {key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        old = base.get(key(result))
+        if old is None:
+            continue
+        for path, higher_is_better in _CHECKS:
+            before, after = _get(old, path), _get(result, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append({"scenario": dict(zip(("players", "max_workers", "time_scale"), key(result))),
+                                    "metric": ".".join(path), "baseline": before, "current": after,
+                                    "change": round(change, 4)})
+    return regressions
+
+
+def run_suite(players: List[int], games: int, max_workers: List[int], time_scale: float, logs: List[str],
+              latency: LatencyModel, seed: int = 0, measure_memory: bool = True) -> dict:
+    responses = ResponseModel.from_logs(logs)
+    results = []
+    for n in players:
+        for workers in max_workers:
+            result = run_scenario(n, games, responses, latency, time_scale=time_scale, max_workers=workers,
+                                  seed=seed, measure_memory=measure_memory)
+            results.append(result)
+            print(f"players={n:<3} workers={workers:<3} {result['games_per_sec']:>9.2f} games/s  "
+                  f"rounds={result['avg_rounds']:<6} calls/game={result['llm_calls_per_game']:<8} "
+                  f"prompt KB/game={result['prompt_bytes_per_game'] / 1024:,.1f}  "
+                  f"peak MB={result.get('peak_memory_bytes', 0) / 2 ** 20:.1f}", file=sys.stderr)
+    return {
+        "environment": environment(),
+        "config": {"logs": logs, "games": games, "seed": seed, "latency_model": latency.to_dict(),
+                   "responses": responses.summary()},
+        "results": results,
+    }
+
+
+def _ints(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the game engine with a latency-modelled fake LLM")
+    parser.add_argument("--players", default="6,10,20,50", help="逗号分隔的人数列表")
+    parser.add_argument("--games", type=int, default=20, help="每个场景的局数")
+    parser.add_argument("--max-workers", default="1", help="逗号分隔的阶段内并发数列表")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="实际等待 建模延迟*该系数 秒，0表示不等待")
+    parser.add_argument("--logs", nargs="*", default=None, help="用于建模回复分布的日志，默认使用仓库中的录制日志")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="不测量内存峰值")
+    parser.add_argument("--save", default=None, help="把结果写入JSON（作为新的基线）")
+    parser.add_argument("--compare", default=None, help="与该基线JSON对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="对比时允许的相对退化")
+    args = parser.parse_args()
+    logs = args.logs if args.logs is not None else [p for p in DEFAULT_LOGS if os.path.exists(p)]
+    report = run_suite(_ints(args.players), args.games, _ints(args.max_workers), args.time_scale, logs,
+                       LatencyModel(), seed=args.seed, measure_memory=not args.no_memory)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        print(json.dumps({"regressions": regressions}, indent=2, ensure_ascii=False))
+        raise SystemExit(1 if regressions else 0)
+    if not args.save:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -0,0 +1,261 @@
+# token与费用预算：按价格表统计每局（及整批对局）的prompt/completion token和估算费用。
+# 达到软上限后把该局的调用切换到更便宜的模型（如gpt-4o -> gpt-4o-mini），达到硬上限后改用启发式策略，
+# 每次切换都作为"budget"事件写入日志。
+# Per-game and per-batch token/cost budget governor.
+#
+# 运行：LLM_BUDGET_SOFT=0.05 LLM_BUDGET_HARD=0.10 python main.py en 4          # 单局软/硬上限（美元）
+#       LLM_BUDGET_UNIT=tokens LLM_BUDGET_SOFT=200000 python main.py en 4        # 按token计
+#       python tournament.py --games 100 --budget-soft 0.05 --batch-budget-hard 5  # 整批上限
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from llm_api import MODEL_NAME
+
+# 每百万token的美元价格(输入, 输出)。模型名按最长前缀匹配，带日期后缀的版本名（如gpt-4o-mini-2024-07-18）也能找到价格
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "o3": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+}
+
+# 软上限时的降级目标
+DOWNGRADES: Dict[str, str] = {
+    "gpt-4o": "gpt-4o-mini",
+    "gpt-4.1": "gpt-4.1-mini",
+    "gpt-4.1-mini": "gpt-4.1-nano",
+    "gpt-4-turbo": "gpt-4o-mini",
+    "o3": "o4-mini",
+}
+
+NORMAL, SOFT, HARD = "normal", "soft", "hard"
+_LEVELS = (NORMAL, SOFT, HARD)
+
+# 降级范围：speech只降级发言，decision只降级夜晚行动、用药、开枪和投票，all两者都降级
+DEGRADE_SCOPES = ("all", "speech", "decision")
+
+
+def load_prices(path: str) -> Dict[str, Tuple[float, float]]:
+    """
+    读取JSON价格表：{"model": [输入, 输出]}或{"model": {"input": ..., "output": ...}}，单位为每百万token美元。
+    返回在PRICES基础上覆盖后的价格表。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    prices = dict(PRICES)
+    for model, price in data.items():
+        if isinstance(price, dict):
+            price = (price["input"], price["output"])
+        prices[model] = (float(price[0]), float(price[1]))
+    return prices
+
+
+def price_for(model: Optional[str], prices: Dict[str, Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    if not model:
+        return None
+    if model in prices:
+        return prices[model]
+    matches = [name for name in prices if model.startswith(name)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+class BudgetLedger:
+    """
+    累计的用量与估算费用（线程安全）。多局共享同一个BudgetLedger即可按整批计算。
+    缓存命中的调用没有发出请求，只计调用次数；价格表中没有的模型计入unpriced，只计token不计费用。
+    """
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.prices = prices if prices is not None else PRICES
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.cached = 0
+        self.unpriced = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, model: Optional[str], prompt_tokens: int, completion_tokens: int, cached: bool = False):
+        price = None if cached else price_for(model, self.prices)
+        with self.lock:
+            self.calls += 1
+            if cached:
+                self.cached += 1
+                return
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if price is None:
+                self.unpriced += 1
+            else:
+                self.cost += (prompt_tokens * price[0] + completion_tokens * price[1]) / 1e6
+
+    def spent(self, unit: str = "usd") -> float:
+        if unit == "tokens":
+            return self.prompt_tokens + self.completion_tokens
+        return self.cost
+
+    def merge(self, data: dict):
+        """
+        累加另一个ledger的to_dict()（如进程池中各局的用量）。
+        """
+        with self.lock:
+            self.calls += data.get("calls", 0)
+            self.cached += data.get("cached", 0)
+            self.unpriced += data.get("unpriced", 0)
+            self.prompt_tokens += data.get("prompt_tokens", 0)
+            self.completion_tokens += data.get("completion_tokens", 0)
+            self.cost += data.get("cost_usd", 0.0)
+
+    def to_dict(self) -> dict:
+        return {"calls": self.calls, "cached": self.cached, "unpriced": self.unpriced,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "cost_usd": round(self.cost, 6)}
+
+    @classmethod
+    def from_dict(cls, data: dict, prices: Optional[Dict[str, Tuple[float, float]]] = None) -> "BudgetLedger":
+        ledger = cls(prices)
+        ledger.merge(data)
+        return ledger
+
+
+class BudgetGovernor:
+    """
+    一局游戏的预算控制（GameEngine(budget=...)）。
+    soft_limit / hard_limit：本局的软/硬上限；batch为多局共享的BudgetLedger，batch_soft_limit / batch_hard_limit为整批上限。
+    unit为"usd"（按价格表估算的费用）或"tokens"（prompt与completion token之和）。
+    达到软上限后degrade范围内的调用改用downgrades中的便宜模型，达到硬上限后所有LLM座位改用fallback后端。
+    级别只在两批调用之间检查和切换（update()），同一批内的调用使用相同的模型，切换点与并发执行的顺序无关。
+    """
+    def __init__(self, soft_limit: Optional[float] = None, hard_limit: Optional[float] = None, unit: str = "usd",
+                 batch: Optional[BudgetLedger] = None, batch_soft_limit: Optional[float] = None,
+                 batch_hard_limit: Optional[float] = None, prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 downgrades: Optional[Dict[str, str]] = None, degrade: str = "all", fallback: str = "heuristic"):
+        if unit not in ("usd", "tokens"):
+            raise ValueError(f"unknown budget unit {unit!r}")
+        if degrade not in DEGRADE_SCOPES:
+            raise ValueError(f"unknown degrade scope {degrade!r}, expected one of {DEGRADE_SCOPES}")
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.unit = unit
+        self.batch = batch
+        self.batch_soft_limit = batch_soft_limit
+        self.batch_hard_limit = batch_hard_limit
+        self.downgrades = downgrades if downgrades is not None else DOWNGRADES
+        self.degrade = degrade
+        self.fallback = fallback
+        self.ledger = BudgetLedger(prices if prices is not None else (batch.prices if batch is not None else None))
+        self.level = NORMAL
+        self._agent = None
+
+    def record(self, completion):
+        """
+        计入一次LLM调用的用量（可在并发的调用线程中调用）。
+        """
+        args = (completion.model, completion.prompt_tokens or 0, completion.completion_tokens or 0,
+                completion.cached)
+        self.ledger.add(*args)
+        if self.batch is not None:
+            self.batch.add(*args)
+
+    def _target(self) -> Tuple[str, Optional[str], Optional[float], Optional[float]]:
+        """
+        按当前用量应处的级别，以及触发它的范围（game/batch）、用量和上限。
+        """
+        checks = [(self.ledger, "game", self.soft_limit, self.hard_limit)]
+        if self.batch is not None:
+            checks.append((self.batch, "batch", self.batch_soft_limit, self.batch_hard_limit))
+        best = (NORMAL, None, None, None)
+        for ledger, scope, soft, hard in checks:
+            spent = ledger.spent(self.unit)
+            for level, limit in ((HARD, hard), (SOFT, soft)):
+                if limit is not None and spent >= limit:
+                    if _LEVELS.index(level) > _LEVELS.index(best[0]):
+                        best = (level, scope, spent, limit)
+                    break
+        return best
+
+    def update(self, models: Iterable[Optional[str]] = ()) -> Optional[dict]:
+        """
+        检查是否越过上限。级别升高时返回描述这次切换的事件（不含round），否则返回None。级别不会回落。
+        models为调用LLM的座位所用的模型（None为默认模型），切换到软上限时在事件中记录各模型的降级目标。
+        """
+        level, scope, spent, limit = self._target()
+        if _LEVELS.index(level) <= _LEVELS.index(self.level):
+            return None
+        previous, self.level = self.level, level
+        event = {"phase": "budget", "level": level, "previous": previous, "scope": scope, "unit": self.unit,
+                 "spent": round(spent, 6), "limit": limit}
+        if level == SOFT:
+            event["degrade"] = self.degrade
+            event["models"] = {m: self.downgrades[m] for m in sorted({m or MODEL_NAME for m in models})
+                               if m in self.downgrades}
+        else:
+            event["agent"] = self.fallback
+        return event
+
+    def applies_to(self, phase: str) -> bool:
+        if self.degrade == "all":
+            return True
+        return (phase == "day_speech") == (self.degrade == "speech")
+
+    def model_for(self, phase: str, model: Optional[str]) -> Optional[str]:
+        """
+        软上限之后该调用应改用的模型，不需要切换（或没有更便宜的模型）时返回None。
+        """
+        if self.level == NORMAL or not self.applies_to(phase):
+            return None
+        return self.downgrades.get(model or MODEL_NAME)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.level == HARD
+
+    @property
+    def agent(self):
+        """
+        硬上限之后代替LLM的后端（按fallback创建，一局内共享）。
+        """
+        if self._agent is None:
+            from agents import make_agent
+            self._agent = make_agent(self.fallback)
+        return self._agent
+
+    def state(self) -> dict:
+        """
+        检查点保存的状态：级别与本局用量（整批用量不随单局保存）。
+        """
+        return {"level": self.level, "ledger": self.ledger.to_dict()}
+
+    def restore(self, data: dict):
+        self.level = data.get("level", NORMAL)
+        self.ledger = BudgetLedger.from_dict(data.get("ledger", {}), self.ledger.prices)
+
+    def to_dict(self) -> dict:
+        data = self.ledger.to_dict()
+        data.update({"level": self.level, "unit": self.unit, "soft_limit": self.soft_limit,
+                     "hard_limit": self.hard_limit})
+        return data
+
+
+def governor_from_env(batch: Optional[BudgetLedger] = None) -> Optional[BudgetGovernor]:
+    """
+    按环境变量创建BudgetGovernor，没有设置任何上限时返回None：
+    LLM_BUDGET_SOFT、LLM_BUDGET_HARD、LLM_BUDGET_UNIT（usd/tokens）、LLM_BUDGET_DEGRADE（all/speech/decision）、
+    LLM_BUDGET_FALLBACK（agent后端名）、LLM_PRICES（JSON价格表路径）。
+    """
+    soft = float(os.getenv("LLM_BUDGET_SOFT", "0")) or None
+    hard = float(os.getenv("LLM_BUDGET_HARD", "0")) or None
+    if soft is None and hard is None:
+        return None
+    prices_path = os.getenv("LLM_PRICES", "")
+    return BudgetGovernor(soft, hard, unit=os.getenv("LLM_BUDGET_UNIT", "usd"), batch=batch,
+                          prices=load_prices(prices_path) if prices_path else None,
+                          degrade=os.getenv("LLM_BUDGET_DEGRADE", "all"),
+                          fallback=os.getenv("LLM_BUDGET_FALLBACK", "heuristic"))
@@ -0,0 +1,112 @@
+# 阶段级检查点：每个夜晚/白天阶段结束后写出对局状态（含随机数生成器状态），中断后从断点继续，
+# 已完成阶段的LLM调用不会重复付费。
+# Phase-level checkpointing and resume of in-progress games.
+#
+# 检查点为紧凑JSON：日志部分用compact_log去重，路径以.gz结尾时再gzip压缩；先写临时文件再改名，
+# 写到一半中断也不会损坏已有的检查点。
+#
+# 运行：python main.py en 1 heuristic              # 每个阶段后写出game_checkpoint.json.gz
+#       python main.py --resume                    # 从game_checkpoint.json.gz继续
+#       python checkpoint.py game_checkpoint.json.gz --agents heuristic --out game_log.json
+
+import argparse
+import gzip
+import json
+import os
+from typing import Optional
+
+from compact_log import compact_log, expand_log
+
+FORMAT = "werewolf-checkpoint/1"
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        # 检查点写得频繁，用较低的压缩级别
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=1)
+    return open(path, mode, encoding="utf-8")
+
+
+def save_checkpoint(engine, path: str):
+    """
+    原子地写出engine.checkpoint_state()。
+    """
+    data = engine.checkpoint_state()
+    data["format"] = FORMAT
+    data["log"] = compact_log(data["log"])
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if path.endswith(".gz"):
+        tmp += ".gz"
+    with _open(tmp, "w") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """
+    读取检查点，日志部分还原为GameLogger.to_dict()格式。
+    """
+    with _open(path, "r") as f:
+        data = json.load(f)
+    if data.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a checkpoint ({data.get('format')!r})")
+    data["log"] = expand_log(data["log"])
+    return data
+
+
+def resume_game(path: str, checkpoint: Optional[str] = "", run: bool = True, **engine_kwargs):
+    """
+    从检查点重建引擎并继续对局，返回GameEngine。
+    人数、身份配置、语言、种子和座位模型取自检查点；agents、responder、max_workers、logger、
+    metrics、compaction等运行配置通过engine_kwargs传入（与原对局一致时结果可复现）。
+    checkpoint为继续写检查点的路径，默认沿用path，None表示不再写。run=False时只恢复不运行。
+    """
+    from game_engine import GameEngine
+    from roles import Role
+
+    data = load_checkpoint(path)
+    engine = GameEngine(
+        data["num_players"],
+        {Role[name]: count for name, count in data["role_distribution"].items()},
+        language=data["language"],
+        seed=data["seed"],
+        player_models={int(pid): model for pid, model in data["player_models"].items()},
+        checkpoint=path if checkpoint == "" else checkpoint,
+        **engine_kwargs,
+    )
+    engine.restore_state(data)
+    if run and engine.next_phase is not None:
+        engine.resume()
+    return engine
+
+
+if __name__ == "__main__":
+    from agents import AGENTS, make_agent
+    from llm_client import LLMError
+
+    parser = argparse.ArgumentParser(description="Resume an interrupted Werewolf game from a checkpoint")
+    parser.add_argument("path")
+    parser.add_argument("--agents", default=None, choices=sorted(AGENTS), help="非LLM的agent后端，应与原对局一致")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--out", default="game_log.json")
+    parser.add_argument("--info", action="store_true", help="只显示检查点信息")
+    args = parser.parse_args()
+    if args.info:
+        data = load_checkpoint(args.path)
+        print(json.dumps({"round": data["round"], "next_phase": data["next_phase"],
+                          "alive": [i for i in range(data["num_players"]) if data["alive"] >> i & 1],
+                          "events": len(data["history"]), "prompts": len(data["log"].get("detailed_prompts", [])),
+                          "result": data["log"].get("result")}, indent=2, ensure_ascii=False))
+        raise SystemExit(0)
+    engine = None
+    try:
+        engine = resume_game(args.path, agents=make_agent(args.agents) if args.agents else None,
+                             max_workers=args.max_workers)
+    except LLMError as e:
+        print(f"[LLM API ERROR] {type(e).__name__} after {e.attempts} attempt(s): {e}")
+        print(f"Progress is kept in {args.path}; run this command again to continue.")
+        raise SystemExit(1)
+    engine.logger.save(args.out)
+    print(f"Game finished: {engine.logger.result} Log saved to {args.out}.")
@@ -0,0 +1,223 @@
+# 去重的紧凑日志格式及无损还原。
+# Deduplicated compact log format with a lossless expander back to the GameLogger.save() schema.
+#
+# detailed_prompts中每条prompt都重复着身份说明和不断增长的历史JSON。紧凑格式中：
+# - prompt按行拆分，去掉数字后的每一行只在字符串表中存一次（身份说明、模板都只存一次）
+# - prompt中的历史JSON存为logs中事件的下标，不在logs中的条目（如预言家查验）才内联
+# - 与logs中发言完全相同的回复存为对发言的引用
+# - 每次调用只记录行号、数字参数等本次调用特有的内容
+# 编码后会立即解码校验，无法精确还原的条目原样保存，因此还原总是无损的。
+#
+# 运行：python compact_log.py compress game_log.json game_log.cjson.gz
+#       python compact_log.py expand game_log.cjson.gz game_log.json
+#       python compact_log.py verify game_log_gpt-4o.json
+
+import argparse
+import gzip
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+FORMAT = "werewolf-compact/1"
+BASE_KEYS = ("player_id", "round", "phase", "prompt", "response")
+_HISTORY_MARK = "\x00"
+_NUMBER_MARK = "\x01"
+_NUMBER_RE = re.compile(r"\d+")
+_HISTORY_ANCHOR = "Game history: "
+_decoder = json.JSONDecoder()
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, text: str) -> int:
+        index = self._index.get(text)
+        if index is None:
+            index = self._index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+
+def _split_history(prompt: str) -> Tuple[str, Optional[list]]:
+    """
+    把prompt中"Game history: "后面的JSON数组取出来，原位置替换为占位符。
+    只有重新序列化后与原文完全一致时才拆分。
+    """
+    anchor = prompt.find(_HISTORY_ANCHOR)
+    if anchor < 0:
+        return prompt, None
+    start = anchor + len(_HISTORY_ANCHOR)
+    if not prompt.startswith("[", start):
+        return prompt, None
+    try:
+        history, end = _decoder.raw_decode(prompt, start)
+    except ValueError:
+        return prompt, None
+    if not isinstance(history, list) or _dumps(history) != prompt[start:end]:
+        return prompt, None
+    return prompt[:start] + _HISTORY_MARK + prompt[end:], history
+
+
+def _encode_param(text: str):
+    return int(text) if str(int(text)) == text else text
+
+
+def _encode_prompt(prompt: str, strings: _StringTable, event_ids: Dict[str, int]):
+    if _HISTORY_MARK in prompt or _NUMBER_MARK in prompt:
+        return None
+    template, history = _split_history(prompt)
+    params = [_encode_param(m) for m in _NUMBER_RE.findall(template)]
+    template = _NUMBER_RE.sub(_NUMBER_MARK, template)
+    lines = [strings.add(line) for line in template.split("\n")]
+    refs = None
+    if history is not None:
+        refs = []
+        for item in history:
+            event_id = event_ids.get(_dumps(item))
+            refs.append(event_id if event_id is not None else {"v": item})
+    return lines, params, refs
+
+
+def _decode_prompt(lines: List[int], params: list, refs: Optional[list], strings: List[str], logs: List[dict]) -> str:
+    template = "\n".join(strings[i] for i in lines)
+    values = iter(params)
+    parts = template.split(_NUMBER_MARK)
+    text = parts[0] + "".join(str(next(values)) + part for part in parts[1:])
+    if refs is not None:
+        history = [logs[ref] if isinstance(ref, int) else ref["v"] for ref in refs]
+        text = text.replace(_HISTORY_MARK, _dumps(history), 1)
+    return text
+
+
+def compact_log(data: dict) -> dict:
+    """
+    把GameLogger.save()格式的日志（已json.load）转换为紧凑格式。
+    """
+    logs = data.get("logs", [])
+    strings = _StringTable()
+    event_ids: Dict[str, int] = {}
+    speech_ids: Dict[Tuple[int, int, str], Tuple[int, int]] = {}
+    for index, event in enumerate(logs):
+        event_ids.setdefault(_dumps(event), index)
+        if event.get("phase") == "day_speech":
+            for k, speech in enumerate(event.get("speeches", [])):
+                speech_ids.setdefault((event.get("round"), speech.get("player_id"), speech.get("speech")), (index, k))
+    prompts = []
+    for entry in data.get("detailed_prompts", []):
+        encoded = None
+        if tuple(entry)[:len(BASE_KEYS)] == BASE_KEYS and isinstance(entry["prompt"], str):
+            encoded = _encode_prompt(entry["prompt"], strings, event_ids)
+        if encoded is None:
+            prompts.append({"raw": entry})
+            continue
+        lines, params, refs = encoded
+        response = entry["response"]
+        speech_ref = speech_ids.get((entry["round"], entry["player_id"], response)) if entry["phase"] == "day_speech" else None
+        record = [entry["player_id"], entry["round"], strings.add(entry["phase"]), lines, params, refs,
+                  {"ref": list(speech_ref)} if speech_ref else response]
+        extras = {k: v for k, v in entry.items() if k not in BASE_KEYS}
+        if extras:
+            record.append(extras)
+        # 立即校验，不能精确还原的条目原样保存
+        if _dumps(_expand_entry(record, strings.strings, logs)) != _dumps(entry):
+            prompts.append({"raw": entry})
+            continue
+        prompts.append(record)
+    compact = {"format": FORMAT, "keys": list(data.keys())}
+    for key, value in data.items():
+        if key != "detailed_prompts":
+            compact[key] = value
+    compact["strings"] = strings.strings
+    compact["prompts"] = prompts
+    return compact
+
+
+def _expand_entry(record, strings: List[str], logs: List[dict]) -> dict:
+    if isinstance(record, dict):
+        return record["raw"]
+    player_id, round_num, phase, lines, params, refs, response = record[:7]
+    if isinstance(response, dict):
+        log_index, k = response["ref"]
+        response = logs[log_index]["speeches"][k]["speech"]
+    entry = {
+        "player_id": player_id,
+        "round": round_num,
+        "phase": strings[phase],
+        "prompt": _decode_prompt(lines, params, refs, strings, logs),
+        "response": response,
+    }
+    if len(record) > 7:
+        entry.update(record[7])
+    return entry
+
+
+def expand_log(compact: dict) -> dict:
+    """
+    紧凑格式还原为GameLogger.save()格式，与原日志逐字节一致（键顺序相同）。
+    """
+    if compact.get("format") != FORMAT:
+        raise ValueError(f"not a {FORMAT} log")
+    logs = compact.get("logs", [])
+    strings = compact["strings"]
+    data = {}
+    for key in compact["keys"]:
+        if key == "detailed_prompts":
+            data[key] = [_expand_entry(record, strings, logs) for record in compact["prompts"]]
+        else:
+            data[key] = compact[key]
+    return data
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def save_compact(data: dict, path: str):
+    """
+    以紧凑格式保存日志，路径以.gz结尾时再做gzip压缩。
+    """
+    with _open(path, "w") as f:
+        json.dump(compact_log(data), f, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_log(path: str) -> dict:
+    """
+    读取日志文件，普通格式和紧凑格式（可gzip压缩）都返回GameLogger.save()格式。
+    """
+    with _open(path, "r") as f:
+        data = json.load(f)
+    if data.get("format") == FORMAT:
+        return expand_log(data)
+    return data
+
+
+if __name__ == "__main__":
+    import os
+
+    parser = argparse.ArgumentParser(description="Compact or expand Werewolf game logs")
+    parser.add_argument("command", choices=["compress", "expand", "verify"])
+    parser.add_argument("src")
+    parser.add_argument("dst", nargs="?")
+    args = parser.parse_args()
+    if args.command == "compress":
+        save_compact(load_log(args.src), args.dst)
+        print(f"{args.src}: {os.path.getsize(args.src)} -> {args.dst}: {os.path.getsize(args.dst)} bytes")
+    elif args.command == "expand":
+        with _open(args.dst, "w") as f:
+            json.dump(load_log(args.src), f, indent=2, ensure_ascii=False)
+    else:
+        original = load_log(args.src)
+        compact = compact_log(original)
+        raw = sum(1 for record in compact["prompts"] if isinstance(record, dict))
+        same = _dumps(expand_log(compact)) == _dumps(original)
+        size = len(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        print(f"{args.src}: lossless={same}, compact size={size} bytes, prompts stored raw={raw}")
+        raise SystemExit(0 if same else 1)
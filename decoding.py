@@ -0,0 +1,256 @@
+# 按行动区分的解码配置：发言保留较长的输出，夜晚行动、女巫用药、猎人开枪和投票只需要一个玩家id或yes/no，
+# 用很小的max_tokens、换行停止符和较低的温度在几个token内结束，可选用logit_bias或JSON输出把回答限制在候选项内。
+# Per-action decoding profiles.
+#
+# 运行：LLM_CONSTRAIN=json python main.py en 1          # 决策调用使用结构化输出（需模型支持json_schema）
+#       LLM_CONSTRAIN=logit_bias python main.py en 1    # 只允许候选id的token（需安装tiktoken）
+#       LLM_CONSENSUS=5 python main.py en 1              # 决策调用一次请求5个回答（n=5），取多数
+#       LLM_CONSENSUS=night_wolf=5,day_vote=3 python main.py en 1
+#       python -m doctest decoding.py                    # 毒药回复解析的回归用例
+
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# 决策调用的约束方式：""（只靠prompt与max_tokens）、"json"（response_format json_schema）、"logit_bias"
+LLM_CONSTRAIN = os.getenv("LLM_CONSTRAIN", "")
+# 决策调用的自洽采样数：一个数字对所有决策生效，或"阶段=数量"逗号列表（阶段可省略night_/day_前缀）
+LLM_CONSENSUS = os.getenv("LLM_CONSENSUS", "")
+
+DECISION_PHASES = ("night_wolf", "night_seer", "night_witch_save", "night_witch_poison", "hunter_shoot", "day_vote")
+
+# 答案行中的拒绝或否定用药的说法，出现时不用毒药（毒药不可撤回）。否定词只在修饰用药动作时才算，
+# 修饰目标的说法（"他肯定不是好人"、"Poison 3. No doubt."）不算拒绝
+_DECLINE_RE = re.compile(
+    r"^(?:no|none|nope)\b|\b(?:none|skip|pass)\b|\bno\s+(?:poison|one|target)\b"
+    r"|(?:\bnot|n't|\bnever)\s+(?:\w+\s+){0,3}?(?:poison|use|kill)"
+    r"|[不没別别](?:想|会|打算|要|需要|准备|必要|必|该|应该|有)?(?:用|使用|毒)|放弃")
+
+
+class DecodingProfile:
+    """
+    一类调用的解码参数。None表示沿用LLMClient的默认值。
+    constrain为"json"时请求{"answer": <候选项>}形式的结构化输出，为"logit_bias"时只允许候选项对应的token
+    （每个候选项都必须是单个token，否则不加约束）。decode()把结构化回复还原为纯文本答案。
+    samples大于1时在同一次请求中采样多个回答（n参数，prompt只计费一次），finish()按多数票选出答案。
+    """
+    __slots__ = ("max_tokens", "temperature", "stop", "constrain", "samples")
+
+    def __init__(self, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 stop: Optional[List[str]] = None, constrain: Optional[str] = None, samples: int = 1):
+        if constrain not in (None, "", "json", "logit_bias"):
+            raise ValueError(f"unknown constrain mode {constrain!r}")
+        if samples < 1:
+            raise ValueError("samples must be at least 1")
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = stop
+        self.constrain = constrain or None
+        self.samples = samples
+
+    def request_params(self, choices: Optional[List[str]] = None, model: Optional[str] = None) -> dict:
+        """
+        返回传给LLMClient.complete()的参数。choices为允许的回答（如候选id和"no"），仅用于约束输出。
+        """
+        params = {}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        if self.stop:
+            params["stop"] = list(self.stop)
+        if self.samples > 1:
+            params["n"] = self.samples
+        if choices and self.constrain == "json":
+            # 结构化输出自带结束，不能再用换行截断
+            params.pop("stop", None)
+            params["response_format"] = _json_schema(choices)
+        elif choices and self.constrain == "logit_bias":
+            bias = _logit_bias(choices, model)
+            if bias:
+                params["logit_bias"] = bias
+                params["max_tokens"] = 1
+        return params
+
+    def decode(self, text: str) -> str:
+        """
+        把{"answer": ...}形式的回复还原为答案文本，其他回复原样返回。
+        """
+        stripped = text.strip()
+        if not stripped.startswith("{"):
+            return text
+        try:
+            answer = json.loads(stripped).get("answer")
+        except (ValueError, AttributeError):
+            return text
+        return text if answer is None else str(answer)
+
+    def finish(self, completion, choices: Optional[List[str]] = None):
+        """
+        还原结构化回复；有多个采样时把completion.text换成多数票答案（见consensus()），原始回复保留在samples中。
+        """
+        if completion.samples:
+            completion.samples = [self.decode(text) for text in completion.samples]
+            completion.text = consensus(completion.samples, choices)
+        else:
+            completion.text = self.decode(completion.text)
+        return completion
+
+    def to_dict(self) -> dict:
+        return {"max_tokens": self.max_tokens, "temperature": self.temperature, "stop": self.stop,
+                "constrain": self.constrain, "samples": self.samples}
+
+
+def _json_schema(choices: List[str]) -> dict:
+    values = [int(c) if c.isdigit() else c for c in choices]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "answer",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"answer": {"enum": values}},
+                "required": ["answer"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def _encoding(model: Optional[str]):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or "gpt-4o")
+    except KeyError:
+        return None
+
+
+def _logit_bias(choices: List[str], model: Optional[str]) -> Optional[Dict[str, int]]:
+    """
+    每个候选项都编码为单个token时返回{token_id: 100}，否则（或没有对应的分词器时）返回None。
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return None
+    bias = {}
+    for choice in choices:
+        tokens = encoding.encode(choice)
+        if len(tokens) != 1:
+            return None
+        bias[str(tokens[0])] = 100
+    return bias
+
+
+def choices_for(phase: str, targets: Optional[List[int]]) -> Optional[List[str]]:
+    """
+    某类调用允许的回答：解药为yes/no，毒药为候选id或no，其余决策为候选id；发言没有限制。
+    """
+    if phase == "night_witch_save":
+        return ["yes", "no"]
+    if phase not in DECISION_PHASES or not targets:
+        return None
+    choices = [str(t) for t in targets]
+    if phase == "night_witch_poison":
+        choices.append("no")
+    return choices
+
+
+def parse_samples(spec: str) -> Dict[str, int]:
+    """
+    解析LLM_CONSENSUS："5"对所有决策阶段生效，"wolf=5,vote=3"或"night_wolf=5,day_vote=3"按阶段设置。
+    """
+    spec = spec.strip()
+    if not spec:
+        return {}
+    if spec.isdigit():
+        return {phase: int(spec) for phase in DECISION_PHASES}
+    samples = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        name = name.strip()
+        phase = next((p for p in DECISION_PHASES if name in (p, p.split("_", 1)[1])), None)
+        if phase is None or not value.strip().isdigit():
+            raise ValueError(f"bad LLM_CONSENSUS entry {item!r}")
+        samples[phase] = int(value)
+    return samples
+
+
+def make_profiles(constrain: Optional[str] = None, speech_max_tokens: int = 512,
+                  decision_max_tokens: int = 16, samples: Optional[Dict[str, int]] = None) -> Dict[str, DecodingProfile]:
+    """
+    默认的按阶段解码配置。决策调用的max_tokens留有余量，以容纳"我选择杀死玩家 6。"这类简短的非纯数字回复。
+    samples按阶段设置自洽采样数；多数票需要回答之间有差异，采样数大于1的阶段使用0.7的温度。
+    """
+    samples = samples or {}
+    profiles = {"day_speech": DecodingProfile(max_tokens=speech_max_tokens, temperature=0.7)}
+    for phase in DECISION_PHASES:
+        k = samples.get(phase, 1)
+        profiles[phase] = DecodingProfile(max_tokens=decision_max_tokens, temperature=0.7 if k > 1 else 0.2,
+                                          stop=["\n"], constrain=constrain, samples=k)
+    return profiles
+
+
+DEFAULT_PROFILES = make_profiles(LLM_CONSTRAIN or None, samples=parse_samples(LLM_CONSENSUS))
+
+
+def parse_poison(text: str, candidates: List[int]) -> Optional[int]:
+    """
+    解析女巫毒药的回复，返回要毒的玩家id，不用毒药或无法判断时返回None。
+    只看最后一行（先推理后作答的回复中前面常列出存活玩家）：恰好提到一个候选id且没有拒绝或否定用药的说法
+    （no、skip、won't poison、不想毒、放弃等）时毒该玩家，其余都按不用毒药处理；毒药不可撤回，无法判断时宁可不用。
+
+    >>> [parse_poison(text, [1, 3, 4, 5]) for text in ["3", "Poison 3. No doubt.", "毒3号，他肯定不是好人",
+    ...     "我要毒死3号，不能让他活", "alive: [1, 3, 4]\\n3"]]
+    [3, 3, 3, 3, 3]
+    >>> [parse_poison(text, [1, 3, 4, 5]) for text in ["I will not poison player 3.", "I won't poison 3",
+    ...     "no, not 3", "我不想毒3号", "我不会毒3号玩家", "不用毒药", "skip", "3 or 4", "7"]]
+    [None, None, None, None, None, None, None, None, None]
+    """
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    if not lines:
+        return None
+    answer = lines[-1].strip().strip("'\"`。.!！").lower()
+    if answer.isdigit():
+        return int(answer) if int(answer) in candidates else None
+    ids = {int(n) for n in re.findall(r"\d+", answer) if int(n) in candidates}
+    if len(ids) != 1 or _DECLINE_RE.search(answer):
+        return None
+    return ids.pop()
+
+
+def normalize_answer(text: str, choices: Optional[List[str]]) -> Optional[str]:
+    """
+    把一个回答归一为候选项之一以便计票，无法识别时返回None。
+    毒药沿用parse_poison()（拒绝用语算"no"）；yes/no看是否以yes开头；其余取第一个候选id。
+    """
+    if not choices:
+        stripped = text.strip()
+        return stripped or None
+    if choices == ["yes", "no"]:
+        return "yes" if text.strip().lower().startswith("yes") else "no"
+    ids = [int(c) for c in choices if c.isdigit()]
+    if "no" in choices:
+        target = parse_poison(text, ids)
+        return str(target) if target is not None else "no"
+    for n in re.findall(r"\d+", text):
+        if n in choices:
+            return n
+    return None
+
+
+def consensus(texts: List[str], choices: Optional[List[str]] = None) -> str:
+    """
+    多个采样回答的多数票。票数相同时取最先出现的答案；全部无法识别时返回第一个原始回答，交给引擎原有的解析与兜底。
+    """
+    answers = [a for a in (normalize_answer(text, choices) for text in texts) if a is not None]
+    if not answers:
+        return texts[0] if texts else ""
+    counts = Counter(answers)
+    best = max(counts.values())
+    return next(a for a in answers if counts[a] == best)
@@ -0,0 +1,228 @@
+# 流式事件输出：事件以紧凑JSONL格式经后台线程缓冲写入文件，可选gzip/zstd压缩。
+# Streaming, buffered JSONL event sink.
+
+import gzip
+import io
+import json
+import queue
+import threading
+from typing import Dict, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd压缩是可选功能
+    zstandard = None
+
+# 终端输出级别
+QUIET = 0     # 不输出
+SUMMARY = 1   # 每个事件一行摘要
+VERBOSE = 2   # 摘要加完整JSON（含完整prompt），即原来的行为
+
+
+def _compression_for(path: str, compression: Optional[str]) -> Optional[str]:
+    if compression is not None:
+        return compression or None
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def open_stream(path: str, mode: str = "rb", compression: Optional[str] = None, level: Optional[int] = None):
+    """
+    按压缩方式打开二进制文件流。compression为None时根据后缀（.gz/.zst）判断。
+    """
+    compression = _compression_for(path, compression)
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=level or 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package")
+        raw = open(path, mode)
+        if "r" in mode:
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(raw, closefd=True)
+    return open(path, mode)
+
+
+def read_events(path: str, compression: Optional[str] = None) -> Iterator[Dict]:
+    """
+    逐行读取JsonlSink写出的事件。
+    """
+    with open_stream(path, "rb", compression) as raw:
+        for line in io.TextIOWrapper(raw, encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+
+
+class EventSink:
+    """
+    事件输出接口。write可能在多个线程中被调用。
+    live为True的sink实时转发事件（如live_feed.FeedSink），还会收到流式发言的"token"事件。
+    """
+    live = False
+
+    def write(self, event: Dict):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(EventSink):
+    """
+    把事件保存在列表中，便于测试和调试。
+    """
+    def __init__(self):
+        self.events = []
+
+    def write(self, event: Dict):
+        self.events.append(event)
+
+
+class TeeSink(EventSink):
+    """
+    把事件同时写给多个sink（如落盘的JsonlSink加实时观战的FeedSink）。"token"事件只写给live的sink。
+    """
+    def __init__(self, *sinks: EventSink):
+        self.sinks = list(sinks)
+        self.live = any(sink.live for sink in self.sinks)
+
+    def write(self, event: Dict):
+        token = event.get("type") == "token"
+        for sink in self.sinks:
+            if sink.live or not token:
+                sink.write(event)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class JsonlSink(EventSink):
+    """
+    紧凑JSONL输出。write只把事件放入有界队列，由后台线程批量序列化并写入文件，
+    队列满时write阻塞，因此内存占用有上限。
+    """
+    _STOP = object()
+
+    def __init__(self, path: str, compression: Optional[str] = None, level: Optional[int] = None,
+                 max_queue: int = 10000, batch_size: int = 512):
+        self.path = path
+        self.batch_size = batch_size
+        self._stream = open_stream(path, "wb", compression, level)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._error: Optional[BaseException] = None
+        self._stream_failed = False  # 写文件出错后不再写入；单个事件无法序列化不影响其他事件
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="jsonl-sink", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            stop = False
+            for entry in batch:
+                if entry is self._STOP:
+                    stop = True
+                elif isinstance(entry, threading.Event):
+                    # flush请求：先写出已收集的行再通知
+                    self._write_lines(lines)
+                    lines = []
+                    self._flush_stream()
+                    entry.set()
+                else:
+                    try:
+                        lines.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+                    except (TypeError, ValueError) as e:
+                        # 无法序列化的事件（如set）跳过并记录错误，写线程继续处理后面的事件
+                        if self._error is None:
+                            self._error = e
+            self._write_lines(lines)
+            if stop:
+                return
+
+    def _write_lines(self, lines):
+        if lines and not self._stream_failed:
+            try:
+                self._stream.write(("\n".join(lines) + "\n").encode("utf-8"))
+            except Exception as e:
+                self._stream_failed = True
+                self._error = e
+
+    def _flush_stream(self):
+        if not self._stream_failed:
+            try:
+                self._stream.flush()
+            except Exception as e:
+                self._stream_failed = True
+                self._error = e
+
+    def _check_writer(self):
+        if not self._thread.is_alive():
+            raise RuntimeError("JsonlSink writer thread has stopped") from self._error
+
+    def _put(self, item):
+        """
+        放入队列；队列满时边等边检查写线程，写线程意外退出后不再无限阻塞。
+        """
+        while True:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                self._check_writer()
+
+    def write(self, event: Dict):
+        if self._closed:
+            raise ValueError("write to closed JsonlSink")
+        self._put(event)
+
+    def flush(self):
+        """
+        等待之前写入的事件全部落盘。
+        """
+        if self._closed:
+            return
+        self._check_writer()
+        done = threading.Event()
+        self._put(done)
+        while not done.wait(0.5):
+            self._check_writer()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        stopped = not self._thread.is_alive()
+        if not stopped:
+            self._put(self._STOP)
+            self._thread.join()
+        self._stream.close()
+        if self._error is not None:
+            raise self._error
+        if stopped:
+            raise RuntimeError("JsonlSink writer thread has stopped")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
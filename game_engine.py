@@ -1,51 +1,154 @@
+import json
 import random
 import re
-from typing import List, Dict, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Generator, Callable, Tuple, Union
 from roles import Role, get_role_info
 from player_agent import LLMPlayerAgent
 from logger import GameLogger
-import json
+from event_sink import QUIET
+from game_state import GameState
+from agents import AgentBackend, AgentContext, LLMAgent
+from metrics import GameMetrics
+from history_store import HistoryStore
+from history_compactor import CompactionConfig, HistoryCompactor
+from decoding import DEFAULT_PROFILES, DecodingProfile, choices_for, parse_poison
+from budget import BudgetGovernor
+from lobby import Lobby, LobbyConfig
 
-def extract_player_id(text, candidates):
+def find_player_id(text, candidates) -> Optional[int]:
     """
-    从LLM返回文本中提取player_id，优先返回candidates中的数字。
+    返回文本中第一个属于candidates的数字，没有时返回None。
     """
     numbers = re.findall(r'\d+', text)
     for num in numbers:
         if int(num) in candidates:
             return int(num)
+    return None
+
+def extract_player_id(text, candidates):
+    """
+    从LLM返回文本中提取player_id，优先返回candidates中的数字。
+    """
+    player_id = find_player_id(text, candidates)
     # fallback: 返回第一个候选
-    return candidates[0]
+    return candidates[0] if player_id is None else player_id
+
+_INT_RE = re.compile(r'\s*[+-]?\d+\s*')
+CHECKPOINT_VERSION = 1  # checkpoint_state()的格式版本
+
+class LLMCall:
+    """
+    一次待执行的LLM调用。candidates不为空时走投票接口，否则走发言接口。
+    prompt可以是无参函数，第一次读取时才生成（非LLM后端通常用不到prompt）；
+    引擎保证在本批调用返回后、历史追加新事件之前读取。
+    targets为本次行动的可选目标（夜晚行动、猎人开枪、投票），供非LLM后端使用。
+    """
+    def __init__(self, player: LLMPlayerAgent, phase: str, prompt: Union[str, Callable[[], str]],
+                 candidates: Optional[List[int]] = None, history: Optional[List[Dict]] = None,
+                 tokens: Optional[int] = None, targets: Optional[List[int]] = None):
+        self.player = player
+        self.phase = phase
+        self._prompt = prompt
+        self.candidates = candidates
+        self.history = history if history is not None else []
+        self.tokens = tokens  # prompt的token数（仅在启用历史压缩时统计）
+        self.targets = targets if targets is not None else candidates
+        self.latency: Optional[float] = None  # 调用耗时（秒），仅在启用埋点时记录
+        self.completion = None  # 真实LLM调用的llm_client.Completion（含用量、重试次数）
+        self.profile: Optional[DecodingProfile] = None  # 该类调用的解码配置，分发前由引擎设置
+        self.model: Optional[str] = None  # 预算降级后改用的模型，None表示使用座位的模型
+        self.on_token: Optional[Callable[[Optional[str]], None]] = None  # 流式发言的回调（有实时观战时由引擎设置）
+
+    @property
+    def prompt(self) -> str:
+        if not isinstance(self._prompt, str):
+            self._prompt = self._prompt()
+        return self._prompt
+
+    @property
+    def choices(self) -> Optional[List[str]]:
+        """
+        允许的回答（见decoding.choices_for），用于约束LLM输出。
+        """
+        return choices_for(self.phase, self.targets)
 
 class GameEngine:
     """
     游戏引擎，负责狼人杀流程控制。
     """
-    def __init__(self, num_players: int, role_distribution: Dict[Role, int], language: str = 'en'):
+    def __init__(self, num_players: int, role_distribution: Dict[Role, int], language: str = 'en',
+                 max_workers: int = 1, seed: Optional[int] = None, player_models: Optional[Dict[int, str]] = None,
+                 responder: Optional[Callable[[LLMCall, int], str]] = None,
+                 compaction: Optional[CompactionConfig] = None, logger: Optional[GameLogger] = None,
+                 agents: Union[AgentBackend, Dict[int, AgentBackend], None] = None,
+                 metrics: Optional[GameMetrics] = None, checkpoint: Optional[str] = None,
+                 decoding: Optional[Dict[str, DecodingProfile]] = None, wolf_council: bool = False,
+                 budget: Optional[BudgetGovernor] = None, lobby: Optional[LobbyConfig] = None):
         self.num_players = num_players
         self.role_distribution = role_distribution
+        # 每局独立的随机数生成器，指定seed时身份分配可复现
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # 座位 -> 模型名，未指定的座位使用llm_api中的默认模型
+        self.player_models = player_models or {}
         self.players: List[LLMPlayerAgent] = []
-        self.logger = GameLogger()
+        self.state: Optional[GameState] = None  # 存活位图、身份索引和女巫/预言家状态，assign_roles时创建
+        self.logger = logger if logger is not None else GameLogger()
         self.round = 0
-        self.history: List[Dict] = []  # 记录每一轮的事件
+        self.history = HistoryStore()  # 记录每一轮的事件，按可见性增量维护
         self.language = language
+        # 同一阶段内相互独立的LLM调用的最大并发数，1表示顺序执行
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 可选的应答函数responder(call, round) -> str，设置后代替玩家的LLM调用（如日志回放）
+        self.responder = responder
+        # 可选的历史压缩与prompt token预算，None表示白天prompt携带完整历史
+        self.compactor = HistoryCompactor(compaction) if compaction is not None else None
+        # 非LLM的agent后端（见agents.py）：座位 -> 后端，或一个后端用于所有座位；未指定的座位调用LLM
+        self.agents = agents
+        self._agent_memo: Dict = {}  # 后端在一局内共享的缓存（如对公开历史的分析）
+        self._agent_seed: Optional[int] = None
+        self._agent_rngs: Dict[int, random.Random] = {}
+        # 可选的性能埋点（见metrics.py）：调用延迟、用量、解析回退、各阶段耗时，结束时写入日志
+        self.metrics = metrics
+        # 设置后每个阶段结束时写出检查点（见checkpoint.py），可从中断处恢复
+        self.checkpoint = checkpoint
+        # 阶段 -> 解码配置（见decoding.py），决策调用只生成几个token；没有配置的阶段使用LLMClient的默认参数
+        self.decoding = decoding if decoding is not None else DEFAULT_PROFILES
+        # 狼人议会：每个存活的狼人各自给出杀人目标（同批并发），按多数决定，平票时取座位靠前的狼人的选择；
+        # 关闭时只询问第一个狼人
+        self.wolf_council = wolf_council
+        # 可选的token/费用预算（见budget.py）：软上限后改用便宜模型，硬上限后LLM座位改用启发式后端
+        self.budget = budget
+        # 大厅模式（见lobby.py）：分桌讨论、有界的历史视图、多个狼群/预言家/女巫，用于30-200人的对局
+        self.lobby = Lobby(lobby) if lobby is not None else None
+        self.next_phase: Optional[str] = None  # 下一个要执行的阶段："night"、"day"，结束后为None
+        self.pause_at: Optional[Tuple[int, str]] = None  # run_until()的停止点：(轮次, 阶段)开始之前
 
-    def assign_roles(self):
+    def assign_roles(self, roles: Optional[List[Role]] = None):
         """
-        随机分配身份。
+        随机分配身份。传入roles时按座位顺序直接使用（如回放已有日志）。
         """
-        roles = []
-        for role, count in self.role_distribution.items():
-            roles.extend([role] * count)
-        random.shuffle(roles)
-        self.players = [LLMPlayerAgent(i, roles[i]) for i in range(self.num_players)]
+        if roles is None:
+            roles = []
+            for role, count in self.role_distribution.items():
+                roles.extend([role] * count)
+            if len(roles) != self.num_players:
+                raise ValueError(f"role_distribution has {len(roles)} roles for {self.num_players} players")
+            self.rng.shuffle(roles)
+        # 使用非LLM后端的座位把后端名记为模型名，便于按模型统计胜率
+        self.players = [LLMPlayerAgent(i, roles[i], model=self.player_models.get(i) or self._agent_label(i))
+                        for i in range(self.num_players)]
+        self.state = GameState(self.players)
         self.logger.log_roles(self.players)
 
     def get_alive_players(self) -> List[LLMPlayerAgent]:
         """
         获取存活玩家列表。
         """
-        return [p for p in self.players if p.is_alive]
+        return self.state.alive_players() if self.state is not None else []
 
     def get_role_prompt(self, role: Role) -> str:
         """
@@ -152,12 +255,215 @@ class GameEngine:
             else:
                 return "You are a player in the game. Please act according to your role and the game rules."
 
+    def agent_for(self, player_id: int) -> Optional[AgentBackend]:
+        """
+        该座位使用的非LLM后端，None表示调用LLM。预算达到硬上限后，原本调用LLM的座位改用预算的后备后端。
+        """
+        if self.agents is None or isinstance(self.agents, AgentBackend):
+            agent = self.agents
+        else:
+            agent = self.agents.get(player_id)
+        if self.budget is not None and self.budget.exhausted and (agent is None or isinstance(agent, LLMAgent)):
+            return self.budget.agent
+        return agent
+
+    def _agent_label(self, player_id: int) -> Optional[str]:
+        agent = self.agent_for(player_id)
+        return agent.name if agent is not None and agent.name != "llm" else None
+
+    def agent_context(self, call: LLMCall) -> AgentContext:
+        """
+        构造非LLM后端可见的信息：公开历史加上该玩家身份可知的私有信息。
+        每个座位有独立的随机数生成器，同一座位的调用总是依次发生，因此结果与并发执行的顺序无关。
+        """
+        player = call.player
+        state = self.state
+        rng = self._agent_rngs.get(player.player_id)
+        if rng is None:
+            if self._agent_seed is None:
+                self._agent_seed = self.seed if self.seed is not None else random.getrandbits(64)
+            rng = self._agent_rngs[player.player_id] = random.Random(hash((self._agent_seed, player.player_id)))
+        return AgentContext(
+            round_num=self.round,
+            phase=call.phase,
+            player=player,
+            targets=call.targets or [],
+            alive=state.alive_ids(),
+            public=self.history.public,
+            teammates=[p.player_id for p in state.alive_with_role(Role.WOLF)] if player.role == Role.WOLF else None,
+            seer_checks=state.seers[player.player_id].checks if player.player_id in state.seers else None,
+            witch=state.witches.get(player.player_id),
+            rng=rng,
+            memo=self._agent_memo,
+        )
+
+    def _respond(self, call: LLMCall) -> str:
+        """
+        取得一次调用的回复文本。优先使用responder，其次是该座位的agent后端，否则调用LLM。
+        """
+        call.profile = self.decoding.get(call.phase)
+        if self.responder is not None:
+            return self.responder(call, self.round)
+        if self.budget is not None:
+            call.model = self.budget.model_for(call.phase, call.player.model)
+        self._stream_speech(call)
+        agent = self.agent_for(call.player.player_id)
+        if agent is not None:
+            response = agent.respond(call, self.agent_context(call))
+        else:
+            call.completion = call.player.complete(call.prompt, call.profile, call.choices, call.model,
+                                                   call.on_token)
+            response = call.completion.text
+        if self.budget is not None and call.completion is not None:
+            self.budget.record(call.completion)
+        return response
+
+    def _stream_speech(self, call: LLMCall):
+        """
+        sink实时转发事件时（见live_feed.py），发言调用以流式生成，token随生成写出。
+        """
+        if call.phase == "day_speech" and self.logger.streams_tokens:
+            call.on_token = self.logger.token_stream(call.player.player_id, self.round, call.phase)
+
+    def _source(self, call: LLMCall) -> str:
+        if self.responder is not None:
+            return "responder"
+        agent = self.agent_for(call.player.player_id)
+        return agent.name if agent is not None else "llm"
+
+    def _model_label(self, call: LLMCall) -> str:
+        if call.completion is not None:
+            return call.completion.model
+        return call.player.model or "default"
+
+    def _record_call(self, call: LLMCall, start: float, error: Optional[BaseException] = None):
+        call.latency = time.perf_counter() - start
+        self.metrics.record_call(call.phase, self._model_label(call), self._source(call), call.latency,
+                                 completion=call.completion, error=error)
+
+    def _timed_respond(self, call: LLMCall) -> str:
+        start = time.perf_counter()
+        try:
+            response = self._respond(call)
+        except Exception as e:
+            self._record_call(call, start, e)
+            raise
+        self._record_call(call, start)
+        return response
+
+    def _invoke(self, call: LLMCall):
+        """
+        执行单个LLM调用（发言或投票），投票调用返回解析后的玩家id。
+        """
+        response = self._respond(call) if self.metrics is None else self._timed_respond(call)
+        return self._parse_response(call, response)
+
+    def _parse_response(self, call: LLMCall, response):
+        if call.candidates is not None:
+            vote = call.player.parse_vote(response, call.candidates)
+            if self.metrics is not None and not _INT_RE.fullmatch(str(response)):
+                self._note_fallback(call)
+            return vote
+        return response
+
+    def _note_fallback(self, call: LLMCall):
+        """
+        记录一次解析回退（回复中找不到有效目标，按默认规则处理）。
+        """
+        if self.metrics is not None:
+            self.metrics.record_fallback(call.phase, self._model_label(call))
+
+    def _extract(self, call: LLMCall, response: str, candidates: List[int]) -> int:
+        """
+        extract_player_id的埋点版本：回退到candidates[0]时记录解析回退。
+        """
+        player_id = find_player_id(response, candidates)
+        if player_id is None:
+            self._note_fallback(call)
+            return candidates[0]
+        return player_id
+
+    def _log_call(self, call: LLMCall, response):
+        """
+        记录一次调用的prompt和回复。日志不保留prompt时跳过，避免为此生成延迟的prompt。
+        启用埋点时同时记录延迟、实际服务的模型、用量和尝试次数。
+        """
+        if self.logger.records_prompts:
+            stats = None
+            if call.latency is not None:
+                stats = {"latency": round(call.latency, 6), "model": self._model_label(call)}
+                completion = call.completion
+                if completion is not None:
+                    stats["usage"] = {"prompt_tokens": completion.prompt_tokens,
+                                      "completion_tokens": completion.completion_tokens}
+                    stats["attempts"] = completion.attempts
+                    stats["cached"] = completion.cached
+            self.logger.log_prompt(call.player.player_id, self.round, call.phase, call.prompt, response,
+                                   tokens=call.tokens, stats=stats)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="werewolf-llm")
+        return self._executor
+
+    def execute_calls(self, calls: List[LLMCall]) -> list:
+        """
+        执行一批相互独立的LLM调用，按传入顺序返回结果。
+        max_workers > 1 时并发执行，否则顺序执行。
+        """
+        if self.max_workers > 1 and len(calls) > 1:
+            return list(self._get_executor().map(self._invoke, calls))
+        return [self._invoke(call) for call in calls]
+
+    def _drive(self, steps: Generator):
+        """
+        驱动阶段生成器：生成器每次yield一批独立的LLMCall，
+        这里执行后把结果按顺序send回去，直到阶段结束并返回其结果。
+        """
+        try:
+            calls = next(steps)
+            while True:
+                if self.budget is not None:
+                    self._check_budget()
+                try:
+                    results = self.execute_calls(calls)
+                except BaseException as e:
+                    # 把异常抛回生成器，让其中的finally（关闭、埋点）及时执行
+                    calls = steps.throw(e)
+                    continue
+                calls = steps.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+    def _check_budget(self):
+        """
+        在两批调用之间检查预算，越过上限时切换级别并把切换写入日志。
+        """
+        models = [p.model for p in self.players
+                  if self.responder is None and p.is_alive and self.agent_for(p.player_id) is None]
+        event = self.budget.update(models)
+        if event is not None:
+            log = {"round": self.round}
+            log.update(event)
+            self.logger.log_event(log)
+
+    def close(self):
+        """
+        释放并发执行用的线程池。
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
     def hunter_shoot(self, hunter: LLMPlayerAgent):
         """
         猎人被淘汰时触发，选择带走一名玩家。
         """
+        return self._drive(self._hunter_steps(hunter))
+
+    def _hunter_steps(self, hunter: LLMPlayerAgent):
         # 获取可选目标（存活且不是自己且不是已死的猎人）
-        candidates = [p.player_id for p in self.get_alive_players() if p.player_id != hunter.player_id]
+        candidates = [pid for pid in self.state.alive_ids() if pid != hunter.player_id]
         if not candidates:
             return None
         # 生成prompt
@@ -171,17 +477,17 @@ class GameEngine:
                 "Alive players: {candidates}. Return the player id only."
             )
         prompt_str = prompt.format(candidates=candidates)
-        response = hunter.make_speech(self.history, prompt_str)
-        self.logger.log_prompt(hunter.player_id, self.round, 'hunter_shoot', prompt_str, response)
+        call = LLMCall(hunter, 'hunter_shoot', prompt_str, history=self.history, targets=candidates)
+        response, = yield [call]
+        self._log_call(call, response)
         # 解析目标
         try:
             target_id = int(re.findall(r'\d+', response)[0])
         except Exception:
             target_id = candidates[0]  # fallback
+            self._note_fallback(call)
         if target_id in candidates:
-            for player in self.players:
-                if player.player_id == target_id:
-                    player.is_alive = False
+            self.state.kill(target_id)
             # 记录日志
             log = {
                 "round": self.round,
@@ -189,99 +495,160 @@ class GameEngine:
                 "hunter": hunter.player_id,
                 "target": target_id
             }
-            self.logger.logs.append(log)
+            self.logger.log_event(log)
         return target_id
 
     def night_phase(self):
         """
         夜晚阶段，狼人杀人，预言家查验等。
+        狼人与预言家的调用互不依赖，并发模式下同时发出；
+        女巫的解药和毒药只依赖狼人目标，也作为一批发出。
+        """
+        return self._drive(self._night_steps())
+
+    def _wolf_calls(self, pack: List[LLMPlayerAgent], candidates: List[int]) -> List[LLMCall]:
+        """
+        一个狼群的杀人调用：默认只询问第一个狼人，狼人议会时询问群中每个狼人。
         """
-        wolves = [p for p in self.get_alive_players() if p.role == Role.WOLF]
-        villagers = [p for p in self.get_alive_players() if p.role != Role.WOLF]
-        if not wolves or not villagers:
-            return None, None
-        # 1. 狼人杀人
         wolf_prompt = (
             self.get_role_prompt(Role.WOLF) +
             "\nTonight, choose a player to kill. "
             "Alive players: {villagers}. Return the player id only."
         )
-        candidates = [v.player_id for v in villagers]
         wolf_prompt_str = wolf_prompt.format(villagers=candidates)
-        response = wolves[0].make_speech(
-            game_history=self.history,
-            prompt_template=wolf_prompt_str
+        council = pack if self.wolf_council and len(pack) > 1 else pack[:1]
+        calls = []
+        for wolf in council:
+            prompt = wolf_prompt_str
+            if len(council) > 1:
+                partners = [w.player_id for w in pack if w is not wolf]
+                prompt += (f"\nYou are player {wolf.player_id}; your fellow wolves are {partners}. "
+                           "The pack kills the player chosen by the most wolves.")
+            calls.append(LLMCall(wolf, 'night_wolf', prompt, history=self.history, targets=candidates))
+        return calls
+
+    def _wolf_target(self, calls: List[LLMCall], responses: list, candidates: List[int]):
+        """
+        解析一个狼群的回复，返回(杀人目标, 各狼人的选择)。
+        """
+        wolf_votes = {}
+        for call, response in zip(calls, responses):
+            self._log_call(call, response)
+            wolf_votes[call.player.player_id] = self._extract(call, response, candidates)
+        kill_count = {}
+        for target in wolf_votes.values():
+            kill_count[target] = kill_count.get(target, 0) + 1
+        # 平票时max取先计入的目标，即座位靠前的狼人的选择
+        return max(kill_count, key=kill_count.get), wolf_votes
+
+    def _seer_call(self, seer: LLMPlayerAgent) -> LLMCall:
+        seer_candidates = [pid for pid in self.state.alive_ids() if pid != seer.player_id]
+        seer_prompt = (
+            self.get_role_prompt(Role.SEER) +
+            "\nTonight, you can check the true identity of one player. "
+            "Alive players: {candidates}. Return the player id only."
         )
-        self.logger.log_prompt(wolves[0].player_id, self.round, 'night_wolf', wolf_prompt_str, response)
-        wolf_target = extract_player_id(response, candidates)
-        # 2. 预言家查验身份
-        seers = [p for p in self.get_alive_players() if p.role == Role.SEER]
+        seer_prompt_str = seer_prompt.format(candidates=seer_candidates)
+        return LLMCall(seer, 'night_seer', seer_prompt_str, history=self.history, targets=seer_candidates)
+
+    def _seer_result(self, call: LLMCall, response) -> Dict:
+        """
+        解析查验回复，记入该预言家的查验记录并返回{"checked_id", "result"}。
+        """
+        self._log_call(call, response)
+        seer_check_id = self._extract(call, response, call.targets)
+        checked_player = self.state.player(seer_check_id)
+        # 只返回好人/坏人
+        camp = get_role_info(checked_player.role).get('camp', '')
+        if camp == '狼人阵营':
+            seer_result = {"checked_id": seer_check_id, "result": "Bad"}
+        else:
+            seer_result = {"checked_id": seer_check_id, "result": "Good"}
+        self.state.seers[call.player.player_id].checks.append(seer_result)
+        return seer_result
+
+    def _witch_calls(self, witch: LLMPlayerAgent, attacked: int) -> List[LLMCall]:
+        """
+        女巫的解药与毒药调用（只包含还没用过的药），attacked为告诉她的被刀玩家。
+        """
+        witch_state = self.state.witches[witch.player_id]
+        witch_calls = []
+        # 解药
+        if not witch_state.save_used:
+            save_prompt = (
+                self.get_role_prompt(Role.WITCH) +
+                f"\nTonight, player {attacked} was attacked by the werewolves. "
+                "Do you want to use your healing potion to save them? Answer 'yes' or 'no'."
+            )
+            witch_calls.append(LLMCall(witch, 'night_witch_save', save_prompt, history=self.history,
+                                       targets=[attacked]))
+        # 毒药
+        if not witch_state.poison_used:
+            poison_candidates = [pid for pid in self.state.alive_ids() if pid != witch.player_id and pid != attacked]
+            if poison_candidates:
+                poison_prompt = (
+                    self.get_role_prompt(Role.WITCH) +
+                    f"\nYou may use your poison potion tonight. "
+                    f"Alive players (excluding yourself and the attacked): {poison_candidates}. "
+                    "If you want to use poison, return the player id to poison. If not, return 'no'."
+                )
+                witch_calls.append(LLMCall(witch, 'night_witch_poison', poison_prompt, history=self.history,
+                                           targets=poison_candidates))
+        return witch_calls
+
+    def _witch_results(self, witch_calls: List[LLMCall], witch_responses: list) -> Tuple[bool, Optional[int]]:
+        """
+        解析女巫的回复并更新药水状态，返回(是否用解药, 毒药目标)。
+        """
+        witch_save = False
+        witch_poison_id = None
+        for call, witch_response in zip(witch_calls, witch_responses):
+            self._log_call(call, witch_response)
+            witch_state = self.state.witches[call.player.player_id]
+            if call.phase == 'night_witch_save':
+                if "yes" in witch_response.lower():
+                    witch_save = True
+                    witch_state.save_used = True
+            else:
+                poison_id = parse_poison(witch_response, call.targets)
+                if poison_id is not None:
+                    witch_poison_id = poison_id
+                    witch_state.poison_used = True
+                elif self.metrics is not None and find_player_id(witch_response, call.targets) is not None:
+                    # 回复提到了目标但无法确定是否用药，按不用毒药处理
+                    self._note_fallback(call)
+        return witch_save, witch_poison_id
+
+    def _night_steps(self):
+        if self.lobby is not None:
+            return (yield from self._lobby_night_steps())
+        state = self.state
+        wolves = state.alive_with_role(Role.WOLF)
+        villagers = state.alive_without_role(Role.WOLF)
+        if not wolves or not villagers:
+            return None, None
+        # 1. 狼人杀人
+        candidates = [v.player_id for v in villagers]
+        calls = self._wolf_calls(wolves, candidates)
+        council = len(calls)
+        # 2. 预言家查验身份（与狼人目标无关，同批执行）
+        seers = state.alive_with_role(Role.SEER)
+        if seers:
+            calls.append(self._seer_call(seers[0]))
+        responses = yield calls
+        wolf_target, wolf_votes = self._wolf_target(calls[:council], responses[:council], candidates)
         seer_result = None
         if seers:
-            seer = seers[0]
-            seer_candidates = [p.player_id for p in self.get_alive_players() if p.player_id != seer.player_id]
-            seer_prompt = (
-                self.get_role_prompt(Role.SEER) +
-                "\nTonight, you can check the true identity of one player. "
-                "Alive players: {candidates}. Return the player id only."
-            )
-            seer_prompt_str = seer_prompt.format(candidates=seer_candidates)
-            seer_response = seer.make_speech(self.history, seer_prompt_str)
-            self.logger.log_prompt(seer.player_id, self.round, 'night_seer', seer_prompt_str, seer_response)
-            seer_check_id = extract_player_id(seer_response, seer_candidates)
-            checked_player = next((p for p in self.players if p.player_id == seer_check_id), None)
-            if checked_player:
-                # 只返回好人/坏人
-                camp = get_role_info(checked_player.role).get('camp', '')
-                if camp == '狼人阵营':
-                    seer_result = {"checked_id": seer_check_id, "result": "Bad"}
-                else:
-                    seer_result = {"checked_id": seer_check_id, "result": "Good"}
-                # 记录查验结果到seer.extra_info['all_checks']
-                if "all_checks" not in seer.extra_info:
-                    seer.extra_info["all_checks"] = []
-                seer.extra_info["all_checks"].append(seer_result)
-                seer.extra_info["last_check"] = seer_result
+            seer_result = self._seer_result(calls[council], responses[council])
         # 3. 女巫用药
-        witches = [p for p in self.get_alive_players() if p.role == Role.WITCH]
+        witches = state.alive_with_role(Role.WITCH)
+        witch_state = state.witches[witches[0].player_id] if witches else None
         witch_save = False
         witch_poison_id = None
         if witches:
-            witch = witches[0]
-            # 初始化女巫药水使用情况
-            if "save_used" not in witch.extra_info:
-                witch.extra_info["save_used"] = False
-            if "poison_used" not in witch.extra_info:
-                witch.extra_info["poison_used"] = False
-            # 解药
-            if not witch.extra_info["save_used"]:
-                save_prompt = (
-                    self.get_role_prompt(Role.WITCH) +
-                    f"\nTonight, player {wolf_target} was attacked by the werewolves. "
-                    "Do you want to use your healing potion to save them? Answer 'yes' or 'no'."
-                )
-                save_response = witch.make_speech(self.history, save_prompt)
-                self.logger.log_prompt(witch.player_id, self.round, 'night_witch_save', save_prompt, save_response)
-                if "yes" in save_response.lower():
-                    witch_save = True
-                    witch.extra_info["save_used"] = True
-            # 毒药
-            if not witch.extra_info["poison_used"]:
-                poison_candidates = [p.player_id for p in self.get_alive_players() if p.player_id != witch.player_id and p.player_id != wolf_target]
-                if poison_candidates:
-                    poison_prompt = (
-                        self.get_role_prompt(Role.WITCH) +
-                        f"\nYou may use your poison potion tonight. "
-                        f"Alive players (excluding yourself and the attacked): {poison_candidates}. "
-                        "If you want to use poison, return the player id to poison. If not, return 'no'."
-                    )
-                    poison_response = witch.make_speech(self.history, poison_prompt)
-                    self.logger.log_prompt(witch.player_id, self.round, 'night_witch_poison', poison_prompt, poison_response)
-                    if poison_response.strip().isdigit():
-                        poison_id = int(poison_response.strip())
-                        if poison_id in poison_candidates:
-                            witch_poison_id = poison_id
-                            witch.extra_info["poison_used"] = True
+            witch_calls = self._witch_calls(witches[0], wolf_target)
+            witch_responses = (yield witch_calls) if witch_calls else []
+            witch_save, witch_poison_id = self._witch_results(witch_calls, witch_responses)
         # 结算死亡
         killed = None
         poisoned = None
@@ -290,45 +657,124 @@ class GameEngine:
             killed = wolf_target
         if witch_poison_id is not None:
             poisoned = witch_poison_id
-            # 立即死亡
-            for player in self.players:
-                if player.player_id == poisoned:
-                    # 猎人被毒死
-                    if player.role == Role.HUNTER and player.is_alive:
-                        player.is_alive = False
-                        hunter_to_shoot.append(player)
-                    else:
-                        player.is_alive = False
+            # 立即死亡，猎人被毒死时开枪
+            if state.kill(poisoned) and state.player(poisoned).role == Role.HUNTER:
+                hunter_to_shoot.append(state.player(poisoned))
         if killed is not None:
-            for player in self.players:
-                if player.player_id == killed:
-                    # 猎人被狼杀
-                    if player.role == Role.HUNTER and player.is_alive:
-                        player.is_alive = False
-                        hunter_to_shoot.append(player)
-                    else:
-                        player.is_alive = False
+            # 猎人被狼杀时开枪
+            if state.kill(killed) and state.player(killed).role == Role.HUNTER:
+                hunter_to_shoot.append(state.player(killed))
         # 处理猎人开枪
         for hunter in hunter_to_shoot:
-            self.hunter_shoot(hunter)
+            yield from self._hunter_steps(hunter)
         # 日志
         log = {
             "round": self.round,
             "phase": "night",
             "wolves": [w.player_id for w in wolves],
             "killed": killed,
+            **({"wolf_votes": wolf_votes} if council > 1 else {}),
             "seer_check": seer_result,  # 预言家查验结果（player_id, Good/Bad）
             "witch_action": {
-                "save_used": witches[0].extra_info["save_used"] if witches else None,
-                "save_target": wolf_target if witches and "save_used" in witches[0].extra_info and witches[0].extra_info["save_used"] else None,
-                "poison_used": witches[0].extra_info["poison_used"] if witches else None,
-                "poison_target": witch_poison_id if witches and "poison_used" in witches[0].extra_info and witches[0].extra_info["poison_used"] else None
+                "save_used": witch_state.save_used if witches else None,
+                "save_target": wolf_target if witches and witch_state.save_used else None,
+                "poison_used": witch_state.poison_used if witches else None,
+                "poison_target": witch_poison_id if witches and witch_state.poison_used else None
             }
         }
         self.logger.log_night(self.round, wolves, killed, log)
         self.history.append(log)
         return killed, poisoned
 
+    def _lobby_night_steps(self):
+        """
+        大厅模式的夜晚：每个狼群各杀一人，所有狼群和预言家的调用同批发出；
+        每个女巫被告知一个被刀的玩家（依次分配），所有女巫的调用作为第二批发出。
+        """
+        state = self.state
+        wolves = state.alive_with_role(Role.WOLF)
+        villagers = state.alive_without_role(Role.WOLF)
+        if not wolves or not villagers:
+            return None, None
+        candidates = [v.player_id for v in villagers]
+        packs = self.lobby.packs(wolves)
+        calls, spans = [], []
+        for pack in packs:
+            pack_calls = self._wolf_calls(pack, candidates)
+            spans.append((len(calls), len(calls) + len(pack_calls)))
+            calls.extend(pack_calls)
+        seers = state.alive_with_role(Role.SEER)
+        seer_start = len(calls)
+        calls.extend(self._seer_call(seer) for seer in seers)
+        responses = yield calls
+        kills, wolf_votes = [], {}
+        for pack, (start, end) in zip(packs, spans):
+            target, votes = self._wolf_target(calls[start:end], responses[start:end], candidates)
+            kills.append({"pack": [w.player_id for w in pack], "target": target})
+            if end - start > 1:
+                wolf_votes.update(votes)
+        seer_checks = []
+        for call, response in zip(calls[seer_start:], responses[seer_start:]):
+            seer_checks.append(dict(self._seer_result(call, response), seer=call.player.player_id))
+        # 多个狼群可能选中同一人
+        attacked = list(dict.fromkeys(kill["target"] for kill in kills))
+        witches = state.alive_with_role(Role.WITCH)
+        witch_calls, assigned = [], []
+        for i, witch in enumerate(witches):
+            target = attacked[i % len(attacked)]
+            calls_for_witch = self._witch_calls(witch, target)
+            witch_calls.extend(calls_for_witch)
+            assigned.append((witch, target, len(calls_for_witch)))
+        witch_responses = (yield witch_calls) if witch_calls else []
+        saved, poisoned, witch_actions = set(), [], []
+        offset = 0
+        for witch, target, count in assigned:
+            save, poison = self._witch_results(witch_calls[offset:offset + count],
+                                               witch_responses[offset:offset + count])
+            offset += count
+            if save:
+                saved.add(target)
+            if poison is not None:
+                poisoned.append(poison)
+            witch_actions.append({"witch": witch.player_id, "attacked": target, "saved": save,
+                                  "poison_target": poison})
+        killed = [t for t in attacked if t not in saved]
+        hunter_to_shoot = []
+        for pid in list(dict.fromkeys(poisoned)) + killed:
+            if state.kill(pid) and state.player(pid).role == Role.HUNTER:
+                hunter_to_shoot.append(state.player(pid))
+        for hunter in hunter_to_shoot:
+            yield from self._hunter_steps(hunter)
+        log = {
+            "round": self.round,
+            "phase": "night",
+            "wolves": [w.player_id for w in wolves],
+            "kills": kills,
+            "killed": killed,
+            "poisoned": list(dict.fromkeys(poisoned)),
+            **({"wolf_votes": wolf_votes} if wolf_votes else {}),
+            "seer_checks": seer_checks,
+            "witch_actions": witch_actions,
+        }
+        self.logger.log_night(self.round, wolves, killed, log)
+        self.history.append(log)
+        return killed, log["poisoned"]
+
+    def _private_history(self, player: LLMPlayerAgent) -> list:
+        """
+        该玩家独有的信息：预言家的查验结果、女巫的用药情况。
+        """
+        private = []
+        # 预言家查验信息
+        seer_state = self.state.seers.get(player.player_id)
+        if seer_state is not None and seer_state.checks:
+            private.append({'seer_checks': seer_state.checks})
+        # 女巫用药信息
+        witch_state = self.state.witches.get(player.player_id)
+        if witch_state is not None:
+            private.append({'witch_info': witch_state.info()})
+        return private
+
     def get_player_history(self, player: LLMPlayerAgent) -> list:
         """
         构造该玩家视角下可见的历史信息（视角隔离）。
@@ -336,53 +782,96 @@ class GameEngine:
         - 预言家额外看到自己的查验结果
         - 女巫额外看到自己的用药情况
         """
-        visible = []
-        for log in self.history:
-            if log.get('phase') in ['day_speech', 'day_vote', 'result']:
-                visible.append(log)
-        # 预言家查验信息
-        if player.role == Role.SEER and 'all_checks' in player.extra_info:
-            visible.append({'seer_checks': player.extra_info['all_checks']})
-        # 女巫用药信息
-        if player.role == Role.WITCH:
-            witch_info = {}
-            if 'save_used' in player.extra_info:
-                witch_info['save_used'] = player.extra_info['save_used']
-            if 'poison_used' in player.extra_info:
-                witch_info['poison_used'] = player.extra_info['poison_used']
-            if witch_info:
-                visible.append({'witch_info': witch_info})
-        return visible
+        return self.history.view(self._private_history(player))
+
+    def get_player_history_json(self, player: LLMPlayerAgent) -> str:
+        """
+        get_player_history的JSON序列化。公开部分在事件追加时已序列化并缓存，这里只拼接私有信息。
+        """
+        return self.history.view_json(self._private_history(player))
+
+    def build_history_prompt(self, player: LLMPlayerAgent, render: Callable[[str], str], lazy: bool = False):
+        """
+        用该玩家可见的历史生成prompt。render(history_json) -> prompt。
+        启用压缩时历史会被压缩到token预算内，并返回prompt的token数；否则token数为None。
+        lazy=True且未启用压缩时，prompt以无参函数返回，读取时才生成（见LLMCall）。
+        返回(prompt, 历史视图, token数)。
+        大厅模式下使用Lobby.view()的有界视图代替完整历史。
+        """
+        if self.lobby is not None:
+            view = self.lobby.view(self.history, player.player_id, self.round, self.state.count_alive(),
+                                   self._private_history(player))
+            if lazy:
+                return (lambda: render(json.dumps(view, ensure_ascii=False))), view, None
+            return render(json.dumps(view, ensure_ascii=False)), view, None
+        if self.compactor is None:
+            if lazy:
+                return (lambda: render(self.get_player_history_json(player))), self.get_player_history(player), None
+            return render(self.get_player_history_json(player)), self.get_player_history(player), None
+        return self.compactor.fit(self.history, self._private_history(player), render)
+
+    def _speech_template(self, player: LLMPlayerAgent) -> str:
+        """
+        白天发言的prompt模板，历史位置保留为{history}。
+        """
+        # 预言家所有查验结果提示
+        seer_info = ""
+        seer_state = self.state.seers.get(player.player_id)
+        if seer_state is not None:
+            checks = seer_state.checks
+            if checks:
+                check_lines = [f"Player {c['checked_id']}: {c['result']}" for c in checks]
+                seer_info = "\n[You have checked the following players: " + ", ".join(check_lines) + ". Only you know this information.]"
+        speech_prompt = (
+            self.get_role_prompt(player.role) +
+            seer_info +
+            "\nYou are player {player_id} (role hidden). Please make a short speech about your thoughts. "
+            "Game history: {history}"
+        )
+        return speech_prompt.replace("{player_id}", str(player.player_id))
+
+    def _vote_template(self, player: LLMPlayerAgent, candidates: List[int]) -> str:
+        """
+        投票的prompt模板，历史位置保留为{history}。
+        """
+        vote_prompt = (
+            self.get_role_prompt(player.role) +
+            "\nYou are player {player_id} (role hidden). Vote to eliminate one player from candidates={candidates}. "
+            "Game history: {history}. Return the player id only."
+        )
+        return vote_prompt.replace(
+            "{player_id}", str(player.player_id)
+        ).replace(
+            "{candidates}", str(candidates)
+        )
 
     def day_phase(self):
         """
         白天阶段，玩家发言和投票。
+        发言prompt只包含之前轮次的历史，因此各玩家的发言互相独立，可并发生成；投票同理。
         """
-        speeches = []
+        return self._drive(self._day_steps())
+
+    def _day_steps(self):
+        if self.lobby is not None:
+            return (yield from self._lobby_day_steps())
         alive_players = self.get_alive_players()
+        if not alive_players:
+            # 夜里最后的玩家同时出局（如狼人被毒、好人被刀），白天无人可发言
+            return None
+        speech_calls = []
         for player in alive_players:
-            # 预言家所有查验结果提示
-            seer_info = ""
-            if player.role == Role.SEER and "all_checks" in player.extra_info:
-                checks = player.extra_info["all_checks"]
-                if checks:
-                    check_lines = [f"Player {c['checked_id']}: {c['result']}" for c in checks]
-                    seer_info = "\n[You have checked the following players: " + ", ".join(check_lines) + ". Only you know this information.]"
-            speech_prompt = (
-                self.get_role_prompt(player.role) +
-                seer_info +
-                "\nYou are player {player_id} (role hidden). Please make a short speech about your thoughts. "
-                "Game history: {history}"
-            )
-            player_history = self.get_player_history(player)
-            speech_prompt_str = speech_prompt.replace(
-                "{player_id}", str(player.player_id)
-            ).replace(
-                "{history}", json.dumps(player_history, ensure_ascii=False)
+            # prompt模板也延迟到读取prompt时再生成
+            speech_prompt_str, player_history, tokens = self.build_history_prompt(
+                player, lambda history, player=player: self._speech_template(player).replace("{history}", history),
+                lazy=True
             )
-            speech = player.make_speech(player_history, speech_prompt_str)
-            self.logger.log_prompt(player.player_id, self.round, 'day_speech', speech_prompt_str, speech)
-            speeches.append({"player_id": player.player_id, "speech": speech})
+            speech_calls.append(LLMCall(player, 'day_speech', speech_prompt_str, history=player_history, tokens=tokens))
+        speech_responses = yield speech_calls
+        speeches = []
+        for call, speech in zip(speech_calls, speech_responses):
+            self._log_call(call, speech)
+            speeches.append({"player_id": call.player.player_id, "speech": speech})
         log_speeches = {
             "round": self.round,
             "phase": "day_speech",
@@ -391,42 +880,32 @@ class GameEngine:
         self.logger.log_speeches(self.round, speeches)
         self.history.append(log_speeches)
         # 投票
+        vote_candidates = [p.player_id for p in alive_players]
+        vote_calls = []
         for player in alive_players:
-            vote_prompt = (
-                self.get_role_prompt(player.role) +
-                "\nYou are player {player_id} (role hidden). Vote to eliminate one player from candidates={candidates}. "
-                "Game history: {history}. Return the player id only."
-            )
-            player_history = self.get_player_history(player)
-            vote_prompt_str = vote_prompt.replace(
-                "{player_id}", str(player.player_id)
-            ).replace(
-                "{candidates}", str([p.player_id for p in alive_players])
-            ).replace(
-                "{history}", json.dumps(player_history, ensure_ascii=False)
+            vote_prompt_str, player_history, tokens = self.build_history_prompt(
+                player,
+                lambda history, player=player: self._vote_template(player, vote_candidates).replace("{history}", history),
+                lazy=True
             )
-            response = player.vote([p.player_id for p in alive_players], player_history, vote_prompt_str)
-            self.logger.log_prompt(player.player_id, self.round, 'day_vote', vote_prompt_str, response)
-            vote = extract_player_id(str(response), [p.player_id for p in alive_players])
-            if 'votes' not in locals():
-                votes = {}
-            votes[player.player_id] = vote
+            vote_calls.append(LLMCall(player, 'day_vote', vote_prompt_str, candidates=vote_candidates,
+                                      history=player_history, tokens=tokens))
+        vote_responses = yield vote_calls
+        votes = {}
+        for call, response in zip(vote_calls, vote_responses):
+            self._log_call(call, response)
+            votes[call.player.player_id] = self._extract(call, str(response), vote_candidates)
         vote_count = {}
         for v in votes.values():
             vote_count[v] = vote_count.get(v, 0) + 1
         eliminated = max(vote_count, key=vote_count.get)
         hunter_to_shoot = []  # 记录白天被淘汰的猎人
-        for player in self.players:
-            if player.player_id == eliminated:
-                # 猎人白天被票死
-                if player.role == Role.HUNTER and player.is_alive:
-                    player.is_alive = False
-                    hunter_to_shoot.append(player)
-                else:
-                    player.is_alive = False
+        # 猎人白天被票死时开枪
+        if self.state.kill(eliminated) and self.state.player(eliminated).role == Role.HUNTER:
+            hunter_to_shoot.append(self.state.player(eliminated))
         # 处理猎人开枪
         for hunter in hunter_to_shoot:
-            self.hunter_shoot(hunter)
+            yield from self._hunter_steps(hunter)
         log_votes = {
             "round": self.round,
             "phase": "day_vote",
@@ -437,36 +916,316 @@ class GameEngine:
         self.history.append(log_votes)
         return eliminated
 
+    def _lobby_day_steps(self):
+        """
+        大厅模式的白天：存活玩家随机分桌，各桌的发言人（每桌不超过speakers_per_table人）同批发言；
+        然后所有人投票，候选为全场提名（本轮发言中被提到最多的玩家）加上本桌玩家。
+        """
+        alive_ids = self.state.alive_ids()
+        if not alive_ids:
+            return None
+        lobby = self.lobby
+        tables = lobby.seat(alive_ids, self.rng)
+        speech_calls = []
+        for speakers in lobby.speakers(self.history):
+            for pid in speakers:
+                player = self.state.player(pid)
+                speech_prompt_str, player_history, tokens = self.build_history_prompt(
+                    player, lambda history, player=player: self._speech_template(player).replace("{history}", history),
+                    lazy=True
+                )
+                speech_calls.append(LLMCall(player, 'day_speech', speech_prompt_str, history=player_history,
+                                            tokens=tokens))
+        speech_responses = yield speech_calls
+        speeches = []
+        for call, speech in zip(speech_calls, speech_responses):
+            self._log_call(call, speech)
+            speeches.append({"player_id": call.player.player_id, "table": lobby.table_of[call.player.player_id],
+                             "speech": speech})
+        log_speeches = {
+            "round": self.round,
+            "phase": "day_speech",
+            "tables": tables,
+            "speeches": speeches
+        }
+        self.logger.log_event(log_speeches)
+        self.history.append(log_speeches)
+        # 投票
+        shortlist = lobby.shortlist(speeches, alive_ids)
+        vote_calls = []
+        for pid in alive_ids:
+            player = self.state.player(pid)
+            vote_candidates = lobby.vote_candidates(pid, shortlist)
+            vote_prompt_str, player_history, tokens = self.build_history_prompt(
+                player,
+                lambda history, player=player, candidates=vote_candidates:
+                    self._vote_template(player, candidates).replace("{history}", history),
+                lazy=True
+            )
+            vote_calls.append(LLMCall(player, 'day_vote', vote_prompt_str, candidates=vote_candidates,
+                                      history=player_history, tokens=tokens))
+        vote_responses = yield vote_calls
+        votes = {}
+        for call, response in zip(vote_calls, vote_responses):
+            self._log_call(call, response)
+            votes[call.player.player_id] = self._extract(call, str(response), call.candidates)
+        vote_count = {}
+        for v in votes.values():
+            vote_count[v] = vote_count.get(v, 0) + 1
+        # 得票最多的若干人出局（同票时先得票者优先），人数与夜里的狼群数相当
+        count = lobby.eliminations(self.state.count_alive(Role.WOLF))
+        eliminated_all = sorted(vote_count, key=lambda pid: -vote_count[pid])[:count]
+        hunter_to_shoot = []
+        for pid in eliminated_all:
+            if self.state.kill(pid) and self.state.player(pid).role == Role.HUNTER:
+                hunter_to_shoot.append(self.state.player(pid))
+        for hunter in hunter_to_shoot:
+            yield from self._hunter_steps(hunter)
+        eliminated = eliminated_all[0]
+        log_votes = {
+            "round": self.round,
+            "phase": "day_vote",
+            "votes": votes,
+            "shortlist": shortlist,
+            "eliminated": eliminated,
+            "eliminated_all": eliminated_all
+        }
+        self.logger.log_event(log_votes)
+        self.history.append(log_votes)
+        return eliminated
+
     def check_win(self) -> Optional[str]:
         """
         判断胜负。
         """
-        alive = self.get_alive_players()
-        wolves = [p for p in alive if p.role == Role.WOLF]
-        others = [p for p in alive if p.role != Role.WOLF]
+        wolves = self.state.count_alive(Role.WOLF)
+        others = self.state.count_alive() - wolves
         if not wolves:
             return "Villagers win!"
-        if len(wolves) >= len(others):
+        if wolves >= others:
             return "Wolves win!"
         return None
 
-    def run(self):
-        """
-        运行游戏主循环。
-        """
-        self.assign_roles()
-        while True:
-            self.round += 1
-            # Night phase
-            killed, _ = self.night_phase()
-            if killed is not None:
-                for player in self.players:
-                    if player.player_id == killed:
-                        player.is_alive = False
-            # Day phase
-            eliminated = self.day_phase()
-            # 检查胜负
-            result = self.check_win()
-            if result:
-                self.logger.log_result(result)
-                break 
\ No newline at end of file
+    def run(self, roles: Optional[List[Role]] = None):
+        """
+        运行游戏主循环。roles可指定各座位的身份，默认随机分配。
+        """
+        self.assign_roles(roles)
+        self._drive(self._game_steps("night"))
+
+    def resume(self):
+        """
+        从restore_state()恢复的状态继续运行（见checkpoint.resume_game），或从run_until()停下的地方继续。
+        """
+        if self.next_phase is None:
+            raise ValueError("game has already finished")
+        self._drive(self._game_steps(self.next_phase))
+
+    def run_until(self, round_num: int, phase: str, roles: Optional[List[Role]] = None) -> bool:
+        """
+        运行到第round_num轮的phase（"night"/"day"）阶段开始之前停下，之后可以fork()或resume()。
+        尚未开始的对局先分配身份（roles同run()）。停在该阶段之前返回True，对局在此之前已结束返回False。
+        """
+        if phase not in ("night", "day"):
+            raise ValueError(f"unknown phase {phase!r}")
+        self.pause_at = (round_num, phase)
+        try:
+            if not self.players:
+                self.assign_roles(roles)
+                self.next_phase = "night"
+            self.resume()
+        finally:
+            self.pause_at = None
+        return self.next_phase is not None
+
+    def _pause(self, phase: str) -> bool:
+        """
+        即将开始的阶段是run_until()的停止点时记下下一阶段并返回True。
+        """
+        if self.pause_at is None:
+            return False
+        round_num = self.round + 1 if phase == "night" else self.round
+        if (round_num, phase) != tuple(self.pause_at):
+            return False
+        self.next_phase = phase
+        return True
+
+    # 是否按阶段用cProfile分析（需要设置metrics.profile_dir）；异步引擎中多局交错执行，不做分析
+    profile_phases = True
+
+    def _game_steps(self, phase: str):
+        """
+        整局的生成器：从phase开始依次执行夜晚和白天，每批LLMCall交给驱动方执行（同步见_drive，异步见async_engine）。
+        """
+        metrics = self.metrics
+        paused = False
+        try:
+            while True:
+                if phase == "night":
+                    if self._pause("night"):
+                        paused = True
+                        return
+                    self.round += 1
+                    round_start = time.perf_counter()
+                    if metrics is None:
+                        yield from self._night_steps()
+                    else:
+                        with metrics.phase("night", self.round, profile=self.profile_phases):
+                            yield from self._night_steps()
+                    self._save_checkpoint("day")
+                else:
+                    # 从白天恢复时本轮耗时只包含白天
+                    round_start = time.perf_counter()
+                if self._pause("day"):
+                    paused = True
+                    return
+                # 阶段耗时包含其中触发的猎人开枪（猎人开枪另有hunter_shoot的调用延迟）
+                if metrics is None:
+                    yield from self._day_steps()
+                else:
+                    with metrics.phase("day", self.round, profile=self.profile_phases):
+                        yield from self._day_steps()
+                    metrics.record_round(self.round, time.perf_counter() - round_start)
+                phase = "night"
+                # 检查胜负
+                result = self.check_win()
+                if result:
+                    self.logger.log_result(result)
+                    break
+                self._save_checkpoint("night")
+        finally:
+            self.close()
+            # 在run_until()的停止点暂停时对局还没有结束
+            if metrics is not None and not paused:
+                metrics.record_game(self.logger.result)
+                self.logger.log_metrics(metrics.registry.to_dict())
+        self._save_checkpoint(None)
+
+    def _save_checkpoint(self, next_phase: Optional[str]):
+        self.next_phase = next_phase
+        if self.checkpoint:
+            from checkpoint import save_checkpoint
+            save_checkpoint(self, self.checkpoint)
+
+    def checkpoint_state(self) -> Dict:
+        """
+        阶段之间的完整对局状态（JSON友好），包括随机数生成器状态，用于检查点。
+        不包含运行配置（agent后端、responder、并发数、压缩配置），恢复时由调用方重新提供。
+        """
+        state = self.state
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "num_players": self.num_players,
+            "role_distribution": {role.name: count for role, count in self.role_distribution.items()},
+            "language": self.language,
+            "seed": self.seed,
+            "player_models": self.player_models,
+            "round": self.round,
+            "next_phase": self.next_phase,
+            "roles": [p.role.name for p in self.players],
+            "models": [p.model for p in self.players],
+            "alive": state.alive,
+            "witches": {pid: [w.save_used, w.poison_used] for pid, w in state.witches.items()},
+            "seers": {pid: s.checks for pid, s in state.seers.items()},
+            "history": self.history.events,
+            "rng": _rng_state(self.rng),
+            "agent_seed": self._agent_seed,
+            "agent_rngs": {pid: _rng_state(rng) for pid, rng in self._agent_rngs.items()},
+            "log": self.logger.to_dict(),
+        }
+        if self.compactor is not None:
+            # LLM摘要是付费调用，随检查点保存，恢复后不再重复生成
+            data["summaries"] = [[r, n, text] for (r, n), text in self.compactor._texts.items()]
+        if self.metrics is not None:
+            data["metrics"] = self.metrics.registry.to_dict()
+        if self.budget is not None:
+            data["budget"] = self.budget.state()
+        return data
+
+    def restore_state(self, data: Dict, history: Optional[HistoryStore] = None):
+        """
+        恢复checkpoint_state()的结果，之后调用resume()继续。logger的已有内容会被替换。
+        history为已有的HistoryStore（fork()传入共享的副本），为None时按data["history"]重建。
+        """
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version {data.get('version')}")
+        if len(data["roles"]) != self.num_players:
+            raise ValueError(f"checkpoint has {len(data['roles'])} players, engine has {self.num_players}")
+        self.round = data["round"]
+        self.next_phase = data["next_phase"]
+        self.rng.setstate(_rng_from_state(data["rng"]))
+        self.players = [LLMPlayerAgent(i, Role[name], model=model)
+                        for i, (name, model) in enumerate(zip(data["roles"], data["models"]))]
+        for player in self.players:
+            player.is_alive = bool(data["alive"] >> player.player_id & 1)
+        self.state = GameState(self.players)
+        for pid, (save_used, poison_used) in data["witches"].items():
+            witch = self.state.witches[int(pid)]
+            witch.save_used, witch.poison_used = save_used, poison_used
+        for pid, checks in data["seers"].items():
+            self.state.seers[int(pid)].checks[:] = checks
+        if history is None:
+            history = HistoryStore(_restore_event(event) for event in data["history"])
+        self.history = history
+        self._agent_seed = data["agent_seed"]
+        self._agent_rngs = {int(pid): random.Random() for pid in data["agent_rngs"]}
+        for pid, rng_state in data["agent_rngs"].items():
+            self._agent_rngs[int(pid)].setstate(_rng_from_state(rng_state))
+        self._agent_memo = {}  # 后端的缓存可以从公开历史重建
+        if self.compactor is not None:
+            self.compactor._texts.update({(r, n): text for r, n, text in data.get("summaries", [])})
+        if self.metrics is not None and data.get("metrics"):
+            from metrics import MetricsRegistry
+            self.metrics.registry.merge(MetricsRegistry.from_dict(data["metrics"]))
+        if self.budget is not None and data.get("budget"):
+            self.budget.restore(data["budget"])
+        log = dict(data["log"])
+        log["logs"] = [_restore_event(event) for event in log.get("logs", [])]
+        self.logger.restore(log)
+
+    def fork(self, seed: Optional[int] = None, **engine_kwargs) -> "GameEngine":
+        """
+        在阶段之间（run_until()停下后、检查点恢复后）复制对局，返回从同一局面继续的新引擎，对其调用resume()。
+        历史与本局写时复制共享（HistoryStore.fork），事件和已序列化的JSON不复制；日志和详细prompt浅复制。
+        engine_kwargs为新引擎的运行配置：未指定时沿用本局的agents、decoding、狼人议会、大厅、历史压缩和并发数，
+        不沿用responder、检查点、埋点和预算；logger默认为不输出的GameLogger。
+        seed不为None时重设引擎与agent后端的随机数，让同一局面的多个分支走向不同；否则与本局完全相同。
+        """
+        if self.next_phase is None:
+            raise ValueError("fork() needs a game paused between phases (run_until() or restore_state())")
+        kwargs = dict(language=self.language, player_models=self.player_models, agents=self.agents,
+                      decoding=self.decoding, wolf_council=self.wolf_council, max_workers=self.max_workers,
+                      compaction=self.compactor.config if self.compactor is not None else None,
+                      lobby=self.lobby.config if self.lobby is not None else None)
+        kwargs.update(engine_kwargs)
+        if kwargs.get("logger") is None:
+            kwargs["logger"] = GameLogger(verbosity=QUIET)
+        child = type(self)(self.num_players, self.role_distribution, seed=self.seed, **kwargs)
+        child.restore_state(self.checkpoint_state(), history=self.history.fork())
+        for player in child.players:
+            # 座位上的后端可能换了，模型名按新的配置重新标记
+            player.model = child.player_models.get(player.player_id) or child._agent_label(player.player_id)
+        if seed is not None:
+            child.rng.seed(seed)
+            child._agent_seed = seed
+            child._agent_rngs = {}
+        return child
+
+
+def _rng_state(rng: random.Random) -> list:
+    version, internal, gauss_next = rng.getstate()
+    return [version, list(internal), gauss_next]
+
+
+def _rng_from_state(state: list) -> tuple:
+    version, internal, gauss_next = state
+    return version, tuple(internal), gauss_next
+
+
+def _restore_event(event: Dict) -> Dict:
+    """
+    JSON往返后恢复事件中的整数键（投票表的投票者id）。
+    """
+    if event.get("phase") == "day_vote" and isinstance(event.get("votes"), dict):
+        event = dict(event, votes={int(voter): target for voter, target in event["votes"].items()})
+    return event
@@ -0,0 +1,265 @@
+# 单进程异步对局主机：在一个事件循环中同时运行大量对局（async_engine.AsyncGameEngine），
+# 所有对局共享一个全局LLM并发上限，名额在对局之间轮转分配，单局可单独取消或设置超时。
+# Single-process async game host running many concurrent games.
+#
+# 运行：python game_host.py --games 200 --players 10 --max-concurrency 64 --time-scale 0.05
+#       python game_host.py --games 500 --agents heuristic            # 只测引擎自身开销
+#       python game_host.py --games 50 --timeout 5 --out host_out      # 单局超时，写出每局日志
+#       python game_host.py --games 100 --live-port 8765                # 实时观战（见live_feed.py）
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from async_engine import AsyncGameEngine
+from roles import Role
+
+PENDING, RUNNING, OK, TIMEOUT, CANCELLED, ERROR = "pending", "running", "ok", "timeout", "cancelled", "error"
+
+
+class FairLimiter:
+    """
+    按对局公平分配的全局并发上限。名额已满时请求按对局排队，释放的名额依次轮转给各个等待中的对局，
+    一个阶段并发几十个调用的大局不会饿死其他对局。
+    只能在同一个事件循环中使用；acquire()被取消时不会泄漏名额。
+    """
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters: "OrderedDict[object, Deque[asyncio.Future]]" = OrderedDict()
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, key=None):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已经转交过来，再转给下一个
+                self.release()
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def release(self):
+        """
+        把名额直接交给下一个对局的最早请求（占用数不变），没有等待者时归还。
+        """
+        while self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class GameHandle:
+    """
+    主机中的一局游戏：状态为pending/running/ok/timeout/cancelled/error。
+    """
+    def __init__(self, game_id: int, engine: AsyncGameEngine):
+        self.game_id = game_id
+        self.engine = engine
+        self.task: Optional[asyncio.Task] = None
+        self.status = PENDING
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def to_dict(self) -> dict:
+        return {
+            "game_id": self.game_id,
+            "status": self.status,
+            "result": self.engine.logger.result or None,
+            "rounds": self.engine.round,
+            "duration_s": round(self.duration, 4) if self.duration is not None else None,
+            "error": self.error,
+        }
+
+
+class GameHost:
+    """
+    在当前事件循环中运行多局AsyncGameEngine。
+    max_concurrency：所有对局同时在途的LLM调用上限（FairLimiter）
+    max_games：同时进行的对局数上限，超出的对局排队，None为不限
+    game_timeout：单局默认超时（秒），超时的对局被取消并标记为timeout
+    """
+    def __init__(self, max_concurrency: int = 64, max_games: Optional[int] = None,
+                 game_timeout: Optional[float] = None):
+        self.limiter = FairLimiter(max_concurrency)
+        self.max_games = max_games
+        self.game_timeout = game_timeout
+        self.games: Dict[int, GameHandle] = {}
+        self._game_slots: Optional[asyncio.Semaphore] = asyncio.Semaphore(max_games) if max_games else None
+        self._next_id = 0
+
+    def start(self, engine: AsyncGameEngine, roles: Optional[List[Role]] = None,
+              timeout: Optional[float] = None) -> GameHandle:
+        """
+        登记并开始一局（须在事件循环中调用），返回GameHandle。engine的limiter和game_id由主机设置。
+        """
+        game_id = self._next_id
+        self._next_id += 1
+        engine.limiter = self.limiter
+        engine.game_id = game_id
+        handle = GameHandle(game_id, engine)
+        self.games[game_id] = handle
+        handle.task = asyncio.ensure_future(self._play(handle, roles, timeout if timeout is not None else self.game_timeout))
+        return handle
+
+    async def _play(self, handle: GameHandle, roles: Optional[List[Role]], timeout: Optional[float]):
+        try:
+            if self._game_slots is not None:
+                await self._game_slots.acquire()
+            try:
+                handle.status = RUNNING
+                handle.started = time.perf_counter()
+                await asyncio.wait_for(handle.engine.arun(roles), timeout)
+                handle.status = OK
+            finally:
+                handle.finished = time.perf_counter()
+                if self._game_slots is not None:
+                    self._game_slots.release()
+        except asyncio.TimeoutError:
+            handle.status = TIMEOUT
+            handle.error = f"game exceeded {timeout}s"
+        except asyncio.CancelledError:
+            # 只取消这一局，不向join()传播
+            handle.status = CANCELLED
+        except Exception as e:
+            handle.status = ERROR
+            handle.error = f"{type(e).__name__}: {e}"
+
+    def cancel(self, game_id: int):
+        self.games[game_id].cancel()
+
+    async def join(self) -> List[GameHandle]:
+        """
+        等待所有已开始的对局结束（包括等待期间新开始的），返回全部GameHandle。
+        """
+        while True:
+            tasks = [h.task for h in self.games.values() if h.task is not None and not h.task.done()]
+            if not tasks:
+                return list(self.games.values())
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for handle in self.games.values():
+            counts[handle.status] = counts.get(handle.status, 0) + 1
+        return {
+            "games": len(self.games),
+            "status": counts,
+            "llm_in_flight": self.limiter.active,
+            "llm_waiting": self.limiter.waiting(),
+        }
+
+
+async def run_host(num_games: int, num_players: int, max_concurrency: int, max_games: Optional[int] = None,
+                   timeout: Optional[float] = None, agents: Optional[str] = None, time_scale: float = 0.05,
+                   seed: int = 0, out_dir: Optional[str] = None, feed=None) -> dict:
+    """
+    同时开始num_games局并等待全部结束，返回汇总。未指定agents时用benchmark.FakeLLM的异步responder
+    按录制日志建模回复与延迟（实际等待 建模延迟*time_scale 秒）。
+    feed为live_feed.LiveFeed时每局的事件实时推送给观众（对局编号为game_id）。
+    """
+    from agents import make_agent
+    from benchmark import DEFAULT_LOGS, FakeLLM, LatencyModel, ResponseModel
+    from event_sink import QUIET
+    from logger import GameLogger
+    from tournament import default_role_distribution
+
+    distribution = default_role_distribution(num_players)
+    responder = None
+    if agents is None:
+        responses = ResponseModel.from_logs([p for p in DEFAULT_LOGS if os.path.exists(p)])
+        responder = FakeLLM(responses, LatencyModel(), time_scale=time_scale, seed=seed).aresponder
+    host = GameHost(max_concurrency, max_games=max_games, game_timeout=timeout)
+    started = time.perf_counter()
+    for i in range(num_games):
+        engine = AsyncGameEngine(num_players, distribution, seed=seed + i, responder=responder,
+                                 agents=make_agent(agents) if agents else None,
+                                 logger=GameLogger(sink=feed.sink(i) if feed is not None else None, verbosity=QUIET,
+                                                   keep_prompts=out_dir is not None))
+        handle = host.start(engine)
+        if feed is not None:
+            # 对局一结束就通知观众
+            handle.task.add_done_callback(lambda _, logger=engine.logger: logger.close())
+    handles = await host.join()
+    wall = time.perf_counter() - started
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        for handle in handles:
+            handle.engine.logger.save(os.path.join(out_dir, f"game_{handle.game_id:04d}.json"))
+    durations = sorted(h.duration for h in handles if h.duration is not None)
+    results: Dict[str, int] = {}
+    for handle in handles:
+        if handle.status == OK:
+            results[handle.engine.logger.result] = results.get(handle.engine.logger.result, 0) + 1
+    summary = host.stats()
+    summary.update({
+        "wall_s": round(wall, 3),
+        "games_per_sec": round(num_games / wall, 3) if wall else None,
+        "median_game_s": round(durations[len(durations) // 2], 3) if durations else None,
+        "results": results,
+        "errors": [h.to_dict() for h in handles if h.status == ERROR][:10],
+    })
+    return summary
+
+
+if __name__ == "__main__":
+    from agents import AGENTS
+
+    parser = argparse.ArgumentParser(description="Run many concurrent Werewolf games in one asyncio event loop")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--max-concurrency", type=int, default=64, help="所有对局共享的LLM并发上限")
+    parser.add_argument("--max-games", type=int, default=None, help="同时进行的对局数上限")
+    parser.add_argument("--timeout", type=float, default=None, help="单局超时（秒）")
+    parser.add_argument("--agents", default=None, choices=sorted(AGENTS), help="使用agent后端代替假LLM")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="假LLM实际等待 建模延迟*该系数 秒")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="写出每局日志的目录")
+    parser.add_argument("--live-port", type=int, default=None, help="在该端口启动实时观战服务器（见live_feed.py）")
+    args = parser.parse_args()
+    live = None
+    if args.live_port is not None:
+        from live_feed import LiveFeed
+        live = LiveFeed()
+        print(f"Live feed on {live.start(port=args.live_port)}/")
+    report = asyncio.run(run_host(args.games, args.players, args.max_concurrency, max_games=args.max_games,
+                                  timeout=args.timeout, agents=args.agents, time_scale=args.time_scale,
+                                  seed=args.seed, out_dir=args.out, feed=live))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if live is not None:
+        print(json.dumps(live.stats()["clients"], ensure_ascii=False))
+        live.close()
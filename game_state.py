@@ -0,0 +1,179 @@
+# 紧凑的对局状态：存活位图、身份索引、女巫/预言家的类型化状态，支持O(1)查找和廉价快照。
+# Compact indexed game state.
+
+import copy
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from roles import Role
+from player_agent import Player
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(mask: int) -> int:
+        return bin(mask).count("1")
+
+
+class WitchState:
+    """
+    女巫的药水使用情况。
+    """
+    __slots__ = ("save_used", "poison_used")
+
+    def __init__(self, save_used: bool = False, poison_used: bool = False):
+        self.save_used = save_used
+        self.poison_used = poison_used
+
+    def info(self) -> Dict[str, bool]:
+        return {"save_used": self.save_used, "poison_used": self.poison_used}
+
+    def __repr__(self):
+        return f"WitchState(save_used={self.save_used}, poison_used={self.poison_used})"
+
+
+class SeerState:
+    """
+    预言家的查验记录，每条为{"checked_id": id, "result": "Good"/"Bad"}，只追加。
+    """
+    __slots__ = ("checks",)
+
+    def __init__(self, checks: Optional[List[Dict]] = None):
+        self.checks: List[Dict] = checks if checks is not None else []
+
+    @property
+    def last_check(self) -> Optional[Dict]:
+        return self.checks[-1] if self.checks else None
+
+    def __repr__(self):
+        return f"SeerState(checks={self.checks})"
+
+
+class GameSnapshot:
+    """
+    GameState.snapshot()的结果，只包含整数和元组，创建开销与玩家数基本无关。
+    """
+    __slots__ = ("alive", "witches", "seers")
+
+    def __init__(self, alive: int, witches: Tuple[Tuple[int, bool, bool], ...], seers: Tuple[Tuple[int, int], ...]):
+        self.alive = alive
+        self.witches = witches
+        self.seers = seers
+
+
+class GameState:
+    """
+    一局游戏的玩家状态。players按座位下标存放（players[i].player_id == i），
+    存活情况以位图alive维护，第i位为1表示i号玩家存活；每个身份的座位预先建好位图索引。
+    玩家的死亡必须通过kill()，以保持位图与player.is_alive一致。
+    """
+    __slots__ = ("players", "alive", "_role_masks", "witches", "seers", "_alive_cache")
+
+    def __init__(self, players: Iterable[Player]):
+        self.players: List[Player] = list(players)
+        for index, player in enumerate(self.players):
+            if player.player_id != index:
+                raise ValueError(f"player at seat {index} has player_id {player.player_id}")
+        self.alive = 0
+        self._role_masks: Dict[Role, int] = {}
+        for player in self.players:
+            if player.is_alive:
+                self.alive |= 1 << player.player_id
+            self._role_masks[player.role] = self._role_masks.get(player.role, 0) | (1 << player.player_id)
+        self.witches: Dict[int, WitchState] = {p.player_id: WitchState() for p in self.players if p.role == Role.WITCH}
+        self.seers: Dict[int, SeerState] = {p.player_id: SeerState() for p in self.players if p.role == Role.SEER}
+        self._alive_cache: Tuple[int, List[Player], List[int]] = (-1, [], [])
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def player(self, player_id: int) -> Player:
+        return self.players[player_id]
+
+    def is_alive(self, player_id: int) -> bool:
+        return bool(self.alive >> player_id & 1)
+
+    def kill(self, player_id: int) -> bool:
+        """
+        淘汰一名玩家，返回其之前是否存活。
+        """
+        bit = 1 << player_id
+        was_alive = bool(self.alive & bit)
+        self.alive &= ~bit
+        self.players[player_id].is_alive = False
+        return was_alive
+
+    def role_mask(self, role: Role) -> int:
+        return self._role_masks.get(role, 0)
+
+    def _players_in(self, mask: int) -> List[Player]:
+        players = self.players
+        result = []
+        while mask:
+            low = mask & -mask
+            result.append(players[low.bit_length() - 1])
+            mask ^= low
+        return result
+
+    def _alive(self) -> Tuple[int, List[Player], List[int]]:
+        cache = self._alive_cache
+        if cache[0] != self.alive:
+            players = self._players_in(self.alive)
+            cache = self._alive_cache = (self.alive, players, [p.player_id for p in players])
+        return cache
+
+    def alive_players(self) -> List[Player]:
+        """
+        按座位顺序返回存活玩家。结果按位图缓存，存活情况不变时只复制列表。
+        """
+        return list(self._alive()[1])
+
+    def alive_ids(self) -> List[int]:
+        return list(self._alive()[2])
+
+    def alive_with_role(self, role: Role) -> List[Player]:
+        return self._players_in(self.alive & self.role_mask(role))
+
+    def alive_without_role(self, role: Role) -> List[Player]:
+        return self._players_in(self.alive & ~self.role_mask(role))
+
+    def count_alive(self, role: Optional[Role] = None) -> int:
+        return _popcount(self.alive if role is None else self.alive & self.role_mask(role))
+
+    def snapshot(self) -> GameSnapshot:
+        """
+        记录当前状态。查验记录只追加，因此只需记录长度。
+        """
+        return GameSnapshot(
+            self.alive,
+            tuple((pid, w.save_used, w.poison_used) for pid, w in self.witches.items()),
+            tuple((pid, len(s.checks)) for pid, s in self.seers.items()),
+        )
+
+    def restore(self, snapshot: GameSnapshot):
+        """
+        恢复到snapshot()时的状态（同一个GameState上的回退）。
+        """
+        self.alive = snapshot.alive
+        for player in self.players:
+            player.is_alive = bool(snapshot.alive >> player.player_id & 1)
+        for pid, save_used, poison_used in snapshot.witches:
+            witch = self.witches[pid]
+            witch.save_used, witch.poison_used = save_used, poison_used
+        for pid, count in snapshot.seers:
+            del self.seers[pid].checks[count:]
+
+    def copy(self) -> "GameState":
+        """
+        复制出完全独立的状态（玩家对象也浅复制一份），用于从某一时刻分叉对局。
+        """
+        state = GameState.__new__(GameState)
+        state.players = [copy.copy(p) for p in self.players]
+        state.alive = self.alive
+        state._role_masks = self._role_masks
+        state.witches = {pid: WitchState(w.save_used, w.poison_used) for pid, w in self.witches.items()}
+        state.seers = {pid: SeerState(list(s.checks)) for pid, s in self.seers.items()}
+        state._alive_cache = (-1, [], [])
+        return state
+
+    def __repr__(self):
+        return f"GameState(players={len(self.players)}, alive={self.alive_ids()})"
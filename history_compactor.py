@@ -0,0 +1,169 @@
+# 历史压缩与单个prompt的token预算：旧轮次替换为摘要和投票/淘汰表，最近几轮保留原文。
+# History compaction and per-prompt token budget enforcement.
+
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+from history_store import HistoryStore
+from llm_client import estimate_tokens
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken未安装或编码文件不可用时退回估算
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计token数。安装了tiktoken时精确计数，否则使用llm_client.estimate_tokens估算。
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def heuristic_summary(round_num: int, events: List[Dict], excerpt_chars: int = 80) -> Dict[str, str]:
+    """
+    本地启发式摘要：每位发言者保留发言开头的一句话（截断到excerpt_chars个字符）。
+    """
+    excerpts = {}
+    for event in events:
+        if event.get('phase') != 'day_speech':
+            continue
+        for speech in event.get('speeches', []):
+            text = " ".join(str(speech.get('speech', '')).split())
+            for mark in ("。", ". ", "！", "? ", "？"):
+                cut = text.find(mark)
+                if 0 < cut < excerpt_chars:
+                    text = text[:cut + len(mark)].strip()
+                    break
+            if len(text) > excerpt_chars:
+                text = text[:excerpt_chars] + "…"
+            excerpts[str(speech.get('player_id'))] = text
+    return excerpts
+
+
+def llm_summarizer(model: str = "gpt-4o-mini", max_chars: int = 600) -> Callable[[int, List[Dict]], str]:
+    """
+    用便宜模型生成一轮的文字摘要。每轮只调用一次，结果由HistoryCompactor缓存。
+    """
+    def summarize(round_num: int, events: List[Dict]) -> str:
+        from llm_api import call_llm_api
+        prompt = (
+            f"Summarize round {round_num} of a Werewolf game in at most {max_chars} characters. "
+            "Keep who accused whom, who defended whom and any role claims. "
+            f"Events: {json.dumps(events, ensure_ascii=False)}"
+        )
+        return call_llm_api(prompt, model=model)[:max_chars]
+    return summarize
+
+
+class CompactionConfig:
+    """
+    压缩配置。
+    keep_recent_rounds: 保留原始发言的最近轮数，更早的轮次替换为摘要
+    max_prompt_tokens: 单个prompt的token硬上限，None表示不限制
+    excerpt_chars: 启发式摘要中每人保留的字符数
+    summarizer: 自定义摘要函数 summarizer(round, events) -> str，例如llm_summarizer()；默认使用启发式摘要
+    token_counter: token计数函数，默认count_tokens
+    """
+    def __init__(self, keep_recent_rounds: int = 1, max_prompt_tokens: Optional[int] = None,
+                 excerpt_chars: int = 80, summarizer: Optional[Callable[[int, List[Dict]], str]] = None,
+                 token_counter: Callable[[str], int] = count_tokens):
+        self.keep_recent_rounds = keep_recent_rounds
+        self.max_prompt_tokens = max_prompt_tokens
+        self.excerpt_chars = excerpt_chars
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+
+
+class HistoryCompactor:
+    """
+    把HistoryStore的公开视图压缩为：
+    - 每个旧轮次一条 {"round", "phase": "round_summary", "summary", "votes": [[投票者, 目标], ...], "eliminated"}
+    - 最近keep_recent_rounds轮的原始事件
+    摘要按(轮次, 是否含发言, 事件数)缓存其对象和JSON，原始事件直接复用HistoryStore中的JSON。
+
+    超出max_prompt_tokens时逐级加大压缩力度：
+    0 按配置；1 所有已结束轮次都摘要；2 摘要去掉发言，只保留投票/淘汰表；
+    3 从最早的轮次开始丢弃，直到满足预算（至少保留私有信息）。
+    """
+    def __init__(self, config: CompactionConfig):
+        self.config = config
+        self._summaries: Dict[Tuple[int, bool, int], Tuple[Dict, str]] = {}
+        self._texts: Dict[Tuple[int, int], object] = {}
+
+    @staticmethod
+    def _rounds(history: HistoryStore):
+        """
+        按轮次分组公开事件，每个事件附带HistoryStore中已缓存的JSON。
+        """
+        order, by_round, unrounded = [], {}, []
+        for event, serialized in zip(history.public, history.public_serialized):
+            round_num = event.get('round')
+            if round_num is None:
+                unrounded.append((event, serialized))
+                continue
+            if round_num not in by_round:
+                order.append(round_num)
+                by_round[round_num] = []
+            by_round[round_num].append((event, serialized))
+        return order, by_round, unrounded
+
+    def _summary(self, round_num: int, events: List[Dict], level: int) -> Tuple[Dict, str]:
+        # 键中带上事件数，进行中的轮次追加事件后会重新生成摘要
+        key = (round_num, level < 2, len(events))
+        cached = self._summaries.get(key)
+        if cached is not None:
+            return cached
+        entry = {"round": round_num, "phase": "round_summary"}
+        if level < 2:
+            text_key = (round_num, len(events))
+            if text_key not in self._texts:
+                if self.config.summarizer is not None:
+                    self._texts[text_key] = self.config.summarizer(round_num, events)
+                else:
+                    self._texts[text_key] = heuristic_summary(round_num, events, self.config.excerpt_chars)
+            entry["summary"] = self._texts[text_key]
+        for event in events:
+            if event.get('phase') == 'day_vote':
+                entry["votes"] = [[int(voter), target] for voter, target in event.get('votes', {}).items()]
+                entry["eliminated"] = event.get('eliminated')
+        cached = (entry, json.dumps(entry, ensure_ascii=False))
+        self._summaries[key] = cached
+        return cached
+
+    def _parts(self, history: HistoryStore, level: int) -> List[Tuple[Dict, str]]:
+        order, by_round, unrounded = self._rounds(history)
+        keep = 0 if level >= 1 else self.config.keep_recent_rounds
+        summarized = order[:-keep] if keep else order
+        parts = [self._summary(r, [event for event, _ in by_round[r]], level) for r in summarized]
+        for r in order[len(summarized):]:
+            parts.extend(by_round[r])
+        parts.extend(unrounded)
+        return parts
+
+    def fit(self, history: HistoryStore, extras: List[Dict], render: Callable[[str], str]) -> Tuple[str, List[Dict], int]:
+        """
+        生成满足token预算的prompt。render(history_json) -> prompt。
+        返回(prompt, 使用的历史视图, prompt的token数)。
+        """
+        extra_parts = [(item, json.dumps(item, ensure_ascii=False)) for item in extras]
+        budget = self.config.max_prompt_tokens
+        for level in (0, 1, 2):
+            parts = self._parts(history, level) + extra_parts
+            prompt = render("[" + ", ".join(s for _, s in parts) + "]")
+            tokens = self.config.token_counter(prompt)
+            if budget is None or tokens <= budget:
+                return prompt, [item for item, _ in parts], tokens
+        # level 3：从最早的事件开始丢弃
+        public_parts = self._parts(history, 2)
+        while public_parts:
+            public_parts = public_parts[1:]
+            parts = public_parts + extra_parts
+            prompt = render("[" + ", ".join(s for _, s in parts) + "]")
+            tokens = self.config.token_counter(prompt)
+            if tokens <= budget:
+                break
+        return prompt, [item for item, _ in parts], tokens
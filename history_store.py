@@ -0,0 +1,86 @@
+# 增量历史记录：事件只追加一次，公开视图及其JSON序列化随事件到达增量维护。
+# Incremental, per-visibility game history with a cached serialized public prefix.
+
+import json
+from typing import Dict, Iterator, List, Optional
+
+# 所有玩家都能看到的阶段
+PUBLIC_PHASES = ('day_speech', 'day_vote', 'result')
+
+
+class HistoryStore:
+    """
+    游戏历史。对外表现为只追加的事件列表（可迭代、len、下标访问），同时维护：
+    - public：公开事件列表（发言、投票、结果），所有视角共享
+    - 公开事件的JSON前缀缓存：每个事件只序列化一次，构造prompt时只需拼接私有部分
+
+    序列化结果与 json.dumps(list, ensure_ascii=False) 完全一致，因此prompt文本不会改变。
+    预言家、女巫等角色的私有信息很小，作为extras在构造视图时追加在公开事件之后。
+    """
+    def __init__(self, events: Optional[List[Dict]] = None):
+        self.events: List[Dict] = []
+        self.public: List[Dict] = []
+        self.public_serialized: List[str] = []  # 与public一一对应的JSON
+        self._public_prefix = "["  # 已序列化的公开事件，不含结尾的 "]"
+        self._shared = False  # 列表是否与fork()出的副本共享，共享时追加前先复制
+        for event in events or []:
+            self.append(event)
+
+    def fork(self) -> "HistoryStore":
+        """
+        返回共享全部已有事件的副本（写时复制）：在任一方追加新事件之前，两边使用同一组列表；
+        追加时只复制列表本身，事件对象和已序列化的JSON始终共享。
+        """
+        child = HistoryStore.__new__(HistoryStore)
+        child.events = self.events
+        child.public = self.public
+        child.public_serialized = self.public_serialized
+        child._public_prefix = self._public_prefix
+        child._shared = self._shared = True
+        return child
+
+    def append(self, event: Dict):
+        if self._shared:
+            self.events = list(self.events)
+            self.public = list(self.public)
+            self.public_serialized = list(self.public_serialized)
+            self._shared = False
+        self.events.append(event)
+        if event.get('phase') in PUBLIC_PHASES:
+            serialized = json.dumps(event, ensure_ascii=False)
+            if self.public:
+                self._public_prefix += ", " + serialized
+            else:
+                self._public_prefix += serialized
+            self.public.append(event)
+            self.public_serialized.append(serialized)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.events)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __getitem__(self, index):
+        return self.events[index]
+
+    def view(self, extras: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        某个视角下可见的历史：公开事件加上该视角的私有信息。
+        """
+        if extras:
+            return self.public + extras
+        return list(self.public)
+
+    def public_json(self) -> str:
+        return self._public_prefix + "]"
+
+    def view_json(self, extras: Optional[List[Dict]] = None) -> str:
+        """
+        view(extras)的JSON序列化，公开部分直接复用缓存。
+        """
+        if not extras:
+            return self._public_prefix + "]"
+        tail = ", ".join(json.dumps(item, ensure_ascii=False) for item in extras)
+        separator = ", " if self.public else ""
+        return self._public_prefix + separator + tail + "]"
@@ -0,0 +1,434 @@
+# 实时观战：本地SSE（Server-Sent Events）服务器，引擎事件产生时立即推送给观众，发言随LLM生成逐段推送。
+# 每个观众有自己的有界队列，同一发言未发出的token合并为一条，队列满时丢弃最旧的事件（优先丢token），
+# 慢观众只会丢消息，不会阻塞引擎或其他观众。
+# Low-latency live spectator feed (SSE) with per-client bounded queues.
+#
+# 运行：python live_feed.py --port 8765 --games 4 --agents heuristic --delay 0.2   # 演示：同时观看多局
+#       python live_feed.py --port 8765 --games 1 --llm                            # 真实LLM（或stub），发言逐token推送
+#       浏览器打开 http://127.0.0.1:8765/ ，或 curl -N "http://127.0.0.1:8765/events?game=0"
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from agents import AgentBackend
+from event_sink import EventSink
+
+class ClientQueue:
+    """
+    单个观众的有界队列。put()不阻塞：同一发言（game, player_id, round）尚未发出的token事件合并为一条；
+    队列满时先丢弃最旧的token事件，没有token时丢弃最旧的事件，丢弃数在下一次get()时以"dropped"事件告知。
+    """
+    def __init__(self, maxsize: int = 256, games: Optional[Iterable[str]] = None, tokens: bool = True):
+        self.maxsize = max(1, maxsize)
+        self.games = set(games) if games else None  # None表示所有对局
+        self.tokens = tokens
+        self.items: Deque[dict] = deque()
+        self.pending_tokens: Dict[tuple, dict] = {}  # 尚未发出、可以继续合并的token事件
+        self.queued_tokens = 0  # 队列中的token事件数，为0时淘汰不必扫描
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def wants(self, event: dict) -> bool:
+        if self.games is not None and event["game"] not in self.games:
+            return False
+        return self.tokens or event.get("type") != "token"
+
+    @staticmethod
+    def _token_key(event: dict) -> tuple:
+        return event["game"], event.get("player_id"), event.get("round")
+
+    def put(self, event: dict):
+        with self.cond:
+            if self.closed:
+                return
+            if event.get("type") == "token":
+                key = self._token_key(event)
+                if event.get("reset"):
+                    self.pending_tokens.pop(key, None)
+                else:
+                    pending = self.pending_tokens.get(key)
+                    if pending is not None:
+                        pending["text"] += event["text"]
+                        pending["seq"] = event["seq"]
+                        self.coalesced += 1
+                        return
+                    # 复制一份，合并时不影响其他观众队列中的同一事件
+                    event = dict(event)
+                    self.pending_tokens[key] = event
+            if len(self.items) >= self.maxsize:
+                self._evict()
+            if event.get("type") == "token":
+                self.queued_tokens += 1
+            self.items.append(event)
+            self.cond.notify()
+
+    def _evict(self):
+        if not self.queued_tokens:
+            self.items.popleft()
+            self.dropped += 1
+            return
+        for i, item in enumerate(self.items):
+            if item.get("type") == "token":
+                del self.items[i]
+                break
+        self.queued_tokens -= 1
+        key = self._token_key(item)
+        if self.pending_tokens.get(key) is item:
+            del self.pending_tokens[key]
+        self.dropped += 1
+
+    def get(self, timeout: Optional[float] = None) -> List[dict]:
+        """
+        等待并取出全部待发事件，超时返回空列表，关闭后返回None。
+        """
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if self.closed and not self.items:
+                return None
+            items = list(self.items)
+            self.items.clear()
+            self.pending_tokens.clear()
+            self.queued_tokens = 0
+            if self.dropped:
+                items.insert(0, {"type": "dropped", "count": self.dropped})
+                self.dropped = 0
+            self.sent += len(items)
+            return items
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class _GameFeed:
+    """
+    一局的回放缓存：最近的非token事件，新观众连接时先收到这些事件。
+    """
+    __slots__ = ("game_id", "seq", "backlog", "finished", "started")
+
+    def __init__(self, game_id: str, backlog: int):
+        self.game_id = game_id
+        self.seq = 0
+        self.backlog: Deque[dict] = deque(maxlen=backlog)
+        self.finished = False
+        self.started = time.time()
+
+
+class LiveFeed:
+    """
+    多局共享的实时事件中心与SSE服务器。publish()只在内存中分发（加锁、入队），序列化和网络写出在各观众的
+    连接线程中进行，因此引擎线程/事件循环不会因观众而阻塞。
+    每局保留最近backlog条非token事件供新观众补看，已结束的对局最多保留keep_finished局。
+    """
+    def __init__(self, max_queue: int = 256, backlog: int = 500, keep_finished: int = 100,
+                 heartbeat: float = 15.0):
+        self.max_queue = max_queue
+        self.backlog = backlog
+        self.keep_finished = keep_finished
+        self.heartbeat = heartbeat
+        self.games: "OrderedDict[str, _GameFeed]" = OrderedDict()
+        self.clients: List[ClientQueue] = []
+        self.lock = threading.Lock()
+        self.published = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def sink(self, game_id, prompts: bool = False) -> "FeedSink":
+        """
+        返回写入本中心的sink，供GameLogger(sink=...)使用。
+        """
+        return FeedSink(self, str(game_id), prompts)
+
+    def _game(self, game_id: str) -> _GameFeed:
+        game = self.games.get(game_id)
+        if game is None:
+            game = self.games[game_id] = _GameFeed(game_id, self.backlog)
+        return game
+
+    def publish(self, game_id, event: dict):
+        """
+        给事件加上game和每局递增的seq后分发给所有订阅了该局的观众。
+        """
+        game_id = str(game_id)
+        with self.lock:
+            game = self._game(game_id)
+            game.seq += 1
+            record = {"game": game_id, "seq": game.seq}
+            record.update(event)
+            if record.get("type") != "token":
+                # token只实时转发，回放缓存中有完整的发言事件
+                game.backlog.append(record)
+            self.published += 1
+            # 在锁内入队：各观众收到的同一局事件保持seq顺序，与subscribe()放入的回放缓存也不会重复或遗漏
+            for client in self.clients:
+                if client.wants(record):
+                    client.put(record)
+
+    def end(self, game_id):
+        """
+        标记对局结束：通知观众，并只保留最近keep_finished局已结束对局的回放缓存。
+        """
+        game_id = str(game_id)
+        with self.lock:
+            game = self.games.get(game_id)
+            if game is None or game.finished:
+                return
+        self.publish(game_id, {"type": "end"})
+        with self.lock:
+            game.finished = True
+            finished = [gid for gid, g in self.games.items() if g.finished]
+            for gid in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.games[gid]
+
+    def subscribe(self, games: Optional[Iterable[str]] = None, tokens: bool = True,
+                  max_queue: Optional[int] = None) -> ClientQueue:
+        """
+        新增一个观众，先放入所订阅对局的回放缓存（只保留能放进队列的最近部分）。
+        """
+        client = ClientQueue(max_queue or self.max_queue, games, tokens)
+        with self.lock:
+            backlog = [event for game in self.games.values() if client.games is None or game.game_id in client.games
+                       for event in game.backlog]
+            for event in backlog[-client.maxsize:]:
+                client.items.append(event)
+            self.clients.append(client)
+        return client
+
+    def unsubscribe(self, client: ClientQueue):
+        client.close()
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def finished(self, game_id) -> bool:
+        with self.lock:
+            game = self.games.get(str(game_id))
+            return game is not None and game.finished
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "published": self.published,
+                "games": [{"game": g.game_id, "events": g.seq, "finished": g.finished} for g in self.games.values()],
+                "clients": [{"games": sorted(c.games) if c.games is not None else None, "queued": len(c.items),
+                             "sent": c.sent, "coalesced": c.coalesced, "dropped": c.dropped}
+                            for c in self.clients],
+            }
+
+    def start(self, host: str = "127.0.0.1", port: int = 8765) -> str:
+        """
+        在后台线程启动SSE服务器，返回地址。port=0表示随机端口。
+        """
+        handler = type("BoundFeedHandler", (FeedHandler,), {"feed": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="live-feed", daemon=True).start()
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients)
+            self.clients.clear()
+        for client in clients:
+            client.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class FeedSink(EventSink):
+    """
+    把一局的事件转发给LiveFeed。live=True，引擎会以流式生成发言并写出token事件。
+    prompt事件默认去掉prompt正文（只保留回复与调用信息），prompts=True时完整转发。
+    close()标记对局结束。
+    """
+    live = True
+
+    def __init__(self, feed: LiveFeed, game_id: str, prompts: bool = False):
+        self.feed = feed
+        self.game_id = game_id
+        self.prompts = prompts
+
+    def write(self, event: Dict):
+        if event.get("type") == "prompt" and not self.prompts:
+            event = {k: v for k, v in event.items() if k != "prompt"}
+        self.feed.publish(self.game_id, event)
+
+    def close(self):
+        self.feed.end(self.game_id)
+
+
+_INDEX_HTML = """<!doctype html><meta charset="utf-8"><title>Werewolf live</title>
+<style>body{font:14px monospace;margin:1em}pre{white-space:pre-wrap;margin:0}.t{color:#06c}</style>
+<div id="log"></div><script>
+const log=document.getElementById("log"),live={};
+const es=new EventSource("events"+location.search);
+function line(t,c){const p=document.createElement("pre");p.textContent=t;if(c)p.className=c;log.prepend(p);return p;}
+es.addEventListener("token",e=>{const d=JSON.parse(e.data),k=d.game+"/"+d.player_id+"/"+d.round;
+ if(!live[k])live[k]=line("["+d.game+"] player "+d.player_id+": ","t");
+ if(d.reset)live[k].textContent="["+d.game+"] player "+d.player_id+": ";else live[k].textContent+=d.text;});
+es.onmessage=e=>line(e.data);
+["roles","log","prompt","metrics","end","dropped"].forEach(t=>es.addEventListener(t,e=>line(t+" "+e.data)));
+</script>"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    GET /            简单的网页观战界面（参数同/events）
+    GET /games       对局与观众统计（JSON）
+    GET /events      SSE事件流；?game=1,2只看指定对局，?tokens=0不接收token事件，?queue=N设置队列长度。
+                     只订阅一局时，对局结束后关闭连接。
+    """
+    protocol_version = "HTTP/1.1"
+    feed: LiveFeed = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/")
+        if path == "":
+            self._send(200, _INDEX_HTML.encode("utf-8"), "text/html; charset=utf-8")
+        elif path == "/games":
+            self._send(200, json.dumps(self.feed.stats(), ensure_ascii=False).encode("utf-8"), "application/json")
+        elif path == "/events":
+            games = [g for value in query.get("game", []) for g in value.split(",") if g] or None
+            tokens = query.get("tokens", ["1"])[0] not in ("0", "false", "no")
+            max_queue = int(query["queue"][0]) if "queue" in query else None
+            self._stream(games, tokens, max_queue)
+        else:
+            self._send(404, b'{"error": "not found"}', "application/json")
+
+    def _stream(self, games: Optional[List[str]], tokens: bool, max_queue: Optional[int]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        client = self.feed.subscribe(games, tokens, max_queue)
+        single = games[0] if games is not None and len(games) == 1 else None
+        try:
+            while True:
+                items = client.get(self.feed.heartbeat)
+                if items is None:
+                    return
+                if not items:
+                    # 心跳，同时发现已断开的连接
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    continue
+                chunks = []
+                for item in items:
+                    kind = item.get("type", "message")
+                    event_id = f"id: {item['game']}:{item['seq']}\n" if "seq" in item else ""
+                    chunks.append(f"{event_id}event: {kind}\n"
+                                  f"data: {json.dumps(item, ensure_ascii=False, separators=(',', ':'))}\n\n")
+                self.wfile.write("".join(chunks).encode("utf-8"))
+                self.wfile.flush()
+                if single is not None and any(item.get("type") == "end" for item in items):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.feed.unsubscribe(client)
+
+
+class PacedAgent(AgentBackend):
+    """
+    演示用：包装一个agent后端，每次回复耗时约delay秒；发言按词逐段写给call.on_token，模拟LLM的流式生成。
+    """
+    def __init__(self, backend: AgentBackend, delay: float):
+        self.backend = backend
+        self.delay = delay
+        self.name = backend.name
+
+    def respond(self, call, context) -> str:
+        text = self.backend.respond(call, context)
+        if call.on_token is None:
+            time.sleep(self.delay)
+            return text
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.delay / len(words))
+            call.on_token(word if i == 0 else " " + word)
+        return text
+
+
+def run_demo(feed: LiveFeed, num_games: int, num_players: int, agents: Optional[str], delay: float,
+             seed: int, lobby: bool = False) -> List[threading.Thread]:
+    """
+    在后台线程同时运行num_games局并推送到feed。agents为None时调用LLM（发言流式生成），
+    否则使用PacedAgent包装的agent后端。
+    """
+    from agents import make_agent
+    from event_sink import QUIET
+    from game_engine import GameEngine
+    from lobby import LobbyConfig, lobby_role_distribution
+    from logger import GameLogger
+    from tournament import default_role_distribution
+
+    distribution = lobby_role_distribution(num_players) if lobby else default_role_distribution(num_players)
+    backend = PacedAgent(make_agent(agents), delay) if agents is not None else None
+
+    def play(i: int):
+        logger = GameLogger(sink=feed.sink(i), verbosity=QUIET, keep_prompts=False)
+        engine = GameEngine(num_players, distribution, seed=seed + i, max_workers=num_players, agents=backend,
+                            lobby=LobbyConfig() if lobby else None, logger=logger)
+        try:
+            engine.run()
+        finally:
+            logger.close()
+
+    threads = [threading.Thread(target=play, args=(i,), daemon=True) for i in range(num_games)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+if __name__ == "__main__":
+    from agents import AGENTS
+
+    parser = argparse.ArgumentParser(description="Live spectator feed (SSE) for concurrent Werewolf games")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--agents", default="heuristic", choices=sorted(AGENTS), help="演示使用的agent后端")
+    parser.add_argument("--llm", action="store_true", help="调用LLM（OPENAI_BASE_URL可指向stub_server.py）")
+    parser.add_argument("--lobby", action="store_true", help="大厅模式（见lobby.py）")
+    parser.add_argument("--delay", type=float, default=0.2, help="agent后端每次调用前等待的秒数")
+    parser.add_argument("--queue", type=int, default=256, help="每个观众的队列长度")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--linger", type=float, default=60.0, help="对局结束后继续提供服务的秒数")
+    args = parser.parse_args()
+    live = LiveFeed(max_queue=args.queue)
+    url = live.start(args.host, args.port)
+    print(f"Live feed on {url}/  (SSE: {url}/events?game=0)")
+    workers = run_demo(live, args.games, args.players, None if args.llm else args.agents, args.delay, args.seed,
+                       args.lobby)
+    for worker in workers:
+        worker.join()
+    print(json.dumps(live.stats(), ensure_ascii=False))
+    time.sleep(args.linger)
+    live.close()
@@ -2,32 +2,120 @@
 # 该模块为LLM API调用的真实接口，使用OpenAI GPT-4o。
 
 import os
-import openai
+import threading
+from typing import Optional
+
+from llm_client import LLMClient, Completion
+from llm_cache import ResponseCache
 
 # 可自定义API Key和Base URL，留空则使用环境变量或默认
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
 MODEL_NAME = "gpt-4o"
 
-def call_llm_api(prompt: str) -> str:
+# 连接池与限流配置，均可通过环境变量调整
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RPM = float(os.getenv("LLM_RPM", "0")) or None
+LLM_TPM = float(os.getenv("LLM_TPM", "0")) or None
+# 设置LLM_CACHE_DIR后启用磁盘缓存，相同(模型, 参数, prompt)的调用直接返回缓存结果
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "512"))
+# 自托管推理服务：LLM_BATCH_SIZE > 1时把同时发出的请求合并为批量的/v1/completions请求（见llm_batch.py）
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+LLM_BATCH_WAIT_MS = float(os.getenv("LLM_BATCH_WAIT_MS", "5"))
+LLM_BATCH_INFLIGHT = int(os.getenv("LLM_BATCH_INFLIGHT", "4"))
+LLM_PROMPT_FORMAT = os.getenv("LLM_PROMPT_FORMAT", "{prompt}")
+# 尾延迟控制（见llm_hedge.py）：任一项设置后get_client()返回HedgingLLMClient
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "0")) or None  # 单次调用（含对冲与故障转移）的总时限（秒）
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0")) or None  # 超过该延迟分位数时发出对冲请求
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")  # 备用端点的模型，对冲和故障转移时使用
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL", "")
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+_default_client: Optional[LLMClient] = None
+_default_client_lock = threading.Lock()
+
+
+def _build_client(base_url: str, cache: Optional[ResponseCache]) -> LLMClient:
+    kwargs = {}
+    client_class = LLMClient
+    if LLM_BATCH_SIZE > 1:
+        from llm_batch import BatchingLLMClient
+        client_class = BatchingLLMClient
+        kwargs = dict(max_batch_size=LLM_BATCH_SIZE, max_wait=LLM_BATCH_WAIT_MS / 1000,
+                      max_inflight=LLM_BATCH_INFLIGHT, prompt_format=LLM_PROMPT_FORMAT)
+    return client_class(
+        api_key=OPENAI_API_KEY,
+        base_url=base_url,
+        model=MODEL_NAME,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        requests_per_minute=LLM_RPM,
+        tokens_per_minute=LLM_TPM,
+        cache=cache,
+        **kwargs,
+    )
+
+
+def get_client() -> LLMClient:
+    """
+    返回进程内共享的LLMClient，首次调用时创建。
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                cache = ResponseCache(LLM_CACHE_DIR, int(LLM_CACHE_MAX_MB * 1024 * 1024)) if LLM_CACHE_DIR else None
+                client = _build_client(OPENAI_BASE_URL, cache)
+                if LLM_DEADLINE or LLM_HEDGE_PERCENTILE or LLM_FALLBACK_MODEL or LLM_FALLBACK_BASE_URL:
+                    from llm_hedge import CircuitBreaker, HedgingLLMClient, Route
+
+                    def breaker():
+                        return CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+
+                    routes = [Route(client, name="primary", breaker=breaker())]
+                    if LLM_FALLBACK_MODEL or LLM_FALLBACK_BASE_URL:
+                        fallback = _build_client(LLM_FALLBACK_BASE_URL, cache) if LLM_FALLBACK_BASE_URL else client
+                        routes.append(Route(fallback, model=LLM_FALLBACK_MODEL or None, name="fallback",
+                                            breaker=breaker()))
+                    client = HedgingLLMClient(routes, deadline=LLM_DEADLINE, hedge_percentile=LLM_HEDGE_PERCENTILE,
+                                              max_workers=LLM_MAX_CONCURRENCY * 2)
+                _default_client = client
+    return _default_client
+
+
+def set_client(client: Optional[LLMClient]):
+    """
+    替换共享客户端（例如指向本地stub服务器，或使用不同的限流配置）。
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+def call_llm_completion(prompt: str, model: Optional[str] = None, **params) -> Completion:
+    """
+    调用LLM并返回包含用量与延迟的Completion。失败时抛出llm_client.LLMError。
+    """
+    return get_client().complete(prompt, model=model, **params)
+
+
+async def acall_llm_completion(prompt: str, model: Optional[str] = None, **params) -> Completion:
+    """
+    call_llm_completion的异步版本，供异步引擎在事件循环中调用。
+    """
+    return await get_client().acomplete(prompt, model=model, **params)
+
+
+def call_llm_api(prompt: str, model: Optional[str] = None) -> str:
     """
     Call the OpenAI GPT-4o API with the given prompt and return the response.
     prompt: 英文prompt
     return: 英文回复
+    失败（超时、限流、连接错误等）在重试耗尽后抛出llm_client.LLMError，不再返回哨兵字符串。
     """
-    try:
-        # 新版openai>=1.0.0的用法
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY or None,
-            base_url=OPENAI_BASE_URL or None
-        )
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1000,
-            temperature=0.7,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"[LLM API ERROR] {e}")
-        return "Sorry, I cannot respond right now." 
\ No newline at end of file
+    return call_llm_completion(prompt, model=model).text
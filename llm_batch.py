@@ -0,0 +1,306 @@
+# 微批处理：把同一时刻发出的prompt（一个阶段内所有玩家、同一进程内的多局对局）在一个很短的时间窗内
+# 攒成一批，用一次/v1/completions请求发给自托管的OpenAI兼容推理服务（vLLM、TGI、llama.cpp server等），
+# 再把结果分发回各自的调用方，让服务端的批处理真正发挥作用。
+# Micro-batching dispatcher for local OpenAI-compatible inference backends.
+#
+# 运行：LLM_BATCH_SIZE=16 LLM_BATCH_WAIT_MS=5 OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python main.py en 10
+#       python llm_batch.py --bench 512 --concurrency 64 --batch-sizes 1,4,16,64   # 对模拟推理设备的stub测吞吐
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+
+from llm_client import Completion, LLMClient, LLMResponseError, LLMTimeoutError, estimate_tokens
+
+# 补全接口支持的采样参数，其余（如response_format）不随批量请求发送
+COMPLETION_PARAMS = ("max_tokens", "temperature", "top_p", "stop", "seed", "logit_bias",
+                     "presence_penalty", "frequency_penalty", "n")
+
+
+class _Pending:
+    __slots__ = ("prompt", "future", "enqueued")
+
+    def __init__(self, prompt: str, future: Future, enqueued: float):
+        self.prompt = prompt
+        self.future = future
+        self.enqueued = enqueued
+
+
+class MicroBatcher:
+    """
+    通用的微批调度器。submit(prompt, key)返回Future；key相同（同一模型和采样参数）的请求才会合并。
+    某个key的队列达到max_batch_size，或其中最早的请求已等待max_wait秒时发出一批。
+    同时在途的批次不超过max_inflight；在途已满时新请求继续排队，下一批因此更大（负载越高批量越大）。
+    send(prompts, key)返回与prompts一一对应的结果，抛出的异常会传给这一批的所有调用方。
+    """
+    def __init__(self, send: Callable[[List[str], str], list], max_batch_size: int = 16,
+                 max_wait: float = 0.005, max_inflight: int = 4):
+        self.send = send
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_inflight = max(1, max_inflight)
+        self._queues: Dict[str, List[_Pending]] = {}
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix="llm-batch")
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+        self.size_counts: Dict[int, int] = {}
+
+    def submit(self, prompt: str, key: str = "") -> Future:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("batcher is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-batcher", daemon=True)
+                self._thread.start()
+            queue = self._queues.setdefault(key, [])
+            queue.append(_Pending(prompt, future, time.monotonic()))
+            # 只在新队列出现或队列已满时唤醒调度线程，其余情况由它按时间窗自行醒来
+            if len(queue) == 1 or len(queue) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def _due(self, now: float) -> Optional[str]:
+        """
+        返回应当立即发出的队列key；没有时返回None。满队列优先，其次是等待最久的队列。
+        """
+        oldest_key, oldest = None, None
+        for key, queue in self._queues.items():
+            if len(queue) >= self.max_batch_size:
+                return key
+            if oldest is None or queue[0].enqueued < oldest:
+                oldest_key, oldest = key, queue[0].enqueued
+        if oldest is not None and now - oldest >= self.max_wait:
+            return oldest_key
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._queues:
+                        return
+                    key = self._due(time.monotonic()) if not self._closed else next(iter(self._queues))
+                    if key is not None:
+                        break
+                    if not self._queues:
+                        self._cond.wait()
+                    else:
+                        oldest = min(queue[0].enqueued for queue in self._queues.values())
+                        self._cond.wait(max(0.0, oldest + self.max_wait - time.monotonic()))
+            # 等待在途名额时不持有锁，新请求继续进入队列
+            self._slots.acquire()
+            with self._cond:
+                queue = self._queues.get(key, [])
+                batch = queue[:self.max_batch_size]
+                del queue[:self.max_batch_size]
+                if not queue:
+                    self._queues.pop(key, None)
+            # 调用方已超时取消的请求不再发出；标记为运行中之后cancel()不再生效，结果会被调用方忽略
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                self._slots.release()
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self.size_counts[len(batch)] = self.size_counts.get(len(batch), 0) + 1
+            self._executor.submit(self._dispatch, key, batch)
+
+    def _dispatch(self, key: str, batch: List[_Pending]):
+        try:
+            results = self.send([item.prompt for item in batch], key)
+            if len(results) != len(batch):
+                raise LLMResponseError(f"batch of {len(batch)} prompts returned {len(results)} results")
+        except BaseException as e:
+            for item in batch:
+                item.future.set_exception(e)
+        else:
+            for item, result in zip(batch, results):
+                item.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 3) if self.batches else None,
+            "batch_sizes": dict(sorted(self.size_counts.items())),
+        }
+
+    def close(self):
+        """
+        发出剩余的请求后停止调度线程。
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+
+class BatchingLLMClient(LLMClient):
+    """
+    把complete()/acomplete()经MicroBatcher合并为批量的/v1/completions请求的LLMClient，
+    可直接用llm_api.set_client()替换共享客户端（LLM_BATCH_SIZE > 1时get_client()自动使用）。
+    补全接口不套用服务端的聊天模板，prompt_format用于自行包装（如"<|user|>\\n{prompt}\\n<|assistant|>\\n"）。
+    服务端只返回整批的用量，按各prompt/回复的估计token数比例分摊到每次调用。
+    缓存、限流、重试和超时与LLMClient相同，只是以批为单位。
+    """
+    def __init__(self, *args, max_batch_size: int = 16, max_wait: float = 0.005, max_inflight: int = 4,
+                 prompt_format: str = "{prompt}", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prompt_format = prompt_format
+        self.batcher = MicroBatcher(self._send_batch, max_batch_size=max_batch_size, max_wait=max_wait,
+                                    max_inflight=max_inflight)
+
+    def _batch_key(self, request: dict) -> str:
+        params = {k: v for k, v in request.items() if k in COMPLETION_PARAMS}
+        params["model"] = request["model"]
+        return json.dumps(params, sort_keys=True)
+
+    def _send_batch(self, prompts: List[str], key: str) -> List[Completion]:
+        params = json.loads(key)
+        model = params.pop("model")
+        formatted = [self.prompt_format.replace("{prompt}", prompt) for prompt in prompts]
+        prompt_estimates = [estimate_tokens(p) for p in formatted]
+        n = params.get("n", 1)
+        budget = sum(prompt_estimates) + params.get("max_tokens", self.max_tokens) * len(prompts) * n
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.acquire(budget)
+            start = time.monotonic()
+            try:
+                with self._semaphore:
+                    response = self.client.completions.create(model=model, prompt=formatted, **params)
+                return self._split(response, model, prompt_estimates, time.monotonic() - start, attempt, n)
+            except Exception as exc:
+                error = self._translate(exc, attempt)
+                if attempt > self.max_retries or not self._retryable(error):
+                    raise error
+                time.sleep(self._backoff(attempt, error))
+
+    @staticmethod
+    def _split(response, model: str, prompt_estimates: List[int], latency: float, attempts: int,
+               n: int = 1) -> List[Completion]:
+        """
+        按choices[i].index把批量回复分回各个prompt（每个prompt n个回复，第i个prompt的回复下标为i*n到i*n+n-1），
+        并分摊整批的用量。
+        """
+        slots: List[Optional[str]] = [None] * (len(prompt_estimates) * n)
+        for choice in response.choices or []:
+            if 0 <= choice.index < len(slots):
+                slots[choice.index] = (choice.text or "").strip()
+        if any(text is None for text in slots):
+            raise LLMResponseError(f"batch response is missing choices ({len(response.choices or [])} of {len(slots)})",
+                                   attempts=attempts)
+        samples = [slots[i * n:(i + 1) * n] for i in range(len(prompt_estimates))]
+        texts = [group[0] for group in samples]
+        usage = getattr(response, "usage", None)
+        total_prompt = getattr(usage, "prompt_tokens", 0) or 0
+        total_completion = getattr(usage, "completion_tokens", 0) or 0
+        completion_estimates = [sum(estimate_tokens(text) for text in group) for group in samples]
+        prompt_sum = sum(prompt_estimates) or 1
+        completion_sum = sum(completion_estimates) or 1
+        served = getattr(response, "model", None) or model
+        return [Completion(text, served,
+                           prompt_tokens=round(total_prompt * p / prompt_sum),
+                           completion_tokens=round(total_completion * c / completion_sum),
+                           latency=latency, attempts=attempts, samples=group if n > 1 else None)
+                for text, group, p, c in zip(texts, samples, prompt_estimates, completion_estimates)]
+
+    def _wait_budget(self) -> float:
+        """
+        等待一次批量请求结果的上限：与单独请求相同的超时、重试和退避总时长。
+        """
+        return self.timeout * (self.max_retries + 1) + self.backoff_max * self.max_retries
+
+    def _timeout_error(self, cause: BaseException) -> LLMTimeoutError:
+        return LLMTimeoutError(f"batched request did not complete within {self._wait_budget():.1f}s",
+                               attempts=self.max_retries + 1, cause=cause)
+
+    def complete(self, prompt: str, model: Optional[str] = None,
+                 on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        # 批量请求不支持流式输出，on_token在回复完成后一次收到整段文本
+        request = self._request(prompt, model, params)
+        cache_key, completion = self._cache_lookup(request)
+        if completion is None:
+            future = self.batcher.submit(prompt, self._batch_key(request))
+            try:
+                completion = future.result(timeout=self._wait_budget())
+            except FutureTimeoutError as e:
+                # 与其他客户端一样抛出LLMError，调用方据此保存进度或计入熔断；仍在排队的请求随之取消
+                future.cancel()
+                raise self._timeout_error(e) from e
+            self._cache_store(cache_key, completion)
+        if on_token is not None:
+            on_token(completion.text)
+        return completion
+
+    async def acomplete(self, prompt: str, model: Optional[str] = None,
+                        on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        request = self._request(prompt, model, params)
+        cache_key, completion = self._cache_lookup(request)
+        if completion is None:
+            future = self.batcher.submit(prompt, self._batch_key(request))
+            try:
+                # 超时后wait_for取消包装的future，取消会传到批次中的请求（已发出的结果被忽略）
+                completion = await asyncio.wait_for(asyncio.wrap_future(future), self._wait_budget())
+            except asyncio.TimeoutError as e:
+                raise self._timeout_error(e) from e
+            self._cache_store(cache_key, completion)
+        if on_token is not None:
+            on_token(completion.text)
+        return completion
+
+    def close(self):
+        self.batcher.close()
+        super().close()
+
+
+def run_bench(num_requests: int, concurrency: int, batch_sizes: List[int], latency: float,
+              item_latency: float, max_wait: float):
+    """
+    对模拟单个推理设备的stub（请求串行处理，耗时 latency + item_latency * 批大小）测量不同批大小下的吞吐。
+    批大小1表示不合并：每个prompt一次请求。
+    """
+    from stub_server import start_stub_server
+
+    prompt = "Vote to eliminate one player from candidates=[0, 1, 2, 3]. Return the player id only."
+    for size in batch_sizes:
+        server, base_url = start_stub_server(latency=latency, item_latency=item_latency, device=True, seed=0)
+        client = BatchingLLMClient(api_key="stub", base_url=base_url, model="stub", max_concurrency=concurrency,
+                                   max_batch_size=size, max_wait=max_wait)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: client.complete(prompt), range(num_requests)))
+        elapsed = time.monotonic() - start
+        stats = client.batcher.stats()
+        print(f"batch_size={size:<4} {num_requests} prompts in {elapsed:6.2f}s ({num_requests / elapsed:7.1f} prompts/s), "
+              f"{stats['batches']} requests, avg batch {stats['avg_batch_size']}")
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched LLM calls against a simulated device")
+    parser.add_argument("--bench", type=int, default=512, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=64, help="同时发出请求的线程数")
+    parser.add_argument("--batch-sizes", default="1,4,16,64")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次生成的固定耗时（秒）")
+    parser.add_argument("--item-latency", type=float, default=0.002, help="批中每个prompt增加的耗时（秒）")
+    parser.add_argument("--wait-ms", type=float, default=5.0, help="攒批的时间窗（毫秒）")
+    args = parser.parse_args()
+    run_bench(args.bench, args.concurrency, [int(x) for x in args.batch_sizes.split(",")], args.latency,
+              args.item_latency, args.wait_ms / 1000)
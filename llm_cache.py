@@ -0,0 +1,108 @@
+# 持久化的prompt→response缓存，按(模型, 参数, prompt)的内容哈希寻址，超过容量时按最近使用时间淘汰。
+# Persistent content-addressed prompt->response cache with size-based LRU eviction.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+class ResponseCache:
+    """
+    磁盘缓存。每个条目是 directory/<hash[:2]>/<hash>.json 一个文件，写入时先写临时文件再原子替换，
+    因此多个进程可以共享同一个目录。读取命中会刷新文件的mtime，淘汰时先删除mtime最早的条目。
+    """
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(model: str, params: dict, prompt: str) -> str:
+        """
+        由模型名、请求参数和prompt计算缓存键。参数按键排序后序列化，顺序不同的同一组参数得到同一个键。
+        """
+        payload = json.dumps({"model": model, "params": params, "prompt": prompt},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data) - old_size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self, target_ratio: float = 0.9):
+        """
+        按mtime从旧到新删除条目，直到总大小降到max_bytes*target_ratio以下。
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            size = sum(e[2] for e in entries)
+            target = self.max_bytes * target_ratio
+            for path, _, entry_size in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entry_size
+                except FileNotFoundError:
+                    size -= entry_size
+            self._size = size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._size, "updated": time.time()}
@@ -0,0 +1,412 @@
+# 长连接复用的LLM客户端：连接池、并发上限、令牌桶限流、超时与指数退避重试。
+# Long-lived LLM client with a shared connection pool, concurrency cap,
+# token-bucket rate limiting, timeouts and exponential-backoff retries.
+
+import asyncio
+import random
+import re
+import threading
+import time
+import types
+import weakref
+from typing import Callable, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import openai
+    from llm_cache import ResponseCache
+
+
+def _openai():
+    """
+    延迟导入openai：只使用非LLM的agent后端（agents.py）时不需要安装openai，也不付出导入开销。
+    """
+    import openai
+    return openai
+
+
+class LLMError(Exception):
+    """
+    LLM调用失败的基类，替代原来的 "Sorry, I cannot respond right now." 哨兵字符串。
+    """
+    def __init__(self, message: str, attempts: int = 1, cause: Optional[BaseException] = None):
+        super().__init__(message)
+        self.attempts = attempts
+        self.cause = cause
+
+
+class LLMTimeoutError(LLMError):
+    """请求超时。"""
+
+
+class LLMRateLimitError(LLMError):
+    """服务端限流（HTTP 429）且重试耗尽。"""
+
+
+class LLMConnectionError(LLMError):
+    """网络连接失败。"""
+
+
+class LLMResponseError(LLMError):
+    """服务端返回错误状态码或内容为空。"""
+    def __init__(self, message: str, status_code: Optional[int] = None, **kwargs):
+        super().__init__(message, **kwargs)
+        self.status_code = status_code
+
+
+_CJK_RE = re.compile(r'[\u3000-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计token数：中日韩字符按1个token计，其余字符按4个字符1个token计。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return max(1, cjk + (len(text) - cjk) // 4)
+
+
+class TokenBucket:
+    """
+    令牌桶。rate为每秒补充的令牌数，capacity为桶容量。
+    reserve()立即预留令牌并返回需要等待的秒数（允许透支），同步和异步调用方各自去sleep。
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 单次请求超过桶容量时按容量计，否则永远无法满足
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    按每分钟请求数（RPM）和每分钟token数（TPM）限流，任一为None表示不限制。
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens: int) -> float:
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens: int):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Completion:
+    """
+    一次成功调用的结果。
+    """
+    __slots__ = ("text", "model", "prompt_tokens", "completion_tokens", "latency", "attempts", "cached", "samples")
+
+    def __init__(self, text: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                 latency: float = 0.0, attempts: int = 1, cached: bool = False, samples: Optional[list] = None):
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.attempts = attempts
+        self.cached = cached  # 是否来自ResponseCache（未发出请求）
+        self.samples = samples  # 请求n > 1时的全部回复，text为第一个
+
+    def __repr__(self):
+        return f"Completion(model={self.model!r}, tokens={self.prompt_tokens}+{self.completion_tokens}, latency={self.latency:.3f})"
+
+
+class _StreamedResponse:
+    """
+    把流式响应的各个chunk拼回与非流式响应相同的结构（choices[i].message.content、usage、model），
+    index为0的回复每收到一段就回调on_token。
+    """
+    def __init__(self, on_token: Callable[[Optional[str]], None]):
+        self.on_token = on_token
+        self.parts = {}
+        self.model = None
+        self.usage = None
+
+    def add(self, chunk):
+        self.model = getattr(chunk, "model", None) or self.model
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices or ():
+            text = getattr(choice.delta, "content", None)
+            if text:
+                self.parts.setdefault(choice.index, []).append(text)
+                if choice.index == 0:
+                    self.on_token(text)
+
+    @property
+    def choices(self) -> list:
+        return [types.SimpleNamespace(message=types.SimpleNamespace(content="".join(self.parts[index])))
+                for index in sorted(self.parts)]
+
+
+class LLMClient:
+    """
+    长期存活的LLM客户端。底层openai客户端只创建一次，HTTP连接在调用之间复用（keep-alive）。
+    同一个实例可以同时被多个线程（complete）和一个事件循环（acomplete）使用。
+    """
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, model: str = "gpt-4o",
+                 timeout: float = 60.0, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 max_concurrency: int = 16, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_tokens: int = 1000, temperature: float = 0.7,
+                 cache: Optional["ResponseCache"] = None):
+        self.api_key = api_key or None
+        self.base_url = base_url or None
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.cache = cache  # 可选的llm_cache.ResponseCache，命中时不发请求
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        # 每个事件循环各自一个信号量；弱引用，循环结束后不再被客户端保留
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self._client: Optional["openai.OpenAI"] = None
+        self._aclient: Optional["openai.AsyncOpenAI"] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> "openai.OpenAI":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # 重试由本类负责，关闭SDK自带的重试，避免重试次数相乘
+                    self._client = _openai().OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                    timeout=self.timeout, max_retries=0)
+        return self._client
+
+    @property
+    def aclient(self) -> "openai.AsyncOpenAI":
+        if self._aclient is None:
+            with self._lock:
+                if self._aclient is None:
+                    self._aclient = _openai().AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                          timeout=self.timeout, max_retries=0)
+        return self._aclient
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            # 发生过等待的信号量会引用自己的事件循环，弱引用对它们不起作用，新建时顺便清理已关闭的循环
+            for closed in [other for other in self._async_semaphores.keys() if other.is_closed()]:
+                del self._async_semaphores[closed]
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _request(self, prompt: str, model: Optional[str], params: dict) -> dict:
+        request = {
+            "model": model or self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+        }
+        request.update(params)
+        return request
+
+    def _cache_lookup(self, request: dict):
+        """
+        返回(缓存键, 命中的Completion)。未配置缓存时返回(None, None)。
+        """
+        if self.cache is None:
+            return None, None
+        params = {k: v for k, v in request.items() if k not in ("model", "messages")}
+        key = self.cache.make_key(request["model"], params, request["messages"][0]["content"])
+        entry = self.cache.get(key)
+        if entry is None:
+            return key, None
+        return key, Completion(entry["text"], entry["model"], prompt_tokens=entry.get("prompt_tokens", 0),
+                               completion_tokens=entry.get("completion_tokens", 0), latency=0.0,
+                               attempts=0, cached=True, samples=entry.get("samples"))
+
+    def _cache_store(self, key: Optional[str], completion: Completion):
+        if key is not None:
+            entry = {"text": completion.text, "model": completion.model, "prompt_tokens": completion.prompt_tokens,
+                     "completion_tokens": completion.completion_tokens}
+            if completion.samples:
+                entry["samples"] = completion.samples
+            self.cache.put(key, entry)
+
+    def _backoff(self, attempt: int, error: LLMError) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        # full jitter，避免大量并发请求同时重试
+        return random.uniform(0, delay)
+
+    @staticmethod
+    def _translate(exc: BaseException, attempts: int) -> LLMError:
+        """
+        把openai SDK的异常转换为本模块的类型化异常。
+        """
+        if isinstance(exc, LLMError):
+            return exc
+        openai = _openai()
+        if isinstance(exc, openai.APITimeoutError):
+            return LLMTimeoutError(str(exc), attempts=attempts, cause=exc)
+        if isinstance(exc, openai.APIConnectionError):
+            return LLMConnectionError(str(exc), attempts=attempts, cause=exc)
+        if isinstance(exc, openai.RateLimitError):
+            error = LLMRateLimitError(str(exc), attempts=attempts, cause=exc)
+            try:
+                error.retry_after = float(exc.response.headers.get("retry-after"))
+            except (TypeError, ValueError, AttributeError):
+                error.retry_after = None
+            return error
+        if isinstance(exc, openai.APIStatusError):
+            return LLMResponseError(str(exc), status_code=exc.status_code, attempts=attempts, cause=exc)
+        return LLMError(f"{type(exc).__name__}: {exc}", attempts=attempts, cause=exc)
+
+    @staticmethod
+    def _retryable(error: LLMError) -> bool:
+        if isinstance(error, (LLMTimeoutError, LLMConnectionError, LLMRateLimitError)):
+            return True
+        if isinstance(error, LLMResponseError):
+            return error.status_code is None or error.status_code >= 500 or error.status_code == 408
+        return False
+
+    def _completion(self, response, model: str, latency: float, attempts: int) -> Completion:
+        if not response.choices or response.choices[0].message.content is None:
+            raise LLMResponseError("empty completion", attempts=attempts)
+        usage = getattr(response, "usage", None)
+        samples = None
+        if len(response.choices) > 1:
+            samples = [choice.message.content.strip() for choice in response.choices
+                       if choice.message.content is not None]
+        return Completion(
+            response.choices[0].message.content.strip(),
+            getattr(response, "model", None) or model,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            latency=latency,
+            attempts=attempts,
+            samples=samples,
+        )
+
+    @staticmethod
+    def _stream_request(request: dict) -> dict:
+        return dict(request, stream=True, stream_options={"include_usage": True})
+
+    def complete(self, prompt: str, model: Optional[str] = None,
+                 on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        """
+        同步调用，失败时按指数退避重试，重试耗尽后抛出LLMError的子类。
+        params会覆盖默认的请求参数（如max_tokens、temperature）。
+        on_token不为None时使用流式请求，每收到一段回复文本就调用on_token(text)；重试前调用on_token(None)，
+        表示丢弃已收到的部分。缓存命中时整段回复只回调一次。
+        """
+        request = self._request(prompt, model, params)
+        cache_key, cached = self._cache_lookup(request)
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached.text)
+            return cached
+        budget = estimate_tokens(prompt) + request["max_tokens"] * request.get("n", 1)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.acquire(budget)
+            if on_token is not None and attempt > 1:
+                on_token(None)
+            start = time.monotonic()
+            try:
+                with self._semaphore:
+                    if on_token is None:
+                        response = self.client.chat.completions.create(**request)
+                    else:
+                        response = _StreamedResponse(on_token)
+                        for chunk in self.client.chat.completions.create(**self._stream_request(request)):
+                            response.add(chunk)
+                completion = self._completion(response, request["model"], time.monotonic() - start, attempt)
+                self._cache_store(cache_key, completion)
+                return completion
+            except Exception as exc:
+                error = self._translate(exc, attempt)
+                if attempt > self.max_retries or not self._retryable(error):
+                    raise error
+                time.sleep(self._backoff(attempt, error))
+
+    async def acomplete(self, prompt: str, model: Optional[str] = None,
+                        on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        """
+        complete()的异步版本，共享同一套限流器和缓存。
+        """
+        request = self._request(prompt, model, params)
+        cache_key, cached = self._cache_lookup(request)
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached.text)
+            return cached
+        budget = estimate_tokens(prompt) + request["max_tokens"] * request.get("n", 1)
+        semaphore = self._async_semaphore()
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.limiter.acquire_async(budget)
+            if on_token is not None and attempt > 1:
+                on_token(None)
+            start = time.monotonic()
+            try:
+                async with semaphore:
+                    if on_token is None:
+                        response = await self.aclient.chat.completions.create(**request)
+                    else:
+                        response = _StreamedResponse(on_token)
+                        async for chunk in await self.aclient.chat.completions.create(
+                                **self._stream_request(request)):
+                            response.add(chunk)
+                completion = self._completion(response, request["model"], time.monotonic() - start, attempt)
+                self._cache_store(cache_key, completion)
+                return completion
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                error = self._translate(exc, attempt)
+                if attempt > self.max_retries or not self._retryable(error):
+                    raise error
+                await asyncio.sleep(self._backoff(attempt, error))
+
+    def close(self):
+        """
+        关闭底层连接池。
+        """
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        """
+        关闭异步连接池。
+        """
+        if self._aclient is not None:
+            await self._aclient.close()
+            self._aclient = None
@@ -0,0 +1,455 @@
+# 尾延迟控制：单次调用的截止时间、超过历史延迟百分位后向同一或备用模型发出对冲请求（取先返回的结果）、
+# 对持续失败的端点熔断并绕行，以及各机制触发次数的计数。
+# Hedged requests, deadlines and circuit breaking for tail-latency control.
+#
+# 运行：LLM_DEADLINE=20 LLM_HEDGE_PERCENTILE=0.95 LLM_FALLBACK_MODEL=gpt-4o-mini python main.py en 10
+#       python llm_hedge.py --requests 300 --spike-rate 0.05 --spike-latency 2   # 对注入延迟尖峰的stub对比
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from llm_client import Completion, LLMClient, LLMError, LLMTimeoutError
+
+
+class CircuitOpenError(LLMError):
+    """
+    所有端点都处于熔断状态，没有发出请求。
+    """
+
+
+class CircuitBreaker:
+    """
+    连续失败failure_threshold次后熔断（open），reset_timeout秒内不再发请求；
+    之后进入半开（half_open），只放行一个探测请求，成功则恢复，失败则再次熔断。
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """
+        记录一次失败，本次导致熔断时返回True。
+        """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class LatencyWindow:
+    """
+    最近window次成功调用的延迟，用于计算对冲的触发时间。
+    """
+    def __init__(self, window: int = 200):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._values:
+                return None
+            values = sorted(self._values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Route:
+    """
+    一个可发请求的端点：LLMClient加可选的模型名（None表示沿用调用方指定的模型），各自有熔断器和延迟窗口。
+    """
+    def __init__(self, client: LLMClient, model: Optional[str] = None, name: Optional[str] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.model = model
+        self.name = name or model or client.base_url or "default"
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyWindow()
+
+
+class _TokenGate:
+    """
+    对冲时的流式输出：只转发主请求的token。由对冲或故障转移的请求胜出时，先发出on_token(None)丢弃已转发的部分，
+    再一次给出完整回复；调用结束后不再转发（较慢的请求仍在后台生成）。
+    """
+    def __init__(self, on_token: Callable[[Optional[str]], None]):
+        self.on_token = on_token
+        self.open = True
+        self.emitted = False
+        self.lock = threading.Lock()
+
+    def __call__(self, text: Optional[str]):
+        with self.lock:
+            if self.open:
+                self.emitted = True
+                self.on_token(text)
+
+    def finish(self, completion: Optional[Completion] = None, kind: str = "primary"):
+        with self.lock:
+            if not self.open:
+                return
+            self.open = False
+            if completion is not None and kind != "primary":
+                if self.emitted:
+                    self.on_token(None)
+                self.on_token(completion.text)
+
+
+class HedgingLLMClient:
+    """
+    在多个Route之上提供与LLMClient相同的complete()/acomplete()接口，可直接用llm_api.set_client()替换共享客户端。
+    - deadline：单次调用（含对冲和故障转移）的总时限，超过时抛出LLMTimeoutError
+    - 对冲：首选端点超过其最近延迟的hedge_percentile分位（样本不足min_samples时为hedge_delay秒）仍未返回时，
+      向下一个可用端点（只有一个端点时为同一端点）再发一次，取先成功的结果；异步调用会取消较慢的请求
+    - 故障转移：首选端点报错时立即改发下一个可用端点
+    - 熔断：每个端点各自的CircuitBreaker，熔断中的端点被跳过
+    计数见stats()，export_metrics()写入metrics.MetricsRegistry。
+    """
+    def __init__(self, routes: List[Route], deadline: Optional[float] = None, hedge_percentile: Optional[float] = 0.95,
+                 hedge_delay: float = 2.0, min_hedge_delay: float = 0.05, min_samples: int = 20,
+                 max_workers: int = 64):
+        if not routes:
+            raise ValueError("at least one route is required")
+        self.routes = routes
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._counters: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> str:
+        return self.routes[0].model or self.routes[0].client.model
+
+    def _count(self, event: str, route: Optional[Route] = None):
+        key = (event, route.name if route is not None else "")
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        """
+        各机制的触发次数：calls、hedges（发出的对冲请求）、hedge_wins（对冲请求先返回）、failovers、
+        deadline_exceeded、breaker_opens、breaker_skips（因熔断跳过端点）、errors，以及各端点的请求数与失败数。
+        """
+        totals: Dict[str, int] = {}
+        routes: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for (event, route), count in self._counters.items():
+                totals[event] = totals.get(event, 0) + count
+                if route:
+                    per_route = routes.setdefault(route, {})
+                    per_route[event] = per_route.get(event, 0) + count
+        totals["routes"] = {route.name: dict(routes.get(route.name, {}), breaker=route.breaker.state)
+                            for route in self.routes}
+        return totals
+
+    def export_metrics(self, registry):
+        """
+        把计数写入metrics.MetricsRegistry（werewolf_llm_resilience_events{event, route}）。
+        """
+        registry.describe("werewolf_llm_resilience_events", "Deadline, hedging, failover and circuit breaker events")
+        with self._lock:
+            counters = dict(self._counters)
+        for (event, route), count in sorted(counters.items()):
+            registry.inc("werewolf_llm_resilience_events", {"event": event, "route": route or "all"}, count)
+
+    def _hedge_after(self, route: Route) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        if len(route.latencies) < self.min_samples:
+            return self.hedge_delay
+        return max(self.min_hedge_delay, route.latencies.percentile(self.hedge_percentile))
+
+    def _next_route(self, tried: List[Route]) -> Optional[Route]:
+        for route in self.routes:
+            if route in tried:
+                continue
+            if route.breaker.allow():
+                return route
+            self._count("breaker_skips", route)
+        return None
+
+    def _record(self, route: Route, start: float, error: Optional[BaseException] = None):
+        if error is None:
+            route.latencies.add(time.monotonic() - start)
+            route.breaker.record_success()
+            return
+        self._count("errors", route)
+        if isinstance(error, LLMError) and route.breaker.record_failure():
+            self._count("breaker_opens", route)
+
+    def _call(self, route: Route, prompt: str, model: Optional[str], params: dict) -> Completion:
+        self._count("requests", route)
+        start = time.monotonic()
+        try:
+            completion = route.client.complete(prompt, model=route.model or model, **params)
+        except Exception as e:
+            self._record(route, start, e)
+            raise
+        self._record(route, start)
+        return completion
+
+    async def _acall(self, route: Route, prompt: str, model: Optional[str], params: dict) -> Completion:
+        self._count("requests", route)
+        start = time.monotonic()
+        try:
+            completion = await route.client.acomplete(prompt, model=route.model or model, **params)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record(route, start, e)
+            raise
+        self._record(route, start)
+        return completion
+
+    def _first_route(self) -> Route:
+        self._count("calls")
+        route = self._next_route([])
+        if route is None:
+            self._count("rejected")
+            raise CircuitOpenError("all LLM routes are open")
+        return route
+
+    def _hedge_route(self, tried: List[Route]) -> Optional[Route]:
+        """
+        对冲优先发往未试过的端点，只有一个端点时发往同一端点。
+        """
+        route = self._next_route(tried)
+        if route is None and len(self.routes) == 1 and tried[0].breaker.state == CircuitBreaker.CLOSED:
+            route = tried[0]
+        return route
+
+    def complete(self, prompt: str, model: Optional[str] = None,
+                 on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        gate = _TokenGate(on_token) if on_token is not None else None
+        try:
+            return self._complete(prompt, model, params, gate)
+        finally:
+            if gate is not None:
+                gate.finish()
+
+    def _complete(self, prompt: str, model: Optional[str], params: dict, gate: Optional[_TokenGate]) -> Completion:
+        start = time.monotonic()
+        primary = self._first_route()
+        tried = [primary]
+        primary_params = params if gate is None else dict(params, on_token=gate)
+        pending = {self._executor.submit(self._call, primary, prompt, model, primary_params): (primary, "primary")}
+        hedge_after = self._hedge_after(primary)
+        hedged = False
+        error: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic()
+            timeouts = []
+            if self.deadline is not None:
+                timeouts.append(start + self.deadline - now)
+            if not hedged and hedge_after is not None:
+                timeouts.append(start + hedge_after - now)
+            done, _ = wait(pending, timeout=max(0.0, min(timeouts)) if timeouts else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                route, kind = pending.pop(future)
+                try:
+                    completion = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if kind != "primary":
+                    self._count(f"{kind}_wins", route)
+                if gate is not None:
+                    gate.finish(completion, kind)
+                # 较慢的请求无法中断，在后台完成（结果只用于延迟统计和熔断）
+                return completion
+            if self.deadline is not None and time.monotonic() - start >= self.deadline:
+                self._count("deadline_exceeded")
+                raise LLMTimeoutError(f"LLM call exceeded deadline of {self.deadline}s")
+            if not pending:
+                # 所有请求都失败了：故障转移到下一个可用端点
+                route = self._next_route(tried)
+                if route is None:
+                    raise error
+                self._count("failovers", route)
+                tried.append(route)
+                pending[self._executor.submit(self._call, route, prompt, model, params)] = (route, "failover")
+            elif not hedged and hedge_after is not None and time.monotonic() - start >= hedge_after:
+                hedged = True
+                route = self._hedge_route(tried)
+                if route is not None:
+                    self._count("hedges", route)
+                    if route not in tried:
+                        tried.append(route)
+                    pending[self._executor.submit(self._call, route, prompt, model, params)] = (route, "hedge")
+        raise error
+
+    async def acomplete(self, prompt: str, model: Optional[str] = None,
+                        on_token: Optional[Callable[[Optional[str]], None]] = None, **params) -> Completion:
+        gate = _TokenGate(on_token) if on_token is not None else None
+        try:
+            if self.deadline is None:
+                return await self._acomplete(prompt, model, params, gate)
+            try:
+                return await asyncio.wait_for(self._acomplete(prompt, model, params, gate), self.deadline)
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise LLMTimeoutError(f"LLM call exceeded deadline of {self.deadline}s") from None
+        finally:
+            if gate is not None:
+                gate.finish()
+
+    async def _acomplete(self, prompt: str, model: Optional[str], params: dict,
+                         gate: Optional[_TokenGate] = None) -> Completion:
+        start = time.monotonic()
+        primary = self._first_route()
+        tried = [primary]
+        primary_params = params if gate is None else dict(params, on_token=gate)
+        pending = {asyncio.ensure_future(self._acall(primary, prompt, model, primary_params)): (primary, "primary")}
+        hedge_after = self._hedge_after(primary)
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None
+                if not hedged and hedge_after is not None:
+                    timeout = max(0.0, start + hedge_after - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    route, kind = pending.pop(task)
+                    try:
+                        completion = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if kind != "primary":
+                        self._count(f"{kind}_wins", route)
+                    if gate is not None:
+                        gate.finish(completion, kind)
+                    return completion
+                if not pending:
+                    route = self._next_route(tried)
+                    if route is None:
+                        raise error
+                    self._count("failovers", route)
+                    tried.append(route)
+                    pending[asyncio.ensure_future(self._acall(route, prompt, model, params))] = (route, "failover")
+                elif not hedged and hedge_after is not None and time.monotonic() - start >= hedge_after:
+                    hedged = True
+                    route = self._hedge_route(tried)
+                    if route is not None:
+                        self._count("hedges", route)
+                        if route not in tried:
+                            tried.append(route)
+                        pending[asyncio.ensure_future(self._acall(route, prompt, model, params))] = (route, "hedge")
+            raise error
+        finally:
+            # 取消较慢的请求
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for route in self.routes:
+            route.client.close()
+
+    async def aclose(self):
+        for route in self.routes:
+            await route.client.aclose()
+
+
+def run_bench(num_requests: int, concurrency: int, latency: float, spike_rate: float, spike_latency: float,
+              hedge_percentile: float, deadline: Optional[float]):
+    """
+    对注入延迟尖峰的stub对比直接调用与对冲调用的延迟分位数。
+    """
+    from stub_server import start_stub_server
+
+    prompt = "Vote to eliminate one player from candidates=[0, 1, 2, 3]. Return the player id only."
+
+    def measure(client) -> dict:
+        latencies = []
+        errors = 0
+
+        def one(_):
+            nonlocal errors
+            start = time.monotonic()
+            try:
+                client.complete(prompt)
+            except LLMError:
+                errors += 1
+                return
+            latencies.append(time.monotonic() - start)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(num_requests)))
+        latencies.sort()
+        q = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+        return {"p50": q(0.5), "p95": q(0.95), "p99": q(0.99), "max": round(latencies[-1], 3) if latencies else None,
+                "errors": errors}
+
+    server, base_url = start_stub_server(latency=latency, jitter=latency / 2, spike_rate=spike_rate,
+                                         spike_latency=spike_latency, seed=0)
+    plain = LLMClient(api_key="stub", base_url=base_url, model="stub", max_concurrency=concurrency * 2, max_retries=0)
+    print("direct ", json.dumps(measure(plain)))
+    hedging = HedgingLLMClient([Route(plain, name="stub")], deadline=deadline, hedge_percentile=hedge_percentile,
+                               hedge_delay=latency * 2, min_samples=20)
+    print("hedged ", json.dumps(measure(hedging)))
+    print("events ", json.dumps(hedging.stats()))
+    hedging.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare direct and hedged LLM calls against a stub with latency spikes")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="正常请求的平均延迟（秒）")
+    parser.add_argument("--spike-rate", type=float, default=0.05, help="出现延迟尖峰的请求比例")
+    parser.add_argument("--spike-latency", type=float, default=2.0, help="尖峰请求额外增加的延迟（秒）")
+    parser.add_argument("--hedge-percentile", type=float, default=0.9)
+    parser.add_argument("--deadline", type=float, default=None)
+    args = parser.parse_args()
+    run_bench(args.requests, args.concurrency, args.latency, args.spike_rate, args.spike_latency,
+              args.hedge_percentile, args.deadline)
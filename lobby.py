@@ -0,0 +1,294 @@
+# 大厅模式：30-200人的对局。白天分桌并行讨论，每桌每轮只有有限的发言人；
+# 玩家的prompt只包含本桌发言、其他桌的有限摘录和最近几轮的公开结果，单个prompt的大小与人数无关，
+# 每轮的prompt总量随人数线性增长。夜晚支持多个狼群、多个预言家和女巫。
+# Large-lobby game mode with parallel sub-tables and bounded digests.
+#
+# 运行：python lobby.py --players 100 --agents heuristic              # 跑一局，输出prompt总量
+#       python lobby.py --players 10,30,100,200 --compare             # 与经典模式比较prompt总量
+#       python tournament.py --games 20 --players 100 --lobby --agents heuristic
+
+import argparse
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from history_compactor import heuristic_summary
+from roles import Role
+
+_MENTION_RE = re.compile(r"(?:player|玩家)\s*(\d+)", re.IGNORECASE)
+
+
+class LobbyConfig:
+    """
+    大厅模式配置（GameEngine(lobby=...)）。
+    table_size: 每桌人数上限，存活玩家每天重新随机分桌
+    speakers_per_table: 每桌每轮的发言人数上限，优先最久没有发言的玩家
+    digest_speeches: 每个prompt中其他桌发言摘录的条数上限，依次从各桌轮流选取
+    excerpt_chars: 每条摘录保留的字符数
+    shortlist_size: 全场提名人数，按本轮发言中被提到的次数选出；每人可投提名者或本桌玩家
+    memory_rounds: prompt中保留最近几轮的死亡、淘汰和得票前列
+    pack_size: 每个狼群的人数上限，每个狼群每晚各杀一人
+    eliminations_per_day: 每天按得票淘汰的人数，None表示与存活的狼群数相同（与夜里的刀数相当）
+    """
+    def __init__(self, table_size: int = 10, speakers_per_table: int = 4, digest_speeches: int = 12,
+                 excerpt_chars: int = 80, shortlist_size: int = 6, memory_rounds: int = 2, pack_size: int = 4,
+                 eliminations_per_day: Optional[int] = None):
+        if table_size < 2 or speakers_per_table < 1 or pack_size < 1:
+            raise ValueError("table_size must be at least 2, speakers_per_table and pack_size at least 1")
+        self.table_size = table_size
+        self.speakers_per_table = speakers_per_table
+        self.digest_speeches = digest_speeches
+        self.excerpt_chars = excerpt_chars
+        self.shortlist_size = shortlist_size
+        self.memory_rounds = memory_rounds
+        self.pack_size = pack_size
+        self.eliminations_per_day = eliminations_per_day
+
+
+def lobby_role_distribution(num_players: int) -> Dict[Role, int]:
+    """
+    大厅的默认身份配置：约1/4狼人，每15人一个预言家和女巫，每20人一个猎人（各至少一个），其余为平民。
+    """
+    wolves = max(1, num_players // 4)
+    seers = witches = max(1, num_players // 15)
+    hunters = max(1, num_players // 20)
+    villagers = num_players - wolves - seers - witches - hunters
+    if villagers < 0:
+        raise ValueError(f"{num_players} players are too few for a lobby")
+    return {Role.WOLF: wolves, Role.SEER: seers, Role.WITCH: witches, Role.HUNTER: hunters, Role.VILLAGER: villagers}
+
+
+class Lobby:
+    """
+    大厅模式的分桌、发言人选择、提名和有界视图。除当天的分桌外不保存状态，其余都由历史推出，
+    因此检查点无需额外内容（分桌使用引擎的随机数生成器，随检查点保存）。
+    按轮次缓存由历史推出的摘要，每个prompt只做与人数无关的工作。
+    """
+    def __init__(self, config: LobbyConfig):
+        self.config = config
+        self.tables: List[List[int]] = []
+        self.table_of: Dict[int, int] = {}
+        self._speech_rounds: Dict[int, Tuple[Dict[int, int], List[List[Tuple[int, str]]], Dict[int, List[Dict]]]] = {}
+        self._recent: Dict[Tuple[int, int], Dict] = {}
+
+    def seat(self, alive_ids: List[int], rng) -> List[List[int]]:
+        """
+        把存活玩家随机分成人数均衡的若干桌，记为当天的分桌。
+        """
+        order = list(alive_ids)
+        rng.shuffle(order)
+        count = max(1, -(-len(order) // self.config.table_size))
+        self.tables = [sorted(order[i::count]) for i in range(count)]
+        self.table_of = {pid: i for i, table in enumerate(self.tables) for pid in table}
+        return self.tables
+
+    def speakers(self, history) -> List[List[int]]:
+        """
+        每桌的发言人：最久没有发言的玩家优先（从未发言的最先），同样久时按座位。
+        """
+        last_spoke: Dict[int, int] = {}
+        for event in history.public:
+            if event.get("phase") == "day_speech":
+                for speech in event.get("speeches", []):
+                    last_spoke[speech["player_id"]] = event.get("round", 0)
+        window = self.config.speakers_per_table
+        return [sorted(sorted(table, key=lambda pid: last_spoke.get(pid, -1))[:window]) for table in self.tables]
+
+    def shortlist(self, speeches: List[Dict], alive: List[int]) -> List[int]:
+        """
+        全场提名：本轮发言中被提到次数最多的存活玩家（同样多时按座位），最多shortlist_size人。
+        """
+        alive_set = set(alive)
+        counts: Dict[int, int] = {}
+        for speech in speeches:
+            for number in set(_MENTION_RE.findall(str(speech.get("speech", "")))):
+                pid = int(number)
+                if pid in alive_set and pid != speech["player_id"]:
+                    counts[pid] = counts.get(pid, 0) + 1
+        ranked = sorted(counts, key=lambda pid: (-counts[pid], pid))
+        return sorted(ranked[:self.config.shortlist_size])
+
+    def vote_candidates(self, player_id: int, shortlist: List[int]) -> List[int]:
+        """
+        某个玩家的投票候选：全场提名加上本桌的存活玩家，人数与大厅规模无关。
+        """
+        table = self.tables[self.table_of[player_id]] if player_id in self.table_of else []
+        return sorted(set(shortlist) | set(table))
+
+    def packs(self, wolves: List) -> List[List]:
+        """
+        按座位把存活的狼人分成人数均衡的狼群（每群不超过pack_size人）。
+        """
+        if not wolves:
+            return []
+        count = -(-len(wolves) // self.config.pack_size)
+        return [wolves[i::count] for i in range(count)]
+
+    def eliminations(self, wolves_alive: int) -> int:
+        if self.config.eliminations_per_day is not None:
+            return self.config.eliminations_per_day
+        return max(1, -(-wolves_alive // self.config.pack_size))
+
+    def _speech_round(self, event: Dict):
+        """
+        一轮发言的缓存：座位 -> 桌号、各桌的摘录、各桌的完整发言。
+        """
+        round_num = event.get("round", 0)
+        cached = self._speech_rounds.get(round_num)
+        if cached is not None:
+            return cached
+        tables = event.get("tables") or []
+        table_of = {pid: i for i, table in enumerate(tables) for pid in table}
+        excerpts = heuristic_summary(round_num, [event], self.config.excerpt_chars)
+        by_table: List[List[Tuple[int, str]]] = [[] for _ in tables]
+        full: Dict[int, List[Dict]] = {}
+        for speech in event.get("speeches", []):
+            index = speech.get("table", table_of.get(speech["player_id"], 0))
+            full.setdefault(index, []).append({"player_id": speech["player_id"], "speech": speech["speech"]})
+            if index < len(by_table):
+                by_table[index].append((speech["player_id"], excerpts.get(str(speech["player_id"]), "")))
+        cached = (table_of, by_table, full)
+        # 只保留最近的发言轮次
+        self._speech_rounds = {r: v for r, v in self._speech_rounds.items() if r >= round_num - 1}
+        self._speech_rounds[round_num] = cached
+        return cached
+
+    def _digest(self, by_table: List[List[Tuple[int, str]]], own: int) -> List[Dict]:
+        """
+        其他桌的发言摘录：从本桌之后的一桌开始轮流取，每桌一条，共不超过digest_speeches条。
+        不同桌的玩家看到不同的起点，各桌的信息都能传开。
+        """
+        limit = self.config.digest_speeches
+        count = len(by_table)
+        others = [by_table[(own + offset) % count] for offset in range(1, count)]
+        digest: List[Dict] = []
+        depth = 0
+        while len(digest) < limit and any(depth < len(t) for t in others):
+            for offset, table in enumerate(others, start=1):
+                if depth < len(table) and len(digest) < limit:
+                    pid, excerpt = table[depth]
+                    digest.append({"player_id": pid, "table": (own + offset) % count, "excerpt": excerpt})
+            depth += 1
+        return digest
+
+    def _round_summary(self, round_num: int, events: List[Dict]) -> Dict:
+        """
+        一轮的公开结果：夜里的死者、猎人开枪、白天被淘汰者和得票最多的三人。
+        """
+        key = (round_num, len(events))
+        cached = self._recent.get(key)
+        if cached is not None:
+            return cached
+        summary: Dict = {"round": round_num, "phase": "round_result"}
+        for event in events:
+            phase = event.get("phase")
+            if phase == "night":
+                killed = event.get("killed")
+                deaths = list(killed) if isinstance(killed, list) else ([] if killed is None else [killed])
+                poisoned = event.get("poisoned")
+                deaths += list(poisoned) if isinstance(poisoned, list) else []
+                summary["night_deaths"] = sorted(set(deaths))
+            elif phase == "hunter_shoot":
+                summary.setdefault("shot", []).append(event.get("target"))
+            elif phase == "day_vote":
+                tally: Dict[int, int] = {}
+                for target in event.get("votes", {}).values():
+                    tally[target] = tally.get(target, 0) + 1
+                summary["top_votes"] = sorted(([t, n] for t, n in tally.items()), key=lambda x: (-x[1], x[0]))[:3]
+                summary["eliminated"] = event.get("eliminated_all", event.get("eliminated"))
+        self._recent = {k: v for k, v in self._recent.items() if k[0] >= round_num - self.config.memory_rounds}
+        self._recent[key] = summary
+        return summary
+
+    def view(self, history, player_id: int, round_num: int, alive: int, extras: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        玩家的有界历史视图：
+        - 大厅概况（当前轮次、存活人数、桌数、本桌成员）
+        - 最近memory_rounds轮的公开结果
+        - 最近一轮发言中该玩家所在桌的完整发言，以及其他桌的摘录
+        - 该玩家的私有信息（extras）
+        只从历史末尾向前扫描最近几轮，工作量与对局长度和人数无关。
+        """
+        first_round = round_num - self.config.memory_rounds + 1
+        by_round: Dict[int, List[Dict]] = {}
+        speech_event = None
+        for event in reversed(history.events):
+            event_round = event.get("round")
+            if event_round is None:
+                continue
+            if event.get("phase") == "day_speech" and speech_event is None:
+                speech_event = event
+            if event_round < first_round:
+                if speech_event is not None:
+                    break
+                continue
+            by_round.setdefault(event_round, []).insert(0, event)
+        view: List[Dict] = [{
+            "phase": "lobby", "round": round_num, "alive": alive, "tables": len(self.tables),
+            "your_table": self.tables[self.table_of[player_id]] if player_id in self.table_of else [],
+        }]
+        view.extend(self._round_summary(r, by_round[r]) for r in sorted(by_round))
+        if speech_event is not None:
+            table_of, by_table, full = self._speech_round(speech_event)
+            own = table_of.get(player_id)
+            speech_round = speech_event.get("round", 0)
+            if own is not None:
+                view.append({"phase": "table_speeches", "round": speech_round, "table": own,
+                             "speeches": full.get(own, [])})
+            if by_table:
+                view.append({"phase": "other_tables", "round": speech_round,
+                             "digest": self._digest(by_table, own if own is not None else -1)})
+        if extras:
+            view.extend(extras)
+        return view
+
+
+def prompt_volume(num_players: int, lobby: Optional[LobbyConfig], agents: str = "heuristic", seed: int = 0) -> dict:
+    """
+    用非LLM后端跑一局并统计prompt总量（字符数与估算token数），用于比较经典模式与大厅模式的规模增长。
+    """
+    from agents import make_agent
+    from event_sink import QUIET
+    from game_engine import GameEngine
+    from llm_client import estimate_tokens
+    from logger import GameLogger
+    from tournament import default_role_distribution
+
+    distribution = lobby_role_distribution(num_players) if lobby is not None else default_role_distribution(num_players)
+    engine = GameEngine(num_players, distribution, seed=seed, agents=make_agent(agents), lobby=lobby,
+                        logger=GameLogger(verbosity=QUIET))
+    engine.run()
+    prompts = engine.logger.detailed_prompts
+    chars = sum(len(p["prompt"]) for p in prompts)
+    by_phase: Dict[str, int] = {}
+    for p in prompts:
+        by_phase[p["phase"]] = by_phase.get(p["phase"], 0) + 1
+    return {
+        "players": num_players,
+        "mode": "lobby" if lobby is not None else "classic",
+        "result": engine.logger.result,
+        "rounds": engine.round,
+        "calls": len(prompts),
+        "calls_by_phase": by_phase,
+        "prompt_chars": chars,
+        "prompt_tokens_est": sum(estimate_tokens(p["prompt"]) for p in prompts),
+        "max_prompt_chars": max((len(p["prompt"]) for p in prompts), default=0),
+    }
+
+
+if __name__ == "__main__":
+    from agents import AGENTS
+
+    parser = argparse.ArgumentParser(description="Run large-lobby Werewolf games and report prompt volume")
+    parser.add_argument("--players", default="100", help="人数，逗号分隔可跑多个规模")
+    parser.add_argument("--agents", default="heuristic", choices=sorted(a for a in AGENTS if a != "llm"))
+    parser.add_argument("--table-size", type=int, default=10)
+    parser.add_argument("--speakers", type=int, default=4, help="每桌每轮的发言人数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", action="store_true", help="同时以经典模式运行，比较prompt总量")
+    args = parser.parse_args()
+    config = LobbyConfig(table_size=args.table_size, speakers_per_table=args.speakers)
+    for n in (int(x) for x in args.players.split(",")):
+        print(json.dumps(prompt_volume(n, config, args.agents, args.seed), ensure_ascii=False))
+        if args.compare:
+            print(json.dumps(prompt_volume(n, None, args.agents, args.seed), ensure_ascii=False))
@@ -0,0 +1,470 @@
+# 可查询的对局日志库：把GameLogger的日志（.json / 紧凑的.cjson(.gz)）增量导入本地SQLite，
+# 建立games/roles/night_actions/votes/speeches/prompts表、常用索引和发言全文索引（FTS5），
+# 跨几万局的查询不必再逐个加载、扫描JSON文件。
+# Queryable indexed store for game logs (SQLite + FTS5).
+#
+# 运行：python log_store.py ingest game_log_*.json tournament_out/games/    # 只导入新增或变化的文件
+#       python log_store.py speeches --role WOLF --round 3 --mentions-role SEER
+#       python log_store.py speeches --text "checked player" --limit 5
+#       python log_store.py sql "SELECT role, COUNT(*) FROM roles GROUP BY role"
+#       python log_store.py stats
+
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from analytics import iter_log_sections
+from roles import Role, get_role_info
+
+DEFAULT_DB = "werewolf_logs.db"
+LOG_SUFFIXES = (".json", ".cjson", ".cjson.gz", ".json.gz")
+ROLE_NAMES = {role.value: role.name for role in Role}
+WOLF_CAMP = get_role_info(Role.WOLF)["camp"]
+# 发言中提到的座位号（"player 3" / "Player3" / "玩家3" / "3号"）
+_MENTION_RE = re.compile(r"(?:[Pp]layer\s*|玩家\s*)(\d+)|(\d+)\s*号")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    game_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    result TEXT,
+    winner TEXT,
+    rounds INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roles (
+    game_id INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    camp TEXT,
+    model TEXT,
+    won INTEGER,
+    PRIMARY KEY (game_id, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS night_actions (
+    game_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    actor INTEGER,
+    target INTEGER,
+    result TEXT
+);
+CREATE TABLE IF NOT EXISTS votes (
+    game_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    voter INTEGER NOT NULL,
+    target INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS speeches (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    speech_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    PRIMARY KEY (speech_id, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS prompts (
+    game_id INTEGER NOT NULL,
+    round INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    prompt TEXT,
+    response TEXT,
+    latency REAL,
+    model TEXT
+);
+CREATE INDEX IF NOT EXISTS roles_role ON roles (role, game_id, seat);
+CREATE INDEX IF NOT EXISTS night_actions_game ON night_actions (game_id, round);
+CREATE INDEX IF NOT EXISTS night_actions_action ON night_actions (action, target);
+CREATE INDEX IF NOT EXISTS votes_game ON votes (game_id, round);
+CREATE INDEX IF NOT EXISTS votes_target ON votes (game_id, target);
+CREATE INDEX IF NOT EXISTS speeches_game ON speeches (game_id, round, seat);
+CREATE INDEX IF NOT EXISTS speeches_round ON speeches (round);
+CREATE INDEX IF NOT EXISTS mentions_game ON mentions (game_id, seat);
+CREATE INDEX IF NOT EXISTS prompts_game ON prompts (game_id, round, phase);
+CREATE INDEX IF NOT EXISTS prompts_phase ON prompts (phase);
+"""
+
+
+def _fts_tokenizer(conn: sqlite3.Connection) -> str:
+    """
+    SQLite 3.34+支持trigram分词，可对中文发言做子串匹配；更早的版本退回unicode61。
+    """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp._probe")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61"
+
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """
+    展开glob和目录（递归查找日志文件），返回去重排序后的路径。
+    """
+    paths = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern) or [pattern]:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    paths.update(os.path.join(root, name) for name in names if name.endswith(LOG_SUFFIXES))
+            elif os.path.exists(path):
+                paths.add(path)
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def parse_game(path: str, include_prompts: bool = True) -> dict:
+    """
+    把一局日志解析为各表的行（不含game_id）。在工作进程中执行。
+    """
+    roles: Dict[int, str] = {}
+    models: Dict[int, str] = {}
+    result = None
+    rounds = 0
+    nights, votes, speeches, prompts = [], [], [], []
+    prev_save_used = False
+    for section, item in iter_log_sections(path):
+        if section == "roles":
+            roles = {int(seat): value for seat, value in item.items()}
+        elif section == "models":
+            models = {int(seat): model for seat, model in item.items()}
+        elif section == "result":
+            result = item or None
+        elif section == "logs":
+            phase = item.get("phase")
+            round_num = item.get("round") or 0
+            rounds = max(rounds, round_num)
+            if phase == "night" and "kills" in item:
+                # 大厅模式（lobby.py）：多个狼群、预言家和女巫，执行者直接记录在事件中
+                killed = set(item.get("killed") or [])
+                for kill in item["kills"]:
+                    nights.append((round_num, "kill", kill["pack"][0], kill["target"],
+                                   None if kill["target"] in killed else "saved"))
+                for wolf, choice in (item.get("wolf_votes") or {}).items():
+                    nights.append((round_num, "wolf_vote", int(wolf), choice, None))
+                for check in item.get("seer_checks") or []:
+                    nights.append((round_num, "check", check["seer"], check["checked_id"], check["result"]))
+                for action in item.get("witch_actions") or []:
+                    if action.get("saved"):
+                        nights.append((round_num, "save", action["witch"], action["attacked"], None))
+                    if action.get("poison_target") is not None:
+                        nights.append((round_num, "poison", action["witch"], action["poison_target"], None))
+            elif phase == "night":
+                witch = item.get("witch_action") or {}
+                # save_used是累计标记，只有从False变为True的那一晚才是真正用了解药
+                save_used = bool(witch.get("save_used"))
+                saved = witch.get("save_target") if save_used and not prev_save_used else None
+                prev_save_used = prev_save_used or save_used
+                # killed是结算后的死者，被救时狼人的目标即解药目标
+                target = item.get("killed") if saved is None else saved
+                nights.append((round_num, "kill", None, target, "saved" if saved is not None else None))
+                # 狼人议会（GameEngine(wolf_council=True)）中每个狼人的选择
+                for wolf, choice in (item.get("wolf_votes") or {}).items():
+                    nights.append((round_num, "wolf_vote", int(wolf), choice, None))
+                check = item.get("seer_check")
+                if check:
+                    nights.append((round_num, "check", None, check.get("checked_id"), check.get("result")))
+                if saved is not None:
+                    nights.append((round_num, "save", None, saved, None))
+                if witch.get("poison_target") is not None:
+                    nights.append((round_num, "poison", None, witch["poison_target"], None))
+            elif phase == "hunter_shoot":
+                nights.append((round_num, "shoot", item.get("hunter"), item.get("target"), None))
+            elif phase == "day_speech":
+                for speech in item.get("speeches", []):
+                    speeches.append((round_num, int(speech["player_id"]), str(speech.get("speech", ""))))
+            elif phase == "day_vote":
+                for voter, target in (item.get("votes") or {}).items():
+                    votes.append((round_num, int(voter), int(target)))
+        elif section == "detailed_prompts" and include_prompts:
+            prompts.append((int(item.get("round", 0)), int(item.get("player_id", -1)), item.get("phase", ""),
+                            item.get("prompt"), None if item.get("response") is None else str(item["response"]),
+                            item.get("latency"), item.get("model")))
+    # 夜晚行动的执行者：女巫、预言家只有一人时按身份补全
+    seats_by_role: Dict[str, List[int]] = {}
+    for seat, value in roles.items():
+        seats_by_role.setdefault(ROLE_NAMES.get(value, value), []).append(seat)
+    actor_role = {"check": "SEER", "save": "WITCH", "poison": "WITCH"}
+    filled = []
+    for round_num, action, actor, target, outcome in nights:
+        seats = seats_by_role.get(actor_role.get(action), [])
+        if actor is None and len(seats) == 1:
+            actor = seats[0]
+        filled.append((round_num, action, actor, target, outcome))
+    winner = {"Villagers win!": "good", "Wolves win!": "wolf"}.get(result)
+    role_rows = []
+    for seat in sorted(roles):
+        camp = get_role_info(Role(roles[seat]))["camp"] if roles[seat] in ROLE_NAMES else None
+        won = None
+        if winner is not None and camp is not None:
+            won = int((camp == WOLF_CAMP) == (winner == "wolf"))
+        role_rows.append((seat, ROLE_NAMES.get(roles[seat], roles[seat]), camp, models.get(seat), won))
+    return {
+        "path": path, "result": result, "winner": winner, "rounds": rounds, "roles": role_rows,
+        "nights": filled, "votes": votes, "speeches": speeches, "prompts": prompts,
+    }
+
+
+def _parse_chunk(args) -> List[dict]:
+    paths, include_prompts = args
+    parsed = []
+    for path in paths:
+        try:
+            parsed.append(parse_game(path, include_prompts))
+        except Exception as e:
+            parsed.append({"path": path, "error": f"{type(e).__name__}: {e}"})
+    return parsed
+
+
+class LogStore:
+    """
+    SQLite日志库。ingest()增量导入日志，其余方法为常用查询，sql()执行任意只读SQL。
+    表结构（seat为座位号，role为Role的英文名如WOLF）：
+      games(id, path, result, winner good/wolf, rounds, players)
+      roles(game_id, seat, role, camp, model, won)
+      night_actions(game_id, round, action kill/check/save/poison/shoot/wolf_vote, actor, target, result)
+      votes(game_id, round, voter, target)
+      speeches(id, game_id, round, seat, text)，全文索引speeches_fts
+      mentions(speech_id, game_id, seat)：发言中提到的座位号
+      prompts(game_id, round, seat, phase, prompt, response, latency, model)
+    """
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'speeches_fts'").fetchone() is None:
+            self.conn.execute(f"CREATE VIRTUAL TABLE speeches_fts USING fts5(text, content='speeches', "
+                              f"content_rowid='id', tokenize='{_fts_tokenizer(self.conn)}')")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _pending(self, paths: List[str]) -> List[str]:
+        """
+        返回新增或大小/修改时间有变化的文件。
+        """
+        known = {row["path"]: (row["size"], row["mtime_ns"])
+                 for row in self.conn.execute("SELECT path, size, mtime_ns FROM files")}
+        pending = []
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                pending.append(path)
+        return pending
+
+    def _delete_game(self, game_id: int):
+        conn = self.conn
+        for row in conn.execute("SELECT id, text FROM speeches WHERE game_id = ?", (game_id,)).fetchall():
+            conn.execute("INSERT INTO speeches_fts(speeches_fts, rowid, text) VALUES ('delete', ?, ?)",
+                         (row["id"], row["text"]))
+        for table in ("roles", "night_actions", "votes", "speeches", "mentions", "prompts"):
+            conn.execute(f"DELETE FROM {table} WHERE game_id = ?", (game_id,))
+        conn.execute("DELETE FROM games WHERE id = ?", (game_id,))
+
+    def _insert(self, game: dict):
+        conn = self.conn
+        path = game["path"]
+        old = conn.execute("SELECT game_id FROM files WHERE path = ?", (path,)).fetchone()
+        if old is not None and old["game_id"] is not None:
+            self._delete_game(old["game_id"])
+        stat = os.stat(path)
+        if "error" in game:
+            conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)", (path, stat.st_size, stat.st_mtime_ns))
+            return
+        game_id = conn.execute(
+            "INSERT INTO games (path, result, winner, rounds, players, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, game["result"], game["winner"], game["rounds"], len(game["roles"]), time.time())).lastrowid
+        conn.executemany("INSERT INTO roles VALUES (?, ?, ?, ?, ?, ?)", [(game_id,) + row for row in game["roles"]])
+        conn.executemany("INSERT INTO night_actions VALUES (?, ?, ?, ?, ?, ?)",
+                         [(game_id,) + row for row in game["nights"]])
+        conn.executemany("INSERT INTO votes VALUES (?, ?, ?, ?)", [(game_id,) + row for row in game["votes"]])
+        seats = {row[0] for row in game["roles"]}
+        for round_num, seat, text in game["speeches"]:
+            speech_id = conn.execute("INSERT INTO speeches (game_id, round, seat, text) VALUES (?, ?, ?, ?)",
+                                     (game_id, round_num, seat, text)).lastrowid
+            conn.execute("INSERT INTO speeches_fts(rowid, text) VALUES (?, ?)", (speech_id, text))
+            mentioned = {int(a or b) for a, b in _MENTION_RE.findall(text)} & seats
+            mentioned.discard(seat)
+            conn.executemany("INSERT INTO mentions VALUES (?, ?, ?)",
+                             [(speech_id, game_id, other) for other in sorted(mentioned)])
+        conn.executemany("INSERT INTO prompts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         [(game_id,) + row for row in game["prompts"]])
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime_ns, game_id))
+
+    def ingest(self, patterns: Iterable[str], workers: Optional[int] = None, include_prompts: bool = True,
+               chunk_size: int = 64) -> dict:
+        """
+        导入新增或变化的日志（变化的文件先删除旧记录）。workers > 1时在进程池中解析，主进程按块写入，
+        每块一个事务。返回{"files", "ingested", "skipped", "errors"}。
+        """
+        paths = expand_paths(patterns)
+        pending = self._pending(paths)
+        chunks = [(pending[i:i + chunk_size], include_prompts) for i in range(0, len(pending), chunk_size)]
+        ingested, errors = 0, []
+        if workers is not None and workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(_parse_chunk, chunks)
+                for games in results:
+                    ingested += self._write_chunk(games, errors)
+        else:
+            for chunk in chunks:
+                ingested += self._write_chunk(_parse_chunk(chunk), errors)
+        if pending:
+            # 更新查询规划器的统计信息
+            self.conn.execute("PRAGMA optimize")
+        return {"files": len(paths), "ingested": ingested, "skipped": len(paths) - len(pending), "errors": errors}
+
+    def _write_chunk(self, games: List[dict], errors: List[dict]) -> int:
+        with self.conn:
+            for game in games:
+                self._insert(game)
+                if "error" in game:
+                    errors.append({"path": game["path"], "error": game["error"]})
+        return sum(1 for game in games if "error" not in game)
+
+    def sql(self, query: str, params: Iterable = ()) -> List[dict]:
+        return [dict(row) for row in self.conn.execute(query, tuple(params))]
+
+    def speeches(self, text: Optional[str] = None, role: Optional[str] = None, round_num: Optional[int] = None,
+                 mentions_role: Optional[str] = None, model: Optional[str] = None, winner: Optional[str] = None,
+                 limit: Optional[int] = 100) -> List[dict]:
+        """
+        按条件查询发言。text为FTS5查询（trigram分词时至少3个字符，可匹配中文子串）；
+        role为发言者身份；mentions_role要求发言提到了该身份的某个座位（如狼人发言中点名预言家）。
+        """
+        joins = ["JOIN roles r ON r.game_id = s.game_id AND r.seat = s.seat"]
+        where, params = [], []
+        if text:
+            joins.append("JOIN speeches_fts f ON f.rowid = s.id")
+            where.append("speeches_fts MATCH ?")
+            params.append(text)
+        if role:
+            where.append("r.role = ?")
+            params.append(role.upper())
+        if round_num is not None:
+            where.append("s.round = ?")
+            params.append(round_num)
+        if model:
+            where.append("r.model = ?")
+            params.append(model)
+        if winner:
+            joins.append("JOIN games g ON g.id = s.game_id")
+            where.append("g.winner = ?")
+            params.append(winner)
+        if mentions_role:
+            # CROSS JOIN固定从本条发言的mentions出发，避免按身份扫描整张roles表
+            where.append("EXISTS (SELECT 1 FROM mentions m CROSS JOIN roles mr ON mr.game_id = m.game_id "
+                         "AND mr.seat = m.seat WHERE m.speech_id = s.id AND mr.role = ?)")
+            params.append(mentions_role.upper())
+        query = (f"SELECT s.game_id, s.round, s.seat, r.role, r.model, s.text FROM speeches s {' '.join(joins)}"
+                 + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY s.game_id, s.round, s.seat")
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self.sql(query, params)
+
+    def votes(self, voter_role: Optional[str] = None, target_role: Optional[str] = None,
+              round_num: Optional[int] = None, limit: Optional[int] = 100) -> List[dict]:
+        where, params = [], []
+        if voter_role:
+            where.append("vr.role = ?")
+            params.append(voter_role.upper())
+        if target_role:
+            where.append("tr.role = ?")
+            params.append(target_role.upper())
+        if round_num is not None:
+            where.append("v.round = ?")
+            params.append(round_num)
+        query = ("SELECT v.game_id, v.round, v.voter, vr.role AS voter_role, v.target, tr.role AS target_role "
+                 "FROM votes v JOIN roles vr ON vr.game_id = v.game_id AND vr.seat = v.voter "
+                 "JOIN roles tr ON tr.game_id = v.game_id AND tr.seat = v.target"
+                 + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY v.game_id, v.round, v.voter")
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self.sql(query, params)
+
+    def stats(self) -> dict:
+        counts = {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("games", "roles", "night_actions", "votes", "speeches", "prompts")}
+        counts["results"] = {row["result"] or "unfinished": row["n"] for row in
+                             self.conn.execute("SELECT result, COUNT(*) AS n FROM games GROUP BY result")}
+        counts["db_bytes"] = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return counts
+
+
+def _print_rows(rows: List[dict], width: int):
+    for row in rows:
+        if "text" in row and width:
+            row = dict(row, text=row["text"].replace("\n", " ")[:width])
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and query Werewolf game logs in SQLite")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ingest = sub.add_parser("ingest", help="导入日志文件、glob或目录")
+    p_ingest.add_argument("paths", nargs="+")
+    p_ingest.add_argument("--workers", type=int, default=None)
+    p_ingest.add_argument("--no-prompts", action="store_true", help="不导入详细prompt（库会小很多）")
+    p_speech = sub.add_parser("speeches", help="查询发言")
+    p_speech.add_argument("--text", default=None, help="FTS5全文查询")
+    p_speech.add_argument("--role", default=None)
+    p_speech.add_argument("--round", type=int, default=None)
+    p_speech.add_argument("--mentions-role", default=None, help="发言提到了该身份的玩家")
+    p_speech.add_argument("--model", default=None)
+    p_speech.add_argument("--winner", default=None, choices=["good", "wolf"])
+    p_speech.add_argument("--limit", type=int, default=20)
+    p_speech.add_argument("--width", type=int, default=160, help="发言截断长度，0为不截断")
+    p_votes = sub.add_parser("votes", help="查询投票")
+    p_votes.add_argument("--voter-role", default=None)
+    p_votes.add_argument("--target-role", default=None)
+    p_votes.add_argument("--round", type=int, default=None)
+    p_votes.add_argument("--limit", type=int, default=20)
+    p_sql = sub.add_parser("sql", help="执行SQL")
+    p_sql.add_argument("query")
+    sub.add_parser("stats", help="各表行数")
+    args = parser.parse_args()
+    with LogStore(args.db) as store:
+        start = time.perf_counter()
+        if args.command == "ingest":
+            print(json.dumps(store.ingest(args.paths, workers=args.workers, include_prompts=not args.no_prompts),
+                             ensure_ascii=False))
+        elif args.command == "speeches":
+            _print_rows(store.speeches(args.text, args.role, args.round, args.mentions_role, args.model, args.winner,
+                                       args.limit), args.width)
+        elif args.command == "votes":
+            _print_rows(store.votes(args.voter_role, args.target_role, args.round, args.limit), 0)
+        elif args.command == "sql":
+            _print_rows(store.sql(args.query), 0)
+        else:
+            print(json.dumps(store.stats(), indent=2, ensure_ascii=False))
+        print(f"({time.perf_counter() - start:.3f}s)", file=sys.stderr)
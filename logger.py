@@ -1,24 +1,54 @@
 import json
-from typing import List, Dict, Any
+from collections import deque
+from typing import Callable, List, Dict, Any, Optional, Union
 from player_agent import LLMPlayerAgent
+from event_sink import EventSink, QUIET, SUMMARY, VERBOSE
 
 class GameLogger:
     """
     游戏日志记录类，结构化记录游戏过程。
+    sink: 可选的事件输出（如event_sink.JsonlSink），每个事件产生时立即写出
+    verbosity: 终端输出级别，QUIET/SUMMARY/VERBOSE，默认VERBOSE与原来的输出一致
+    keep_prompts: 内存中保留的详细prompt条数，True为全部保留，False/0为不保留，
+                  整数N为只保留最近N条（完整记录由sink持久化）
     """
-    def __init__(self):
+    def __init__(self, sink: Optional[EventSink] = None, verbosity: int = VERBOSE,
+                 keep_prompts: Union[bool, int] = True):
         self.logs: List[Dict[str, Any]] = []
         self.roles: Dict[int, str] = {}
+        self.models: Dict[int, str] = {}  # 座位 -> 模型名，仅在指定了模型时记录
         self.result: str = ""
-        self.detailed_prompts: List[Dict[str, Any]] = []  # 新增详细prompt日志
+        self.metrics: Optional[Dict[str, Any]] = None  # 启用埋点时的计数器与直方图（见metrics.py）
+        self.sink = sink
+        self.verbosity = verbosity
+        if keep_prompts is True:
+            self.detailed_prompts = []  # 新增详细prompt日志
+        else:
+            self.detailed_prompts = deque(maxlen=int(keep_prompts))
+
+    def _emit(self, kind: str, event: Dict[str, Any], summary: str):
+        """
+        写出事件并按verbosity回显到终端。
+        """
+        if self.sink is not None:
+            record = {"type": kind}
+            record.update(event)
+            self.sink.write(record)
+        if self.verbosity >= SUMMARY:
+            print(summary)
+        if self.verbosity >= VERBOSE:
+            print(json.dumps(event, indent=2, ensure_ascii=False))
 
     def log_roles(self, players: List[LLMPlayerAgent]):
         """
         记录身份分配。
         """
         self.roles = {p.player_id: p.role.value for p in players}
-        print(f"[LOG] Roles assigned: {self.roles}")
-        print(json.dumps({"roles": self.roles}, indent=2, ensure_ascii=False))
+        self.models = {p.player_id: p.model for p in players if getattr(p, "model", None)}
+        event = {"roles": self.roles}
+        if self.models:
+            event["models"] = self.models
+        self._emit("roles", event, f"[LOG] Roles assigned: {self.roles}")
 
     def log_night(self, round_num: int, wolves: List[LLMPlayerAgent], killed_id: int, log: dict = None):
         """
@@ -32,8 +62,7 @@ class GameLogger:
                 "killed": killed_id
             }
         self.logs.append(log)
-        print(f"[LOG] Night {round_num}: Wolves killed player {killed_id}")
-        print(json.dumps(log, indent=2, ensure_ascii=False))
+        self._emit("log", log, f"[LOG] Night {round_num}: Wolves killed player {killed_id}")
 
     def log_speeches(self, round_num: int, speeches: List[Dict]):
         """
@@ -45,8 +74,7 @@ class GameLogger:
             "speeches": speeches
         }
         self.logs.append(log)
-        print(f"[LOG] Day {round_num}: Speeches recorded.")
-        print(json.dumps(log, indent=2, ensure_ascii=False))
+        self._emit("log", log, f"[LOG] Day {round_num}: Speeches recorded.")
 
     def log_votes(self, round_num: int, votes: Dict[int, int], eliminated: int):
         """
@@ -59,8 +87,14 @@ class GameLogger:
             "eliminated": eliminated
         }
         self.logs.append(log)
-        print(f"[LOG] Day {round_num}: Player {eliminated} eliminated by vote.")
-        print(json.dumps(log, indent=2, ensure_ascii=False))
+        self._emit("log", log, f"[LOG] Day {round_num}: Player {eliminated} eliminated by vote.")
+
+    def log_event(self, log: Dict[str, Any]):
+        """
+        记录其他事件（如猎人开枪）。
+        """
+        self.logs.append(log)
+        self._emit("log", log, f"[LOG] Round {log.get('round')}: {log.get('phase')}")
 
     def log_result(self, result: str):
         """
@@ -72,12 +106,21 @@ class GameLogger:
             "result": result
         }
         self.logs.append(log)
-        print(f"[LOG] Game result: {result}")
-        print(json.dumps(log, indent=2, ensure_ascii=False))
+        self._emit("log", log, f"[LOG] Game result: {result}")
+
+    @property
+    def records_prompts(self) -> bool:
+        """
+        log_prompt是否会用到prompt内容（保留在内存、写入sink或打印）。为False时引擎可以不生成prompt。
+        """
+        keeps = not isinstance(self.detailed_prompts, deque) or self.detailed_prompts.maxlen != 0
+        return keeps or self.sink is not None or self.verbosity >= SUMMARY
 
-    def log_prompt(self, player_id: int, round_num: int, phase: str, prompt: str, response: str):
+    def log_prompt(self, player_id: int, round_num: int, phase: str, prompt: str, response: str,
+                   tokens: Optional[int] = None, stats: Optional[Dict[str, Any]] = None):
         """
-        记录每个玩家每轮的prompt和LLM回复。
+        记录每个玩家每轮的prompt和LLM回复。tokens为prompt的token数（启用历史压缩时记录）。
+        stats为启用埋点时的调用信息（latency、model、usage、attempts、cached），合并进条目。
         """
         entry = {
             "player_id": player_id,
@@ -86,19 +129,98 @@ class GameLogger:
             "prompt": prompt,
             "response": response
         }
+        if tokens is not None:
+            entry["prompt_tokens"] = tokens
+        if stats:
+            entry.update(stats)
         self.detailed_prompts.append(entry)
-        print(f"[PROMPT LOG] Player {player_id} Round {round_num} Phase {phase}\nPrompt: {prompt}\nResponse: {response}\n")
+        if self.sink is not None:
+            record = {"type": "prompt"}
+            record.update(entry)
+            self.sink.write(record)
+        if self.verbosity >= VERBOSE:
+            print(f"[PROMPT LOG] Player {player_id} Round {round_num} Phase {phase}\nPrompt: {prompt}\nResponse: {response}\n")
+        elif self.verbosity >= SUMMARY:
+            print(f"[PROMPT LOG] Player {player_id} Round {round_num} Phase {phase}")
+
+    @property
+    def streams_tokens(self) -> bool:
+        """
+        sink是否实时转发事件（见live_feed.py）。为True时引擎以流式生成发言，并通过token_stream写出每段token。
+        """
+        return self.sink is not None and self.sink.live
+
+    def token_stream(self, player_id: int, round_num: int, phase: str) -> Callable[[Optional[str]], None]:
+        """
+        返回一次发言的token回调：每段文本写出一个"token"事件，None（重试前丢弃已生成的部分）写出reset事件。
+        token事件只写入sink，不进入日志和终端输出，完整发言仍由log_speeches记录。
+        """
+        def on_token(text: Optional[str]):
+            record = {"type": "token", "player_id": player_id, "round": round_num, "phase": phase}
+            if text is None:
+                record["reset"] = True
+            else:
+                record["text"] = text
+            self.sink.write(record)
+        return on_token
 
-    def save(self, filename: str = "game_log.json"):
+    def log_metrics(self, metrics: Dict[str, Any]):
         """
-        保存日志到文件。
+        记录本局的埋点汇总（MetricsRegistry.to_dict()），保存时写入"metrics"字段。
+        """
+        self.metrics = metrics
+        if self.sink is not None:
+            self.sink.write({"type": "metrics", "metrics": metrics})
+
+    def restore(self, data: Dict[str, Any]):
+        """
+        从to_dict()的结果恢复（检查点恢复时使用）。JSON往返后座位号键恢复为整数。
+        """
+        self.roles = {int(pid): role for pid, role in data.get("roles", {}).items()}
+        self.models = {int(pid): model for pid, model in data.get("models", {}).items()}
+        self.logs = list(data.get("logs", []))
+        self.result = data.get("result", "")
+        self.metrics = data.get("metrics")
+        self.detailed_prompts.clear()
+        self.detailed_prompts.extend(data.get("detailed_prompts", []))
+
+    def close(self):
+        """
+        刷新并关闭sink。
+        """
+        if self.sink is not None:
+            self.sink.close()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        save()写出的日志结构。
         """
         data = {
             "roles": self.roles,
             "logs": self.logs,
             "result": self.result,
-            "detailed_prompts": self.detailed_prompts  # 保存详细prompt日志
+            "detailed_prompts": list(self.detailed_prompts)  # 保存详细prompt日志
         }
+        if self.models:
+            data["models"] = self.models
+        if self.metrics is not None:
+            data["metrics"] = self.metrics
+        return data
+
+    def save(self, filename: str = "game_log.json", indent: Optional[int] = 2):
+        """
+        保存日志到文件。indent=None时写出紧凑JSON。
+        """
         with open(filename, "w") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        print(f"[LOG] Game log saved to {filename}") 
\ No newline at end of file
+            json.dump(self.to_dict(), f, indent=indent, ensure_ascii=False)
+        if self.verbosity > QUIET:
+            print(f"[LOG] Game log saved to {filename}")
+
+    def save_compact(self, filename: str = "game_log.cjson.gz"):
+        """
+        以去重的紧凑格式保存日志（见compact_log.py），可用compact_log.load_log无损还原。
+        """
+        from compact_log import save_compact
+        save_compact(self.to_dict(), filename)
+        if self.verbosity > QUIET:
+            print(f"[LOG] Compact game log saved to {filename}")
@@ -2,11 +2,32 @@
 
 # 游戏入口
 
+import json
+import os
+import time
+
 from roles import Role
 from game_engine import GameEngine
+from llm_api import get_client
+from llm_client import LLMError
+from agents import AGENTS, make_agent
+from metrics import GameMetrics
+from checkpoint import resume_game
+from budget import governor_from_env
+from logger import GameLogger
+
+# 每个阶段结束后写出的检查点，中断后用 python main.py --resume 继续
+CHECKPOINT_PATH = "game_checkpoint.json.gz"
 
 if __name__ == "__main__":
     import sys
+    # 可选开关：--metrics 记录性能埋点并导出game_metrics.prom，--profile 额外按阶段写出cProfile数据到profiles/，
+    # --resume 从检查点继续上次中断的对局（身份、语言等取自检查点，并发数和agent后端仍按命令行参数），
+    # --wolf-council 每晚询问所有存活的狼人并按多数决定杀人目标，
+    # --live 启动实时观战服务器（端口取LIVE_FEED_PORT，默认8765，见live_feed.py），发言逐token推送；
+    #        对局结束后交互终端等待回车，否则继续服务LIVE_FEED_LINGER秒（默认60）
+    flags = {arg for arg in sys.argv[1:] if arg.startswith("--")}
+    sys.argv = [arg for arg in sys.argv if not arg.startswith("--")]
     # 设置玩家数量和身份分布
     # 例如：2狼，1预言家，1女巫，1猎人，5平民
     num_players = 10
@@ -21,9 +42,65 @@ if __name__ == "__main__":
     language = 'en'
     if len(sys.argv) > 1 and sys.argv[1] in ['en', 'zh']:
         language = sys.argv[1]
+    # 同一阶段内独立LLM调用的并发数，可通过第二个命令行参数传递，默认顺序执行
+    max_workers = 1
+    if len(sys.argv) > 2 and sys.argv[2].isdigit():
+        max_workers = int(sys.argv[2])
+    # 第三个参数可选择非LLM的agent后端（heuristic/random），无需网络即可运行
+    agents = None
+    if len(sys.argv) > 3 and sys.argv[3] in AGENTS:
+        agents = make_agent(sys.argv[3])
     # 启动游戏引擎
-    engine = GameEngine(num_players, role_distribution, language=language)
-    engine.run()
+    metrics = GameMetrics(profile_dir="profiles" if "--profile" in flags else None) if flags & {"--metrics", "--profile"} else None
+    # 设置LLM_BUDGET_SOFT / LLM_BUDGET_HARD时启用预算控制（见budget.py）
+    budget = governor_from_env()
+    feed = None
+    logger = None
+    if "--live" in flags:
+        from live_feed import LiveFeed
+        feed = LiveFeed()
+        url = feed.start(port=int(os.getenv("LIVE_FEED_PORT", "8765")))
+        print(f"Live feed on {url}/ (SSE: {url}/events)")
+        logger = GameLogger(sink=feed.sink(0))
+    if "--resume" in flags:
+        engine = resume_game(CHECKPOINT_PATH, run=False, max_workers=max_workers, agents=agents, metrics=metrics,
+                             wolf_council="--wolf-council" in flags, budget=budget, logger=logger)
+    else:
+        engine = GameEngine(num_players, role_distribution, language=language, max_workers=max_workers, agents=agents,
+                            metrics=metrics, checkpoint=CHECKPOINT_PATH, wolf_council="--wolf-council" in flags,
+                            budget=budget, logger=logger)
+    try:
+        engine.resume() if "--resume" in flags else engine.run()
+    except LLMError as e:
+        # 重试耗尽后LLM仍不可用：保存已进行部分的日志后退出，已完成的阶段保存在检查点中
+        print(f"[LLM API ERROR] {type(e).__name__} after {e.attempts} attempt(s): {e}")
+        engine.logger.save("game_log.json")
+        print(f"Progress saved to {CHECKPOINT_PATH}; run with --resume to continue.")
+        sys.exit(1)
     # 保存日志
     engine.logger.save("game_log.json")
-    print("Game finished. Log saved to game_log.json.") 
\ No newline at end of file
+    engine.logger.close()
+    os.remove(CHECKPOINT_PATH)
+    print("Game finished. Log saved to game_log.json.")
+    if metrics is not None:
+        client = get_client()
+        if hasattr(client, "export_metrics"):
+            # 对冲、故障转移和熔断的计数（见llm_hedge.py）
+            client.export_metrics(metrics.registry)
+        metrics.registry.write_textfile("game_metrics.prom")
+        print(json.dumps(metrics.summary(), indent=2, ensure_ascii=False))
+        for path in metrics.dump_profiles():
+            print(f"Profile written to {path}")
+    if budget is not None:
+        print(json.dumps({"budget": budget.to_dict()}, ensure_ascii=False))
+    if feed is not None:
+        # 与live_feed.py --linger相同：对局结束后继续服务LIVE_FEED_LINGER秒（默认60），
+        # 交互终端中改为等待回车，非交互运行（nohup、CI、< /dev/null）时不读stdin
+        try:
+            if sys.stdin is not None and sys.stdin.isatty():
+                input("Game over. Press Enter to stop the live feed.")
+            else:
+                time.sleep(float(os.getenv("LIVE_FEED_LINGER", "60")))
+        except (KeyboardInterrupt, EOFError):
+            pass
+        feed.close() 
\ No newline at end of file
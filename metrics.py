@@ -0,0 +1,338 @@
+# 性能埋点：每次调用的延迟、API用量token、重试、解析回退，以及每个阶段和每轮的耗时。
+# 汇总为计数器和直方图，可写入对局日志，或导出为Prometheus textfile / OpenMetrics文本。
+# Per-call and per-phase performance instrumentation with exportable metrics.
+#
+# 运行：python main.py en 1 heuristic --metrics --profile   # 写出game_metrics.prom和profiles/<phase>.prof
+#       python tournament.py --agents heuristic --metrics    # 汇总所有对局，写出tournament_out/metrics.prom
+
+import contextlib
+import cProfile
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 直方图的默认桶上界（秒 / token），+Inf桶隐含
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+PHASE_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, object]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    累计桶直方图（与Prometheus语义一致）：counts[i]为落在(bounds[i-1], bounds[i]]的观测数，最后一个为+Inf桶。
+    """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Iterable[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = 0
+        bounds = self.bounds
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        total = 0
+        result = []
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        按桶估计分位数（桶内线性插值），落在+Inf桶时返回最大的有限上界。
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            if seen + n >= rank and n:
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.bounds[-1] if self.bounds else None
+
+    def merge(self, other: "Histogram"):
+        if other.bounds != self.bounds:
+            raise ValueError("cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.bounds), "counts": list(self.counts), "sum": round(self.sum, 6),
+                "count": self.count}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls(data["buckets"])
+        histogram.counts = list(data["counts"])
+        histogram.sum = data["sum"]
+        histogram.count = data["count"]
+        return histogram
+
+
+class MetricsRegistry:
+    """
+    线程安全的计数器与直方图集合，按(名称, 标签)区分序列。
+    计数器名不带_total后缀，导出时再加上。to_dict()/from_dict()/merge()用于跨进程汇总。
+    """
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str, buckets: Optional[Iterable[float]] = None):
+        self.help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, labels: Optional[Dict[str, object]] = None, value: float = 1):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, object]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def counter(self, name: str, labels: Optional[Dict[str, object]] = None) -> float:
+        return self.counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, labels: Optional[Dict[str, object]] = None) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(_labels(labels))
+
+    def merge(self, other: "MetricsRegistry"):
+        with self._lock:
+            for name, text in other.help.items():
+                self.help.setdefault(name, text)
+            for name, series in other.counters.items():
+                mine = self.counters.setdefault(name, {})
+                for key, value in series.items():
+                    mine[key] = mine.get(key, 0) + value
+            for name, series in other.histograms.items():
+                mine = self.histograms.setdefault(name, {})
+                for key, histogram in series.items():
+                    if key in mine:
+                        mine[key].merge(histogram)
+                    else:
+                        mine[key] = Histogram.from_dict(histogram.to_dict())
+
+    def to_dict(self) -> dict:
+        """
+        JSON友好的结构，写入对局日志的"metrics"字段。
+        """
+        with self._lock:
+            return {
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "histograms": {name: [dict(labels=dict(key), **h.to_dict()) for key, h in series.items()]
+                               for name, series in self.histograms.items()},
+                "help": dict(self.help),
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricsRegistry":
+        registry = cls()
+        registry.help.update(data.get("help", {}))
+        for name, series in data.get("counters", {}).items():
+            registry.counters[name] = {_labels(item["labels"]): item["value"] for item in series}
+        for name, series in data.get("histograms", {}).items():
+            registry.histograms[name] = {_labels(item["labels"]): Histogram.from_dict(item) for item in series}
+        return registry
+
+    def render(self, openmetrics: bool = False) -> str:
+        """
+        导出为Prometheus文本格式（node_exporter textfile collector可直接读取），openmetrics=True时为OpenMetrics格式。
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self.counters):
+                if name in self.help:
+                    lines.append(f"# HELP {name if openmetrics else name + '_total'} {self.help[name]}")
+                lines.append(f"# TYPE {name if openmetrics else name + '_total'} counter")
+                for key, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}_total{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self.histograms):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self.histograms[name].items()):
+                    for bound, total in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {total}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(round(histogram.sum, 6))}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str, openmetrics: bool = False):
+        """
+        原子地写出导出文件（先写临时文件再改名），避免采集端读到半个文件。
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render(openmetrics))
+        os.replace(tmp, path)
+
+
+class GameMetrics:
+    """
+    引擎的埋点接口（GameEngine(metrics=...)）。registry可以在多局之间共享以汇总。
+    profile_dir不为None时对每个阶段（night/day）启用cProfile，同名阶段跨轮累积，
+    dump_profiles()写出<profile_dir>/<phase>.prof，可用pstats或snakeviz查看。
+    cProfile只分析调用线程，max_workers > 1时工作线程中的调用只体现为等待时间。
+    """
+    def __init__(self, registry: Optional[MetricsRegistry] = None, profile_dir: Optional[str] = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.profile_dir = profile_dir
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        registry = self.registry
+        registry.describe("werewolf_llm_calls", "Agent calls by phase, model, source and outcome")
+        registry.describe("werewolf_llm_call_seconds", "Agent call latency in seconds", LATENCY_BUCKETS)
+        registry.describe("werewolf_llm_prompt_tokens", "Prompt tokens reported by the API usage field")
+        registry.describe("werewolf_llm_completion_tokens", "Completion tokens reported by the API usage field")
+        registry.describe("werewolf_llm_prompt_tokens_per_call", "Prompt tokens per call", TOKEN_BUCKETS)
+        registry.describe("werewolf_llm_retries", "Retried attempts before a call succeeded")
+        registry.describe("werewolf_llm_cache_hits", "Calls answered from the response cache")
+        registry.describe("werewolf_parse_fallbacks", "Replies whose target id could not be parsed")
+        registry.describe("werewolf_phase_seconds", "Wall time per phase in seconds", PHASE_BUCKETS)
+        registry.describe("werewolf_round_seconds", "Wall time per round (night and day) in seconds", PHASE_BUCKETS)
+        registry.describe("werewolf_games", "Finished games by result")
+
+    def record_call(self, phase: str, model: str, source: str, latency: float, completion=None,
+                    error: Optional[BaseException] = None):
+        """
+        记录一次调用。completion为llm_client.Completion（仅真实LLM调用有），error为失败时的异常。
+        """
+        registry = self.registry
+        labels = {"phase": phase, "model": model, "source": source}
+        registry.inc("werewolf_llm_calls", dict(labels, outcome="error" if error is not None else "ok"))
+        registry.observe("werewolf_llm_call_seconds", latency, labels)
+        if completion is None:
+            return
+        usage = {"phase": phase, "model": model}
+        if completion.cached:
+            registry.inc("werewolf_llm_cache_hits", usage)
+            return
+        registry.inc("werewolf_llm_prompt_tokens", usage, completion.prompt_tokens)
+        registry.inc("werewolf_llm_completion_tokens", usage, completion.completion_tokens)
+        registry.observe("werewolf_llm_prompt_tokens_per_call", completion.prompt_tokens, usage)
+        if completion.attempts > 1:
+            registry.inc("werewolf_llm_retries", usage, completion.attempts - 1)
+
+    def record_fallback(self, phase: str, model: str):
+        self.registry.inc("werewolf_parse_fallbacks", {"phase": phase, "model": model})
+
+    def record_round(self, round_num: int, seconds: float):
+        self.registry.observe("werewolf_round_seconds", seconds, {"round": round_num})
+
+    def record_game(self, result: str):
+        self.registry.inc("werewolf_games", {"result": result or "unfinished"})
+
+    @contextlib.contextmanager
+    def phase(self, name: str, round_num: int, profile: bool = False):
+        """
+        计时一个阶段。profile=True且设置了profile_dir时同时用cProfile分析（不要嵌套使用）。
+        """
+        profiler = None
+        if profile and self.profile_dir is not None:
+            profiler = self.profiles.get(name)
+            if profiler is None:
+                profiler = self.profiles[name] = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            self.registry.observe("werewolf_phase_seconds", elapsed, {"phase": name})
+
+    def dump_profiles(self) -> List[str]:
+        """
+        写出每个阶段累积的cProfile数据，返回文件路径。
+        """
+        if self.profile_dir is None:
+            return []
+        os.makedirs(self.profile_dir, exist_ok=True)
+        paths = []
+        for name, profiler in self.profiles.items():
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def summary(self) -> dict:
+        """
+        人可读的摘要：各阶段调用次数、延迟分位数（按桶估计）、token合计和解析回退次数。
+        """
+        registry = self.registry
+        merged: Dict[str, Histogram] = {}
+        for key, histogram in registry.histograms.get("werewolf_llm_call_seconds", {}).items():
+            phase = dict(key)["phase"]
+            if phase in merged:
+                merged[phase].merge(histogram)
+            else:
+                merged[phase] = Histogram.from_dict(histogram.to_dict())
+        calls = {phase: {"calls": h.count, "seconds": round(h.sum, 4), "p50": round(h.quantile(0.5), 4),
+                         "p95": round(h.quantile(0.95), 4)} for phase, h in merged.items()}
+        tokens = {"prompt": 0, "completion": 0}
+        for value in registry.counters.get("werewolf_llm_prompt_tokens", {}).values():
+            tokens["prompt"] += value
+        for value in registry.counters.get("werewolf_llm_completion_tokens", {}).values():
+            tokens["completion"] += value
+        fallbacks: Dict[str, float] = {}
+        for key, value in registry.counters.get("werewolf_parse_fallbacks", {}).items():
+            phase = dict(key)["phase"]
+            fallbacks[phase] = fallbacks.get(phase, 0) + value
+        phases = {dict(key)["phase"]: {"count": h.count, "seconds": round(h.sum, 4)}
+                  for key, h in registry.histograms.get("werewolf_phase_seconds", {}).items()}
+        return {"calls": calls, "tokens": tokens, "parse_fallbacks": fallbacks, "phases": phases}
@@ -1,17 +1,22 @@
 from roles import Role
-from typing import Optional, List, Dict
-from llm_api import call_llm_api
+from typing import Callable, Optional, List, Dict
+from llm_api import MODEL_NAME, acall_llm_completion, call_llm_api, call_llm_completion
+from llm_client import Completion
+from decoding import DecodingProfile
 
 class Player:
     """
     玩家基础类，包含ID、角色、存活状态等属性。
+    存活状态由game_state.GameState统一维护，引擎中不要直接修改is_alive。
     """
+    __slots__ = ("player_id", "role", "is_alive", "is_protected", "extra_info")
+
     def __init__(self, player_id: int, role: Role):
         self.player_id = player_id
         self.role = role
         self.is_alive = True
         self.is_protected = False  # 是否被守卫保护
-        self.extra_info: Dict = {}  # 角色特有信息
+        self.extra_info: Dict = {}  # 扩展角色的特有信息（女巫、预言家的状态见game_state）
 
     def __repr__(self):
         return f"Player({self.player_id}, {self.role}, Alive={self.is_alive})"
@@ -20,9 +25,43 @@ class LLMPlayerAgent(Player):
     """
     LLM玩家代理类，负责与LLM API交互，生成发言、投票等。
     """
-    def __init__(self, player_id: int, role: Role, name: Optional[str] = None):
+    __slots__ = ("name", "model")
+
+    def __init__(self, player_id: int, role: Role, name: Optional[str] = None, model: Optional[str] = None):
         super().__init__(player_id, role)
         self.name = name or f"Player{player_id}"
+        self.model = model  # None表示使用llm_api中的默认模型
+
+    def complete(self, prompt: str, profile: Optional[DecodingProfile] = None,
+                 choices: Optional[List[str]] = None, model: Optional[str] = None,
+                 on_token: Optional[Callable[[Optional[str]], None]] = None) -> Completion:
+        """
+        调用LLM并返回带用量、延迟和重试次数的Completion（引擎的埋点使用）。
+        profile为该类调用的解码配置（见decoding.py），choices为允许的回答；结构化回复会还原为纯文本答案，
+        多个采样回答按多数票合并。model不为None时代替座位的模型（如预算降级，见budget.py）。
+        on_token不为None时流式生成，逐段回调（见LLMClient.complete）。
+        """
+        model = model or self.model
+        stream = {"on_token": on_token} if on_token is not None else {}
+        if profile is None:
+            return call_llm_completion(prompt, model=model, **stream)
+        completion = call_llm_completion(prompt, model=model, **stream,
+                                         **profile.request_params(choices, model or MODEL_NAME))
+        return profile.finish(completion, choices)
+
+    async def acomplete(self, prompt: str, profile: Optional[DecodingProfile] = None,
+                        choices: Optional[List[str]] = None, model: Optional[str] = None,
+                        on_token: Optional[Callable[[Optional[str]], None]] = None) -> Completion:
+        """
+        complete()的异步版本（异步引擎使用）。
+        """
+        model = model or self.model
+        stream = {"on_token": on_token} if on_token is not None else {}
+        if profile is None:
+            return await acall_llm_completion(prompt, model=model, **stream)
+        completion = await acall_llm_completion(prompt, model=model, **stream,
+                                                **profile.request_params(choices, model or MODEL_NAME))
+        return profile.finish(completion, choices)
 
     def make_speech(self, game_history: List[Dict], prompt_template: str) -> str:
         """
@@ -32,7 +71,7 @@ class LLMPlayerAgent(Player):
         """
         # prompt_template 已经格式化好，直接用
         prompt = prompt_template
-        response = call_llm_api(prompt)
+        response = call_llm_api(prompt, model=self.model)
         return response
 
     def vote(self, candidates: List[int], game_history: List[Dict], prompt_template: str) -> int:
@@ -42,7 +81,14 @@ class LLMPlayerAgent(Player):
         prompt_template: 英文prompt模板（已格式化）
         """
         prompt = prompt_template
-        response = call_llm_api(prompt)
+        response = call_llm_api(prompt, model=self.model)
+        return self.parse_vote(response, candidates)
+
+    @staticmethod
+    def parse_vote(response: str, candidates: List[int]) -> int:
+        """
+        把LLM回复解析为投票目标。
+        """
         # 假设返回的是被投票玩家ID
         try:
             vote_id = int(response)
@@ -0,0 +1,174 @@
+# 确定性回放：用已有日志（如game_log_gpt-4o.json）中记录的回复驱动GameEngine，不调用任何API。
+# Deterministic zero-cost replay of a recorded game log.
+#
+# 运行：python replay.py game_log_gpt-4o.json
+# 回放完成后对比重新生成的logs与原日志，引擎改动后可用来确认对局结果不变。
+
+import argparse
+import json
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from compact_log import load_log
+from event_sink import QUIET, VERBOSE
+from game_engine import GameEngine, LLMCall
+from llm_client import LLMError
+from logger import GameLogger
+from roles import Role
+
+
+class ReplayMissError(LLMError):
+    """
+    日志中找不到与本次调用对应的回复，说明引擎的调用序列已经和录制时不同。
+    """
+
+
+def detect_language(log: dict) -> str:
+    """
+    根据记录的prompt判断对局语言。
+    """
+    for entry in log.get("detailed_prompts", []):
+        if entry.get("phase") == "day_speech":
+            return 'zh' if entry["prompt"].startswith("身份：") else 'en'
+    return 'en'
+
+
+class ReplaySource:
+    """
+    按调用取回录制的回复。优先按完整prompt精确匹配；prompt变了（例如修改了模板）时，
+    退回到按(player_id, round, phase)顺序匹配。每条记录只会被使用一次。
+    """
+    def __init__(self, log: dict):
+        self.log = log
+        self.entries = log.get("detailed_prompts", [])
+        self._by_prompt: Dict[str, deque] = {}
+        self._by_key: Dict[Tuple[int, int, str], deque] = {}
+        for index, entry in enumerate(self.entries):
+            self._by_prompt.setdefault(entry["prompt"], deque()).append(index)
+            key = (int(entry["player_id"]), int(entry["round"]), entry["phase"])
+            self._by_key.setdefault(key, deque()).append(index)
+        self._used = set()
+        self.exact_hits = 0
+        self.key_hits = 0
+
+    @classmethod
+    def load(cls, path: str) -> "ReplaySource":
+        """
+        读取普通或紧凑格式（compact_log）的日志。
+        """
+        return cls(load_log(path))
+
+    def roles(self) -> List[Role]:
+        """
+        按座位顺序返回录制时的身份。
+        """
+        roles = self.log["roles"]
+        return [Role(roles[str(i)] if str(i) in roles else roles[i]) for i in range(len(roles))]
+
+    def _take(self, queue: Optional[deque]) -> Optional[int]:
+        while queue:
+            index = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return index
+        return None
+
+    def __call__(self, call: LLMCall, round_num: int) -> str:
+        index = self._take(self._by_prompt.get(call.prompt))
+        if index is not None:
+            self.exact_hits += 1
+        else:
+            index = self._take(self._by_key.get((call.player.player_id, round_num, call.phase)))
+            if index is None:
+                raise ReplayMissError(
+                    f"no recorded response for player {call.player.player_id}, round {round_num}, phase {call.phase}")
+            self.key_hits += 1
+        return str(self.entries[index]["response"])
+
+    @property
+    def unused(self) -> int:
+        return len(self.entries) - len(self._used)
+
+
+def _normalize(value):
+    # 保存到JSON后dict的整数键会变成字符串，比较前统一经过一次序列化
+    return json.loads(json.dumps(value, ensure_ascii=False))
+
+
+def compare_logs(expected: List[dict], actual: List[dict]) -> List[dict]:
+    """
+    逐条对比两份logs，返回差异列表（为空表示完全一致）。
+    """
+    expected, actual = _normalize(expected), _normalize(actual)
+    diffs = []
+    for index in range(max(len(expected), len(actual))):
+        left = expected[index] if index < len(expected) else None
+        right = actual[index] if index < len(actual) else None
+        if left != right:
+            diffs.append({"index": index, "expected": left, "actual": right})
+    return diffs
+
+
+class ReplayResult:
+    """
+    一次回放的结果。
+    """
+    def __init__(self, engine: GameEngine, source: ReplaySource, diffs: List[dict], error: Optional[LLMError]):
+        self.engine = engine
+        self.source = source
+        self.diffs = diffs
+        self.error = error
+
+    @property
+    def matched(self) -> bool:
+        return self.error is None and not self.diffs and self.engine.logger.result == self.source.log.get("result")
+
+    def summary(self) -> dict:
+        return {
+            "matched": self.matched,
+            "expected_result": self.source.log.get("result"),
+            "actual_result": self.engine.logger.result,
+            "exact_prompt_hits": self.source.exact_hits,
+            "fallback_hits": self.source.key_hits,
+            "unused_responses": self.source.unused,
+            "log_diffs": len(self.diffs),
+            "first_diff": self.diffs[0] if self.diffs else None,
+            "error": f"{type(self.error).__name__}: {self.error}" if self.error else None,
+        }
+
+
+def replay_game(log, max_workers: int = 1, quiet: bool = True) -> ReplayResult:
+    """
+    回放一局已记录的游戏。log可以是日志文件路径或已加载的dict。
+    """
+    source = ReplaySource.load(log) if isinstance(log, str) else ReplaySource(log)
+    roles = source.roles()
+    role_distribution: Dict[Role, int] = {}
+    for role in roles:
+        role_distribution[role] = role_distribution.get(role, 0) + 1
+    engine = GameEngine(len(roles), role_distribution, language=detect_language(source.log),
+                        max_workers=max_workers, responder=source,
+                        logger=GameLogger(verbosity=QUIET if quiet else VERBOSE))
+    error = None
+    try:
+        engine.run(roles=roles)
+    except ReplayMissError as e:
+        error = e
+    diffs = compare_logs(source.log.get("logs", []), engine.logger.logs)
+    return ReplayResult(engine, source, diffs, error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded game log without calling the LLM API")
+    parser.add_argument("logs", nargs="+", help="game_log_*.json")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--save", default=None, help="把回放生成的日志保存到该文件（只回放一个日志时）")
+    args = parser.parse_args()
+    all_matched = True
+    for path in args.logs:
+        result = replay_game(path, max_workers=args.max_workers)
+        all_matched = all_matched and result.matched
+        print(path, json.dumps(result.summary(), ensure_ascii=False))
+        if args.save and len(args.logs) == 1:
+            result.engine.logger.save(args.save)
+    raise SystemExit(0 if all_matched else 1)
@@ -0,0 +1,191 @@
+# 反事实推演：从对局中途的阶段边界分叉（GameEngine.fork），用不同的agent后端、随机种子或改写的某次决策
+# 并行续完多个分支，汇总各分支的结局分布。分叉点之前的部分可以由录制的日志零成本回放得到，不再重复付费。
+# Fork-and-rollout of counterfactual continuations from a mid-game state.
+#
+# 运行：python rollout.py game_log_gpt-4o-mini.json --round 2 --phase night --games 200 --agents heuristic
+#       python rollout.py game_log_gpt-4o-mini.json --round 2 --phase night --games 200 --agents heuristic \
+#           --set 2:night_witch_poison=4          # 对比：假如第2晚女巫毒了4号
+#       python rollout.py game_log_gpt-4o-mini.json --round 2 --phase day --games 20 --agents llm --workers 16
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+
+from agents import AgentBackend, LLMAgent, ScriptedAgent, make_agent
+from balance import wilson_interval
+from compact_log import load_log
+from event_sink import QUIET
+from game_engine import GameEngine
+from logger import GameLogger
+from replay import ReplaySource, detect_language
+from roles import Role
+
+WOLVES_WIN, VILLAGERS_WIN = "Wolves win!", "Villagers win!"
+
+
+def replay_until(log, round_num: int, phase: str, **engine_kwargs) -> GameEngine:
+    """
+    用录制的回复（见replay.py）把一局已有的对局回放到第round_num轮的phase阶段之前，返回停在该处的引擎。
+    log为日志路径或已加载的dict；engine_kwargs为需要与原对局一致的其他配置（如lobby、decoding）。
+    """
+    source = ReplaySource(load_log(log) if isinstance(log, str) else log)
+    roles = source.roles()
+    role_distribution: Dict[Role, int] = {}
+    for role in roles:
+        role_distribution[role] = role_distribution.get(role, 0) + 1
+    kwargs = dict(language=detect_language(source.log), logger=GameLogger(verbosity=QUIET))
+    kwargs.update(engine_kwargs)
+    engine = GameEngine(len(roles), role_distribution, responder=source, **kwargs)
+    if not engine.run_until(round_num, phase, roles=roles):
+        raise ValueError(f"the recorded game ended before round {round_num} {phase}")
+    # 分支不再使用录制的回复
+    engine.responder = None
+    return engine
+
+
+class _Intervention(ScriptedAgent):
+    """
+    改写个别决策的后端：脚本覆盖的调用按脚本回答，其余交给座位原来的后端。
+    名字沿用原后端，统计和模型标记不因改写而变化。
+    """
+    def __init__(self, script: Dict, fallback: AgentBackend):
+        super().__init__(script, fallback)
+        self.name = fallback.name
+
+
+class Branch:
+    """
+    一组续局的配置。
+    agents：后端名、后端对象或座位 -> 后端，None沿用分叉引擎的后端
+    script：改写的决策，键为(轮次, 阶段, 座位)、(轮次, 阶段)或阶段名（见agents.ScriptedAgent）
+    engine_kwargs：传给GameEngine.fork的其他配置（如decoding、wolf_council）
+    """
+    def __init__(self, name: str, agents: Union[str, AgentBackend, Dict[int, AgentBackend], None] = None,
+                 script: Optional[Dict] = None, **engine_kwargs):
+        self.name = name
+        self.agents = agents
+        self.script = script
+        self.engine_kwargs = engine_kwargs
+
+    def backends(self, engine: GameEngine):
+        agents = make_agent(self.agents) if isinstance(self.agents, str) else self.agents
+        if agents is None:
+            agents = engine.agents
+        if not self.script:
+            return agents
+        if isinstance(agents, dict):
+            return {pid: _Intervention(self.script, agents.get(pid) or LLMAgent()) for pid in range(engine.num_players)}
+        return _Intervention(self.script, agents or LLMAgent())
+
+
+def outcome(engine: GameEngine) -> dict:
+    """
+    一个分支的结局：结果、进行到的轮数和存活的座位。
+    """
+    return {"result": engine.logger.result, "rounds": engine.round,
+            "alive": [p.player_id for p in engine.players if p.is_alive]}
+
+
+def _continue(engine: GameEngine) -> dict:
+    engine.resume()
+    return outcome(engine)
+
+
+def summarize(outcomes: List[dict], num_players: int) -> dict:
+    """
+    汇总一组结局：各结果的次数、狼人胜率及其Wilson置信区间、平均轮数、每个座位的存活率。
+    """
+    games = len(outcomes)
+    results: Dict[str, int] = {}
+    for item in outcomes:
+        results[item["result"]] = results.get(item["result"], 0) + 1
+    wolf_wins = results.get(WOLVES_WIN, 0)
+    low, high = wilson_interval(wolf_wins, games)
+    survival = [0] * num_players
+    for item in outcomes:
+        for pid in item["alive"]:
+            survival[pid] += 1
+    return {
+        "games": games,
+        "results": results,
+        "wolf_win_rate": round(wolf_wins / games, 4) if games else None,
+        "wolf_win_ci": [round(low, 4), round(high, 4)],
+        "avg_rounds": round(sum(item["rounds"] for item in outcomes) / games, 3) if games else None,
+        "survival": {pid: round(count / games, 4) for pid, count in enumerate(survival)} if games else {},
+    }
+
+
+def rollout(engine: GameEngine, branches: Optional[List[Branch]] = None, games: int = 100, seed: int = 0,
+            workers: int = 8, processes: bool = False) -> dict:
+    """
+    从engine当前的阶段边界为每个分支续完games局（第i局用种子seed + i，不同分支的同一局种子相同），返回各分支的
+    结局汇总，多个分支时附带相对第一个分支（基线）的狼人胜率差。
+    默认在线程池中运行：分支与engine共享历史（写时复制），适合调用LLM的续局。processes=True时把每个分支的引擎
+    pickle到进程池中运行，适合CPU密集的agent后端；此时分支的后端和脚本必须可pickle（不能用lambda）。
+    """
+    if games < 1:
+        raise ValueError("games must be at least 1")
+    branches = branches or [Branch("baseline")]
+    forks = []
+    for branch in branches:
+        agents = branch.backends(engine)
+        forks.extend((branch.name, engine.fork(seed=seed + i, agents=agents, **branch.engine_kwargs))
+                     for i in range(games))
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(max_workers=max(1, workers)) as pool:
+        outcomes = list(pool.map(_continue, [child for _, child in forks]))
+    by_branch: Dict[str, List[dict]] = {branch.name: [] for branch in branches}
+    for (name, _), item in zip(forks, outcomes):
+        by_branch[name].append(item)
+    summary = {
+        "fork": {"round": engine.round + 1 if engine.next_phase == "night" else engine.round,
+                 "phase": engine.next_phase,
+                 "alive": [p.player_id for p in engine.players if p.is_alive]},
+        "branches": {name: summarize(items, engine.num_players) for name, items in by_branch.items()},
+    }
+    if len(branches) > 1:
+        base = summary["branches"][branches[0].name]["wolf_win_rate"]
+        for name, data in summary["branches"].items():
+            data["wolf_win_rate_delta"] = round(data["wolf_win_rate"] - base, 4)
+    return summary
+
+
+def parse_set(text: str) -> tuple:
+    """
+    解析--set：轮次:阶段[:座位]=回复，如 2:night_witch_poison=4、1:day_vote:3=5。
+    """
+    key, value = text.split("=", 1)
+    parts = key.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"expected ROUND:PHASE[:PLAYER]=VALUE, got {text!r}")
+    return tuple([int(parts[0]), parts[1]] + [int(p) for p in parts[2:]]), value
+
+
+if __name__ == "__main__":
+    from agents import AGENTS
+
+    parser = argparse.ArgumentParser(description="Fork a recorded game at a phase boundary and roll out continuations")
+    parser.add_argument("log", help="录制的对局日志（普通或紧凑格式）")
+    parser.add_argument("--round", type=int, required=True)
+    parser.add_argument("--phase", choices=["night", "day"], required=True, help="在该阶段开始之前分叉")
+    parser.add_argument("--games", type=int, default=100, help="每个分支续完的局数")
+    parser.add_argument("--agents", default="heuristic", choices=sorted(AGENTS), help="续局使用的后端（llm为调用LLM）")
+    parser.add_argument("--set", action="append", type=parse_set, default=[], metavar="ROUND:PHASE[:PLAYER]=VALUE",
+                        help="改写的决策；指定后与不改写的基线分支对比")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", action="store_true", help="在进程池中运行（CPU密集的agent后端）")
+    parser.add_argument("--out", default=None, help="把汇总写入该JSON文件")
+    args = parser.parse_args()
+    base_engine = replay_until(args.log, args.round, args.phase)
+    run_branches = [Branch("baseline", agents=args.agents)]
+    if args.set:
+        run_branches.append(Branch("intervention", agents=args.agents, script=dict(args.set)))
+    report = rollout(base_engine, run_branches, games=args.games, seed=args.seed, workers=args.workers,
+                     processes=args.processes)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
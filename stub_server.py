@@ -0,0 +1,327 @@
+# 本地OpenAI兼容的stub服务器，用于在不联网的情况下测试吞吐量。
+# Local OpenAI-compatible stub server for offline throughput testing.
+#
+# 运行：python stub_server.py --port 8000 --latency 0.2
+# 然后设置 OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=stub 运行main.py。
+# 吞吐测试：python stub_server.py --bench 500 --concurrency 32
+# 模拟单块推理卡（批处理）：python stub_server.py --port 8000 --device --latency 0.05 --item-latency 0.002
+# 故障注入：python stub_server.py --port 8000 --latency 0.2 --spike-rate 0.05 --spike-latency 5 --error-rate 0.01
+# 流式发言（stream=true，见live_feed.py）：python stub_server.py --port 8000 --token-latency 0.03
+#   /v1/completions 的prompt可以是列表，一次请求生成整批，耗时为 latency + item_latency * 批大小
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+_CANDIDATES_RE = re.compile(r'(?:candidates=|Alive players[^:\[]*: |存活玩家有：)\[([\d, ]*)\]')
+
+STUB_SPEECH = (
+    "I have been listening carefully. Some players were vague yesterday, "
+    "so I would like everyone to explain their votes before we decide."
+)
+
+
+def stub_reply(prompt: str, rng: random.Random) -> str:
+    """
+    根据prompt类型生成一个合法的回复：决策类返回候选id，女巫解药返回yes/no，其余返回一段发言。
+    """
+    if "'yes' or 'no'" in prompt:
+        return rng.choice(["yes", "no"])
+    match = _CANDIDATES_RE.search(prompt)
+    if match and match.group(1).strip():
+        candidates = [int(x) for x in match.group(1).split(",")]
+        if "return 'no'" in prompt and rng.random() < 0.5:
+            return "no"
+        return str(rng.choice(candidates))
+    return STUB_SPEECH
+
+
+class StubState:
+    """
+    服务器配置与统计信息，所有请求处理线程共享。
+    device=True时所有生成都经过同一个模拟的推理设备（一次只处理一个请求），
+    每个请求耗时 latency + item_latency * 批大小，因此批量越大吞吐越高。
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None,
+                 item_latency: float = 0.0, device: bool = False, spike_rate: float = 0.0,
+                 spike_latency: float = 0.0, error_rate: float = 0.0, token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency  # 流式请求（stream=true）中每段token之间的间隔（秒）
+        self.jitter = jitter
+        # 故障注入：按比例出现的延迟尖峰和500错误，用于测试对冲与熔断（见llm_hedge.py）
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.error_rate = error_rate
+        self.item_latency = item_latency
+        self.device = threading.Lock() if device else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.batches = 0  # /v1/completions的请求数
+        self.batched_prompts = 0
+        self.spikes = 0
+        self.errors = 0
+
+    def sample_latency(self) -> float:
+        with self.lock:
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            if self.spike_rate and self.rng.random() < self.spike_rate:
+                self.spikes += 1
+                delay += self.spike_latency
+            return delay
+
+    def fail(self) -> bool:
+        """
+        按error_rate决定本次请求是否返回500。
+        """
+        with self.lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def generate(self, batch_size: int = 1):
+        """
+        模拟一次（批量）生成的耗时。
+        """
+        delay = self.sample_latency() + self.item_latency * batch_size
+        if self.device is not None:
+            with self.device:
+                time.sleep(delay)
+        else:
+            time.sleep(delay)
+
+    def reply(self, prompt: str) -> str:
+        with self.lock:
+            self.requests += 1
+            return stub_reply(prompt, self.rng)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "connections": self.connections,
+                    "batches": self.batches, "batched_prompts": self.batched_prompts,
+                    "spikes": self.spikes, "errors": self.errors}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 + Content-Length，客户端可以复用连接
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已超时断开
+            self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.state.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        # 先读完请求体，保证keep-alive连接上的下一个请求不会错位
+        request = self._read_json()
+        path = self.path.rstrip("/")
+        if path.endswith("/v1/completions") or path == "/completions":
+            self._completions(request)
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        prompt = "".join(m.get("content") or "" for m in request.get("messages", []))
+        if self.state.fail():
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+        n = max(1, int(request.get("n") or 1))
+        self.state.generate(n)
+        texts = [self.state.reply(prompt) for _ in range(n)]
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = sum(max(1, len(text) // 4) for text in texts)
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._send_stream(request, texts, (prompt_tokens, completion_tokens) if include_usage else None)
+            return
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": i,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            } for i, text in enumerate(texts)],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send_stream(self, request: dict, texts: list, usage: Optional[tuple]):
+        """
+        以SSE分块返回chat.completion.chunk：每个词一块，间隔token_latency秒；usage不为None时最后附带用量。
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": request.get("model", "stub")}
+
+        def send(data: str):
+            body = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i, text in enumerate(texts):
+                for piece in re.findall(r"\S+\s*", text):
+                    if self.state.token_latency:
+                        time.sleep(self.state.token_latency)
+                    send(json.dumps(dict(base, choices=[{"index": i, "delta": {"content": piece},
+                                                         "finish_reason": None}]), ensure_ascii=False))
+            send(json.dumps(dict(base, choices=[{"index": i, "delta": {}, "finish_reason": "stop"}
+                                                for i in range(len(texts))])))
+            if usage is not None:
+                send(json.dumps(dict(base, choices=[], usage={"prompt_tokens": usage[0], "completion_tokens": usage[1],
+                                                              "total_tokens": usage[0] + usage[1]})))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _completions(self, request: dict):
+        """
+        旧版补全接口，prompt可以是字符串或字符串列表（批量），choices[i].index对应第i个prompt。
+        """
+        prompts = request.get("prompt", "")
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        n = max(1, int(request.get("n") or 1))
+        self.state.generate(len(prompts) * n)
+        with self.state.lock:
+            self.state.batches += 1
+            self.state.batched_prompts += len(prompts)
+        choices = []
+        prompt_tokens = completion_tokens = 0
+        for i, prompt in enumerate(prompts):
+            prompt_tokens += max(1, len(prompt) // 4)
+            for j in range(n):
+                text = self.state.reply(prompt)
+                completion_tokens += max(1, len(text) // 4)
+                choices.append({"index": i * n + j, "text": text, "finish_reason": "stop", "logprobs": None})
+        self._send_json(200, {
+            "id": f"cmpl-{uuid.uuid4().hex}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # 客户端放弃请求（超时、对冲中较慢的请求）时断开连接属于正常情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **state_kwargs):
+    """
+    在后台线程启动stub服务器，返回(server, base_url)。port=0表示随机端口。
+    """
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(**state_kwargs)})
+    server = StubHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+def run_bench(num_requests: int, concurrency: int, latency: float):
+    """
+    用共享LLMClient对本地stub做吞吐测试，打印请求速率和实际建立的TCP连接数。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from llm_client import LLMClient
+
+    server, base_url = start_stub_server(latency=latency, seed=0)
+    client = LLMClient(api_key="stub", base_url=base_url, model="stub", max_concurrency=concurrency)
+    prompt = "Vote to eliminate one player from candidates=[0, 1, 2, 3]. Return the player id only."
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: client.complete(prompt), range(num_requests)))
+    elapsed = time.monotonic() - start
+    stats = server.RequestHandlerClass.state.stats()
+    print(f"{num_requests} requests in {elapsed:.2f}s ({num_requests / elapsed:.1f} req/s), "
+          f"concurrency={concurrency}, latency={latency}s, tcp connections={stats['connections']}")
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的均匀抖动范围（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--item-latency", type=float, default=0.0, help="批量生成时每个prompt增加的延迟（秒）")
+    parser.add_argument("--device", action="store_true", help="模拟单个推理设备：请求串行处理，批量请求一次生成整批")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="出现延迟尖峰的请求比例")
+    parser.add_argument("--spike-latency", type=float, default=0.0, help="尖峰请求额外增加的延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500错误的请求比例")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="流式请求中每段token之间的间隔（秒）")
+    parser.add_argument("--bench", type=int, default=0, help="运行N个请求的吞吐测试后退出")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    if args.bench:
+        run_bench(args.bench, args.concurrency, args.latency)
+    else:
+        server, base_url = start_stub_server(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                                             seed=args.seed, item_latency=args.item_latency, device=args.device,
+                                             spike_rate=args.spike_rate, spike_latency=args.spike_latency,
+                                             error_rate=args.error_rate, token_latency=args.token_latency)
+        print(f"Stub OpenAI server listening on {base_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
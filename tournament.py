@@ -0,0 +1,354 @@
+# 多局批量对战：在进程池中并行运行N局游戏，每局有独立的随机种子，结果边跑边写入磁盘。
+# Multi-game tournament runner across a worker process pool.
+#
+# 示例：
+#   python tournament.py --games 200 --workers 8 --players 10 \
+#       --roles WOLF=2,SEER=1,WITCH=1,HUNTER=1,VILLAGER=5 \
+#       --models gpt-4o,gpt-4o-mini --seed 42 --out tournament_out
+#   python tournament.py --games 200 --budget-soft 0.05 --budget-hard 0.10 --batch-budget-hard 5
+#   python tournament.py --games 20 --players 100 --lobby --agents heuristic     # 大厅模式（见lobby.py）
+
+import argparse
+import json
+import os
+import signal
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from roles import Role, get_role_info
+from metrics import GameMetrics, MetricsRegistry
+from budget import BudgetLedger
+
+RESULT_CAMPS = {
+    "Villagers win!": "好人阵营",
+    "Wolves win!": "狼人阵营",
+}
+
+
+class GameTimeout(BaseException):
+    """
+    单局游戏超过时间限制。继承BaseException，避免被LLM客户端的重试逻辑当作普通错误吞掉。
+    """
+
+
+def default_role_distribution(num_players: int) -> Dict[Role, int]:
+    """
+    按人数给出默认身份配置：约1/4狼人，6人及以上配预言家、女巫、猎人，其余为平民。
+    10人时与main.py中的配置一致。
+    """
+    wolves = max(1, num_players // 4)
+    distribution = {Role.WOLF: wolves}
+    specials = [Role.SEER, Role.WITCH, Role.HUNTER] if num_players >= 6 else [Role.SEER]
+    for role in specials:
+        distribution[role] = 1
+    distribution[Role.VILLAGER] = num_players - wolves - len(specials)
+    return distribution
+
+
+def parse_role_distribution(text: str) -> Dict[Role, int]:
+    """
+    解析 "WOLF=2,SEER=1,VILLAGER=5" 形式的身份配置。
+    """
+    distribution = {}
+    for item in text.split(","):
+        name, _, count = item.partition("=")
+        distribution[Role[name.strip().upper()]] = int(count)
+    return distribution
+
+
+def assign_models(models: List[str], num_players: int) -> Dict[int, str]:
+    """
+    把模型列表循环分配到各个座位。
+    """
+    if not models:
+        return {}
+    return {i: models[i % len(models)] for i in range(num_players)}
+
+
+def _alarm_handler(signum, frame):
+    raise GameTimeout()
+
+
+def play_game(spec: dict) -> dict:
+    """
+    工作进程入口：运行一局游戏并返回结果记录。任何异常都被捕获并记录，不会影响其他对局。
+    """
+    from game_engine import GameEngine
+    from logger import GameLogger
+    from event_sink import QUIET
+    from agents import assign_agents
+    from budget import BudgetGovernor, load_prices
+    from lobby import LobbyConfig
+
+    started = time.time()
+    record = {
+        "game_id": spec["game_id"],
+        "seed": spec["seed"],
+        "status": "ok",
+        "result": None,
+        "winner": None,
+        "roles": None,
+        "models": None,
+        "rounds": 0,
+    }
+    engine = None
+    use_alarm = spec.get("timeout") and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _alarm_handler)
+        signal.setitimer(signal.ITIMER_REAL, spec["timeout"])
+    try:
+        role_distribution = {Role[name]: count for name, count in spec["role_distribution"].items()}
+        # 批量模式下不在终端逐条打印日志；不保存日志时也不在内存中保留详细prompt
+        logger = GameLogger(verbosity=QUIET, keep_prompts=bool(spec.get("log_dir")))
+        budget = None
+        if spec.get("budget"):
+            # 整批用量是提交时的快照，加上本局自己的用量
+            config = dict(spec["budget"])
+            prices_path = config.pop("prices", None)
+            prices = load_prices(prices_path) if prices_path else None
+            batch = BudgetLedger.from_dict(config.pop("batch_spent"), prices)
+            budget = BudgetGovernor(batch=batch, prices=prices, **config)
+        engine = GameEngine(spec["num_players"], role_distribution, language=spec["language"],
+                            max_workers=spec["max_workers"], seed=spec["seed"],
+                            player_models=spec["player_models"], logger=logger,
+                            agents=assign_agents(spec.get("agents") or [], spec["num_players"]),
+                            metrics=GameMetrics() if spec.get("metrics") else None, budget=budget,
+                            lobby=LobbyConfig(**spec["lobby"]) if spec.get("lobby") is not None else None)
+        engine.run()
+        if spec.get("log_dir"):
+            record["log_path"] = os.path.join(spec["log_dir"], f"game_{spec['game_id']:06d}.cjson.gz")
+            engine.logger.save_compact(record["log_path"])
+        record["result"] = engine.logger.result
+        record["winner"] = RESULT_CAMPS.get(engine.logger.result)
+    except GameTimeout:
+        record["status"] = "timeout"
+        record["error"] = f"game exceeded {spec['timeout']}s"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc(limit=5)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    if engine is not None and engine.players:
+        record["roles"] = {p.player_id: p.role.name for p in engine.players}
+        record["models"] = {p.player_id: p.model for p in engine.players if p.model}
+        record["rounds"] = engine.round
+        if engine.metrics is not None:
+            record["metrics"] = engine.metrics.registry.to_dict()
+        if engine.budget is not None:
+            record["budget"] = engine.budget.to_dict()
+    record["duration"] = round(time.time() - started, 3)
+    return record
+
+
+class TournamentStats:
+    """
+    增量汇总对局结果：阵营胜率、各身份胜率、各模型胜率。
+    """
+    def __init__(self):
+        self.games = 0
+        self.status: Dict[str, int] = {}
+        self.camp_wins: Dict[str, int] = {}
+        self.role_games: Dict[str, int] = {}
+        self.role_wins: Dict[str, int] = {}
+        self.model_games: Dict[str, int] = {}
+        self.model_wins: Dict[str, int] = {}
+        self.model_role_games: Dict[str, int] = {}
+        self.model_role_wins: Dict[str, int] = {}
+        self.total_rounds = 0
+
+    @staticmethod
+    def _bump(counter: Dict[str, int], key: str, amount: int = 1):
+        counter[key] = counter.get(key, 0) + amount
+
+    def add(self, record: dict):
+        self.games += 1
+        self._bump(self.status, record["status"])
+        winner = record.get("winner")
+        if record["status"] != "ok" or winner is None:
+            return
+        self._bump(self.camp_wins, winner)
+        self.total_rounds += record["rounds"]
+        models = record.get("models") or {}
+        for pid, role_name in record["roles"].items():
+            won = int(get_role_info(Role[role_name]).get("camp") == winner)
+            self._bump(self.role_games, role_name)
+            self._bump(self.role_wins, role_name, won)
+            model = models.get(pid)
+            if model:
+                self._bump(self.model_games, model)
+                self._bump(self.model_wins, model, won)
+                key = f"{model}/{role_name}"
+                self._bump(self.model_role_games, key)
+                self._bump(self.model_role_wins, key, won)
+
+    @staticmethod
+    def _rates(wins: Dict[str, int], games: Dict[str, int]) -> Dict[str, float]:
+        return {key: round(wins.get(key, 0) / n, 4) for key, n in sorted(games.items()) if n}
+
+    def summary(self) -> dict:
+        finished = sum(self.camp_wins.values())
+        return {
+            "games": self.games,
+            "status": self.status,
+            "camp_win_rate": {camp: round(n / finished, 4) for camp, n in self.camp_wins.items()} if finished else {},
+            "role_win_rate": self._rates(self.role_wins, self.role_games),
+            "model_win_rate": self._rates(self.model_wins, self.model_games),
+            "model_role_win_rate": self._rates(self.model_role_wins, self.model_role_games),
+            "avg_rounds": round(self.total_rounds / finished, 3) if finished else None,
+        }
+
+
+def run_tournament(num_games: int, num_players: int, role_distribution: Dict[Role, int],
+                   models: Optional[List[str]] = None, seed: int = 0, workers: Optional[int] = None,
+                   timeout: Optional[float] = None, language: str = 'en', max_workers: int = 1,
+                   out_dir: str = "tournament_out", save_logs: bool = False,
+                   agents: Optional[List[str]] = None, metrics: bool = False,
+                   budget: Optional[dict] = None, lobby: Optional[dict] = None) -> dict:
+    """
+    在进程池中运行num_games局游戏。第i局的种子为seed+i，因此同样的参数可以复现同样的身份分配。
+    每局结束立即追加到out_dir/results.jsonl，结束后写出out_dir/summary.json。results.jsonl在运行开始时清空，
+    与summary.json、metrics.prom一样只包含本次运行的对局（各次运行的game_id都从0开始，混在一起无法区分）。
+    单局崩溃或超时只记录在该局的结果中；工作进程意外退出时，受影响的对局会在新进程池中重试一次。
+    agents为按座位循环分配的后端名（heuristic / random / llm，见agents.py），不指定时所有座位调用LLM。
+    metrics=True时每局启用性能埋点（见metrics.py），汇总后写出out_dir/metrics.prom，摘要放在summary["metrics"]。
+    budget为BudgetGovernor的参数（soft_limit、hard_limit、unit、batch_soft_limit、batch_hard_limit、degrade、fallback，
+    以及价格表路径prices）。整批用量在主进程中按已结束的对局累计，每局开始时带上当时的快照，
+    因此整批上限对之后开始的对局立即生效，对在途的对局只计入它们自己的用量。汇总放在summary["budget"]。
+    lobby为LobbyConfig的参数，设置时以大厅模式运行（见lobby.py）。
+    """
+    if sum(role_distribution.values()) != num_players:
+        raise ValueError(f"role_distribution has {sum(role_distribution.values())} roles for {num_players} players")
+    os.makedirs(out_dir, exist_ok=True)
+    log_dir = os.path.join(out_dir, "games") if save_logs else None
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    player_models = assign_models(models or [], num_players)
+    specs = [{
+        "game_id": i,
+        "seed": seed + i,
+        "num_players": num_players,
+        "role_distribution": {role.name: count for role, count in role_distribution.items()},
+        "player_models": player_models,
+        "agents": agents or [],
+        "language": language,
+        "max_workers": max_workers,
+        "timeout": timeout,
+        "log_dir": log_dir,
+        "metrics": metrics,
+        "lobby": lobby,
+    } for i in range(num_games)]
+    batch_ledger = BudgetLedger() if budget else None
+    budget_levels: Dict[str, int] = {}
+
+    stats = TournamentStats()
+    registry = MetricsRegistry() if metrics else None
+    attempts: Dict[int, int] = {}
+    pending = list(reversed(specs))
+    with open(os.path.join(out_dir, "results.jsonl"), "w", encoding="utf-8") as results:
+        def record_result(record: dict):
+            if "metrics" in record:
+                registry.merge(MetricsRegistry.from_dict(record.pop("metrics")))
+            if "budget" in record:
+                batch_ledger.merge(record["budget"])
+                level = record["budget"]["level"]
+                budget_levels[level] = budget_levels.get(level, 0) + 1
+            stats.add(record)
+            results.write(json.dumps(record, ensure_ascii=False) + "\n")
+            results.flush()
+
+        while pending:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            running = {}
+            broken = False
+            try:
+                while (pending or running) and not broken:
+                    # 控制在途任务数量，进程池损坏时只影响少量对局
+                    while pending and len(running) < workers * 2:
+                        spec = pending.pop()
+                        attempts[spec["game_id"]] = attempts.get(spec["game_id"], 0) + 1
+                        if budget:
+                            spec["budget"] = dict(budget, batch_spent=batch_ledger.to_dict())
+                        running[executor.submit(play_game, spec)] = spec
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        spec = running.pop(future)
+                        try:
+                            record_result(future.result())
+                        except BrokenProcessPool:
+                            broken = True
+                            if attempts[spec["game_id"]] < 2:
+                                pending.append(spec)
+                            else:
+                                record_result({"game_id": spec["game_id"], "seed": spec["seed"],
+                                               "status": "crashed", "error": "worker process died"})
+                if broken:
+                    # 进程池损坏后其余在途任务也会失败，放回队列重试
+                    for future, spec in running.items():
+                        pending.append(spec)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    summary = stats.summary()
+    if registry is not None:
+        registry.write_textfile(os.path.join(out_dir, "metrics.prom"))
+        summary["metrics"] = GameMetrics(registry).summary()
+    if batch_ledger is not None:
+        summary["budget"] = dict(batch_ledger.to_dict(), levels=budget_levels)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many Werewolf games across a process pool")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--roles", default=None, help="例如 WOLF=2,SEER=1,WITCH=1,HUNTER=1,VILLAGER=5")
+    parser.add_argument("--models", default="", help="逗号分隔的模型列表，按座位循环分配")
+    parser.add_argument("--agents", default="", help="逗号分隔的agent后端（heuristic/random/llm），按座位循环分配")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认CPU核数")
+    parser.add_argument("--timeout", type=float, default=None, help="单局超时（秒）")
+    parser.add_argument("--language", choices=["en", "zh"], default="en")
+    parser.add_argument("--max-workers", type=int, default=1, help="每局内的LLM调用并发数")
+    parser.add_argument("--out", default="tournament_out")
+    parser.add_argument("--save-logs", action="store_true", help="以紧凑格式保存每局的完整日志")
+    parser.add_argument("--metrics", action="store_true", help="记录性能埋点，写出out_dir/metrics.prom")
+    parser.add_argument("--budget-soft", type=float, default=None, help="单局软上限：达到后改用便宜模型")
+    parser.add_argument("--budget-hard", type=float, default=None, help="单局硬上限：达到后改用启发式策略")
+    parser.add_argument("--batch-budget-soft", type=float, default=None, help="整批软上限")
+    parser.add_argument("--batch-budget-hard", type=float, default=None, help="整批硬上限")
+    parser.add_argument("--budget-unit", choices=["usd", "tokens"], default="usd")
+    parser.add_argument("--budget-degrade", choices=["all", "speech", "decision"], default="all",
+                        help="软上限后降级哪些调用")
+    parser.add_argument("--prices", default=None, help="JSON价格表（每百万token美元），覆盖内置价格")
+    parser.add_argument("--lobby", action="store_true", help="大厅模式：分桌讨论、有界视图、多个狼群/预言家/女巫")
+    parser.add_argument("--table-size", type=int, default=10, help="大厅模式每桌人数")
+    parser.add_argument("--speakers", type=int, default=4, help="大厅模式每桌每轮的发言人数")
+    args = parser.parse_args()
+    limits = {"soft_limit": args.budget_soft, "hard_limit": args.budget_hard,
+              "batch_soft_limit": args.batch_budget_soft, "batch_hard_limit": args.batch_budget_hard}
+    budget_config = None
+    if any(v is not None for v in limits.values()):
+        budget_config = dict(limits, unit=args.budget_unit, degrade=args.budget_degrade, prices=args.prices)
+    if args.roles:
+        distribution = parse_role_distribution(args.roles)
+    elif args.lobby:
+        from lobby import lobby_role_distribution
+        distribution = lobby_role_distribution(args.players)
+    else:
+        distribution = default_role_distribution(args.players)
+    summary = run_tournament(args.games, args.players, distribution,
+                             models=[m for m in args.models.split(",") if m], seed=args.seed,
+                             workers=args.workers, timeout=args.timeout, language=args.language,
+                             max_workers=args.max_workers, out_dir=args.out, save_logs=args.save_logs,
+                             agents=[a for a in args.agents.split(",") if a], metrics=args.metrics,
+                             budget=budget_config,
+                             lobby={"table_size": args.table_size, "speakers_per_table": args.speakers} if args.lobby else None)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))